@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks of the hot paths of watchman.
+
+    The guards run against the stand-in commands in ``benchmarks/stubs``,
+    which answer with canned output after a configurable latency. Measured are
+
+    * ``sweep``: wall time of a Patrol sweep over N PingGuards,
+    * ``qstat_check_output``: time and peak memory of QstatFGuard._check_output
+      on complete xml output with 1k to 100k jobs,
+    * ``qstat_guard``: time and peak memory of a whole QstatFGuard watch,
+      where the xml is parsed while it streams in,
+    * ``create_message``: cost of RadioOperator._create_message for N alerts.
+
+    Results are written as JSON, e.g.
+    ``python benchmarks/bench_guards.py --output bench_output.txt``.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import imp
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+
+# measured in a fresh interpreter, so the peak memory is not spoiled by other benchmarks
+_QSTAT_CHILD = """
+import json, resource, sys, time
+from watchman.squad import QstatFGuard
+guard = QstatFGuard('bench')
+if sys.argv[1] == 'check_output':
+    with open(sys.argv[2], 'rb') as xml:
+        out = xml.read()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    alerts = guard._check_output(0, out, '')
+else:
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    alerts = []
+    guard.guard(alerts)
+duration = time.time() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': duration, 'peak_rss_kb': after, 'peak_growth_kb': after - before,
+                  'alerts': len(alerts)}))
+"""
+
+
+def stub_environment(**settings):
+    """
+    Environment which puts the stand-in commands first in the PATH.
+
+    :param settings: WATCHMAN_STUB_* settings without the prefix, e.g. latency=0.1
+    :type settings: dict
+
+    :return: environment
+    :rtype: dict
+    """
+    env = dict(os.environ)
+    env['PATH'] = STUBS + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    for key, value in settings.items():
+        env['WATCHMAN_STUB_' + key.upper()] = str(value)
+    return env
+
+
+def bench_sweep(guard_counts, latency, max_parallel):
+    from watchman.patrol import Patrol
+    from watchman.squad import PingGuard
+
+    results = []
+    saved = dict(os.environ)
+    os.environ.update(stub_environment(latency=latency))
+    try:
+        for count in guard_counts:
+            guards = [PingGuard('PingGuard {:03d}'.format(i), host='ekpblus{:03d}'.format(i)) for i in range(count)]
+            start = time.time()
+            alerts = Patrol(max_parallel=max_parallel).march(guards)
+            results.append({'benchmark': 'sweep',
+                            'params': {'guards': count, 'latency': latency, 'max_parallel': max_parallel},
+                            'seconds': time.time() - start, 'alerts': len(alerts)})
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_qstat(job_counts, queues):
+    qstat = imp.load_source('watchman_stub_qstat', os.path.join(STUBS, 'qstat'))
+    results = []
+    for jobs in job_counts:
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as xml:
+            qstat.write_xml(xml, queues, jobs)
+        try:
+            size = os.path.getsize(xml.name)
+            for mode in ('check_output', 'guard'):
+                env = stub_environment(latency=0, queues=queues, jobs=jobs)
+                out = subprocess.check_output([sys.executable, '-c', _QSTAT_CHILD, mode, xml.name], env=env)
+                result = json.loads(out.decode('utf-8'))
+                result.update({'benchmark': 'qstat_' + mode,
+                               'params': {'jobs': jobs, 'queues': queues, 'xml_bytes': size}})
+                results.append(result)
+        finally:
+            os.remove(xml.name)
+    return results
+
+
+def bench_create_message(alert_counts, repeat):
+    from watchman.squad import RadioOperator
+
+    rto = RadioOperator('bench', from_mail='watchman@example.com', admin_mail='admin@example.com')
+    results = []
+    for count in alert_counts:
+        alerts = [('PingGuard {:03d}'.format(i), ['ping', '-c 4', 'ekpblus{:03d}'.format(i)], 1, '')
+                  for i in range(count)]
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            rto._create_message(alerts).as_string()
+            times.append(time.time() - start)
+        results.append({'benchmark': 'create_message', 'params': {'alerts': count},
+                        'seconds': min(times), 'repeat': repeat})
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', '-o', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--quick', action='store_true', help='small sizes only')
+    parser.add_argument('--latency', type=float, default=0.2, help='latency of the stub commands in seconds')
+    parser.add_argument('--max-parallel', type=int, default=16, help='max_parallel of the Patrol')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    if args.quick:
+        guard_counts, job_counts, alert_counts = [1, 10, 50], [1000, 10000], [10, 1000]
+    else:
+        guard_counts, job_counts, alert_counts = [1, 10, 50, 200, 400], [1000, 10000, 100000], [10, 1000, 100000]
+
+    results = []
+    results += bench_sweep(guard_counts, args.latency, args.max_parallel)
+    results += bench_qstat(job_counts, queues=400)
+    results += bench_create_message(alert_counts, repeat=5)
+
+    report = json.dumps({'meta': {'revision': revision(), 'python': platform.python_version(),
+                                  'host': platform.node(), 'timestamp': time.time()},
+                         'results': results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
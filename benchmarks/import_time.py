@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Import-time benchmark for watchman.
+
+    Measures the wall time of fresh interpreters for ``watchman --help`` and
+    for the start of the daemon (import of ``watchman.cli`` and loading of the
+    default config). With ``--ref`` the same is measured for another git
+    revision, e.g. ``python benchmarks/import_time.py --ref baseline``.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'help': "from watchman.cli import cli\n"
+            "try:\n"
+            "    cli(['--help'])\n"
+            "except SystemExit:\n"
+            "    pass\n",
+    'daemon_start': "import watchman.cli as cli\n"
+                    "config = getattr(cli, '__load_config')({config!r})\n",
+}
+
+
+def measure(source, scenario, repeat):
+    """
+    Run one scenario in fresh interpreters.
+
+    :param source: directory containing the watchman package
+    :type source: str
+
+    :param scenario: name of the scenario
+    :type scenario: str
+
+    :param repeat: number of runs
+    :type repeat: int
+
+    :return: wall times in seconds
+    :rtype: list
+    """
+    code = SCENARIOS[scenario].format(config=os.path.join(source, 'watchman', 'config', 'default.py'))
+    env = dict(os.environ, PYTHONPATH=source)
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', code], env=env, cwd=source,
+                                  stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return times
+
+
+def checkout(ref):
+    """
+    Extract the watchman package of a git revision into a temporary directory.
+
+    :param ref: git revision
+    :type ref: str
+
+    :return: path of the temporary directory
+    :rtype: str
+    """
+    target = tempfile.mkdtemp(prefix='watchman-{}-'.format(ref))
+    archive = subprocess.Popen(['git', 'archive', ref, 'watchman'], cwd=ROOT, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', target], stdin=archive.stdout)
+    archive.stdout.close()
+    if archive.wait() != 0:
+        raise RuntimeError('git archive of {} failed'.format(ref))
+    return target
+
+
+def summary(times):
+    times = sorted(times)
+    return {'median_ms': 1000 * times[len(times) // 2], 'min_ms': 1000 * times[0], 'runs': len(times)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', '-n', type=int, default=10, help='runs per scenario')
+    parser.add_argument('--ref', help='git revision to compare against')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args(argv)
+
+    sources = [('working tree', ROOT)]
+    if args.ref:
+        sources.append((args.ref, checkout(args.ref)))
+
+    results = {}
+    try:
+        for label, source in sources:
+            results[label] = dict((scenario, summary(measure(source, scenario, args.repeat)))
+                                  for scenario in sorted(SCENARIOS))
+    finally:
+        for label, source in sources[1:]:
+            shutil.rmtree(source)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for label, scenarios in sorted(results.items()):
+        for scenario, result in sorted(scenarios.items()):
+            print('{:<16} {:<14} median {:8.1f} ms   min {:8.1f} ms'.format(
+                label, scenario, result['median_ms'], result['min_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,4 +9,59 @@
 """
 from __future__ import print_function, absolute_import, division
 
+import os
+import stat
+
 import pytest
+
+
+class Commands(object):
+    """
+    Stand-ins of the cluster commands on the PATH, each one writes a fixed output and records its calls.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+
+    def add(self, name, output, status=0, delay=0):
+        self._directory.join(name + '.out').write(output)
+        script = self._directory.join(name)
+        script.write('#!/bin/sh\necho "$*" >> "{0}.calls"\nsleep {1}\ncat "{0}.out"\nexit {2}\n'.format(
+            self._directory.join(name), delay, status))
+        script.chmod(script.stat().mode | stat.S_IXUSR)
+
+    def calls(self, name):
+        return len(self.arguments(name))
+
+    def arguments(self, name):
+        calls = self._directory.join(name + '.calls')
+        return [line.rstrip('\n') for line in calls.readlines()] if calls.exists() else []
+
+
+@pytest.fixture
+def commands(tmpdir, monkeypatch):
+    directory = tmpdir.mkdir('bin')
+    monkeypatch.setenv('PATH', '{}{}{}'.format(directory, os.pathsep, os.environ['PATH']))
+    return Commands(directory)
+
+
+@pytest.fixture
+def qstat_xml():
+    """
+    Get a function which writes ``qstat -f -xml`` output of (queue name, state, load, slots) tuples,
+    every queue with a job list.
+    """
+    def write(queues):
+        lines = ['<?xml version="1.0"?>', '<job_info>', '  <queue_info>']
+        for number, (name, state, load, slots) in enumerate(queues):
+            lines += ['    <Queue-List>', '      <name>{}</name>'.format(name), '      <qtype>BIP</qtype>',
+                      '      <slots_used>1</slots_used>', '      <slots_resv>0</slots_resv>',
+                      '      <slots_total>{}</slots_total>'.format(slots),
+                      '      <load_avg>{}</load_avg>'.format(load)]
+            if state:
+                lines.append('      <state>{}</state>'.format(state))
+            lines += ['      <job_list state="running">',
+                      '        <JB_job_number>{}</JB_job_number>'.format(number),
+                      '        <state>r</state>', '      </job_list>', '    </Queue-List>']
+        lines += ['  </queue_info>', '  <job_info/>', '</job_info>', '']
+        return '\n'.join(lines)
+    return write
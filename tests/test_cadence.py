@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import collections
+
+from watchman.cadence import AdaptiveInterval, Cadence
+
+Guard = collections.namedtuple('Guard', ['name'])
+
+DOWN = [('Ping 001', ['ping', 'blus001'], 1, 'Host blus001 is down.')]
+
+
+def test_healthy_guard_backs_off_and_a_change_resets_the_interval():
+    policy = AdaptiveInterval(600, 120, 3600, factor=2.0, healthy_runs=3)
+    intervals = [policy.observe(frozenset()) for i in range(12)]
+    assert intervals == [600, 600, 1200, 1200, 1200, 2400, 2400, 2400, 3600, 3600, 3600, 3600]
+    failure = frozenset([('ping blus001', 'Host blus001 is down.')])
+    # a new failure, the same failure again, the recovery
+    assert [policy.observe(state) for state in (failure, failure, frozenset())] == [120, 600, 120]
+
+
+def test_new_failure_is_held_back_until_the_retries_confirm_it():
+    cadence = Cadence(min_interval=120, max_interval=3600, retries=2, retry_delay=10)
+    guard = Guard('Ping 001')
+    policy = cadence.policy(guard, 600)
+    for retry in range(2):
+        assert cadence.confirm([guard], DOWN) == ([], [])
+        assert policy.current == 10
+    assert cadence.confirm([guard], DOWN) == ([guard], DOWN)
+    cadence.observe([guard], DOWN)
+    assert policy.current == 120
+    # a known failure is not retried
+    assert cadence.confirm([guard], DOWN) == ([guard], DOWN)
+
+
+def test_failure_gone_before_it_was_confirmed_tightens_the_interval():
+    cadence = Cadence(min_interval=120, max_interval=3600, retries=2, retry_delay=10)
+    guard = Guard('Ping 001')
+    policy = cadence.policy(guard, 600)
+    assert cadence.confirm([guard], DOWN) == ([], [])
+    assert cadence.confirm([guard], []) == ([guard], [])
+    assert policy.current == 120
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import io
+
+import pytest
+
+from watchman.capture import Discard, Everything, HeadTail, Spool, SpooledText, excerpt, parse_capture
+
+
+def test_excerpt_keeps_short_output():
+    assert excerpt('short', limit=10) == 'short'
+    assert excerpt('x' * 100, limit=None) == 'x' * 100
+    assert excerpt(['not', 'text'], limit=1) == ['not', 'text']
+
+
+def test_excerpt_keeps_head_and_tail():
+    assert excerpt('0123456789', limit=4) == '01\n[... 6 bytes skipped ...]\n89'
+    assert excerpt('0123456789', limit=5) == '01\n[... 5 bytes skipped ...]\n789'
+
+
+def test_excerpt_of_spooled_output():
+    spooled = Spool(threshold=4).read(io.BytesIO(b'0123456789'))
+    assert isinstance(spooled, SpooledText)
+    assert excerpt(spooled, limit=4) == b'01\n[... 6 bytes skipped ...]\n89'
+    # the excerpt leaves the spool at its start for the guard
+    assert list(spooled.splitlines()) == [b'0123456789']
+    spooled.close()
+
+
+def test_head_tail_across_chunks():
+    collector = HeadTail(head=3, tail=4).collector()
+    for chunk in (b'ab', b'cdef', b'ghij', b'k'):
+        collector.write(chunk)
+    assert collector.value() == b'abc\n[... 4 bytes skipped ...]\nhijk'
+
+
+def test_head_tail_keeps_short_output():
+    assert HeadTail(head=3, tail=4).read(io.BytesIO(b'abcdefg')) == b'abcdefg'
+
+
+def test_small_output_is_not_spooled():
+    assert Spool(threshold=100).read(io.BytesIO(b'small')) == b'small'
+    assert Everything().read(io.BytesIO(b'all')) == b'all'
+    assert Discard().read(io.BytesIO(b'gone')) == b''
+
+
+@pytest.mark.parametrize('value, mode', [
+    ('head_tail 10 20', 'head_tail 10 20'),
+    ('spool 100', 'spool 100'),
+    ('discard', 'discard'),
+])
+def test_parse_capture(value, mode):
+    assert str(parse_capture(value)) == mode
+
+
+def test_parse_capture_of_everything_and_unknown_modes():
+    assert parse_capture('all') is None
+    with pytest.raises(ValueError):
+        parse_capture('head_tail 1 2 3')
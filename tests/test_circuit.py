@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import pytest
+
+from watchman.circuit import CIRCUIT_OPEN_MESSAGE
+from watchman.loop import GuardLoop
+from watchman.patrol import Patrol
+from watchman.squad import RC_CIRCUIT_OPEN, Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+RUNNERS = [lambda: GuardLoop(max_running=8), lambda: Patrol(max_parallel=8)]
+
+
+def switch(state):
+    gateway = Shell('Gateway', 'exit $(cat {})'.format(state))
+    hosts = [Shell('Ping {}'.format(i), 'exit 1', depends_on=gateway) for i in range(5)]
+    sshd = Shell('Sshd 0', 'exit 1', depends_on=hosts[0])
+    return gateway, hosts, sshd
+
+
+@pytest.mark.parametrize('runner', RUNNERS, ids=['loop', 'patrol'])
+def test_children_of_a_failing_parent_are_skipped_with_one_root_cause(runner, tmpdir):
+    state = tmpdir.join('state')
+    state.write('1')
+    gateway, hosts, sshd = switch(state)
+    alerts = runner().march([sshd] + hosts + [gateway])
+    assert sorted((alert[0], alert[2]) for alert in alerts) == [('Gateway', RC_CIRCUIT_OPEN), ('Gateway', 1)]
+    assert CIRCUIT_OPEN_MESSAGE in [alert[3] for alert in alerts]
+    # the children never went on watch, the grandchild has the same root cause
+    assert all(guard.last_result is None and guard.skipped_by is gateway for guard in hosts + [sshd])
+
+
+@pytest.mark.parametrize('runner', RUNNERS, ids=['loop', 'patrol'])
+def test_root_cause_stays_until_the_parent_recovers(runner, tmpdir):
+    state = tmpdir.join('state')
+    state.write('1')
+    gateway, hosts, sshd = switch(state)
+    runner().march([gateway] + hosts)
+    # the parent alone repeats the root cause, the alert is not resolved in between
+    assert (gateway.name, RC_CIRCUIT_OPEN) in [(alert[0], alert[2]) for alert in runner().march([gateway])]
+    state.write('0')
+    alerts = runner().march([gateway] + hosts + [sshd])
+    # now the failing host opens the circuit of its sshd
+    assert sorted((alert[0], alert[2]) for alert in alerts) == sorted(
+        [('Ping {}'.format(i), 1) for i in range(5)] + [('Ping 0', RC_CIRCUIT_OPEN)])
+    assert sshd.skipped_by is hosts[0]
+    assert all(guard.skipped_by is None for guard in hosts) and not gateway.circuit_open
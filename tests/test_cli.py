@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import time
+
+from watchman import cli
+from watchman.patrol import Patrol
+from watchman.squad import Result, Watchman
+
+send_status_report = cli.__dict__['__send_status_report']
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, 'failed')]
+
+
+class Reports(list):
+    def send_status_report(self, report):
+        self.append(report)
+
+
+def test_status_report_does_not_run_skipped_guards_again():
+    parent = Shell('Gateway', 'exit 1', timeout=1)
+    children = [Shell('Child {}'.format(i), 'sleep 1', timeout=1, depends_on=parent) for i in range(5)]
+    patrol = Patrol(max_parallel=4)
+    # every child has an old result
+    for child in children:
+        child._record(Result(0, 'old', '', time.time() - 3600, 0.1))
+    reports = Reports()
+    start = time.time()
+    send_status_report(reports, [parent] + children, patrol.march, max_age=0)
+    assert time.time() - start < 1.0
+    assert reports[0].count('was skipped in the last sweep, Gateway fails, its last result follows.') == 5
+
+
+def test_status_report_of_a_guard_without_result():
+    parent = Shell('Gateway', 'exit 1')
+    parent.failing = True
+    child = Shell('Child', 'true', depends_on=parent)
+    reports = Reports()
+    send_status_report(reports, [child], Patrol().march, max_age=0)
+    assert reports == ['Child has no result, it was skipped in the last sweep, Gateway fails.']
+
+
+def test_status_report_does_not_run_aborted_guards_again():
+    slow = Shell('Slow', 'sleep 2')
+    slow._record(Result(0, 'old', '', time.time() - 3600, 0.1))
+    reports = Reports()
+    start = time.time()
+    send_status_report(reports, [slow], Patrol(budget=0.2).march, max_age=0)
+    assert time.time() - start < 1.0
+    assert reports[0].startswith('Slow did not finish in the last sweep, its last result follows.')
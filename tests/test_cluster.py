@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+from watchman.cluster import (ClusterGuard, ClusterSnapshot, Snapshot, disabled_queues, overloaded_hosts,
+                              unavailable_queues)
+from watchman.loop import GuardLoop
+from watchman.patrol import Patrol
+
+QUEUES = [('all.q@blus001', '', 1.0, 8), ('all.q@blus002', 'd', 2.0, 8), ('all.q@blus003', 'au', 0.0, 8),
+          ('short.q@blus004', '', 7.0, 4), ('long.q@blus004', '', 7.0, 2)]
+
+
+def snapshot(queues, hosts=None):
+    return Snapshot([{'name': name, 'state': state or None, 'load_avg': str(load), 'slots_total': str(slots)}
+                     for name, state, load, slots in queues], hosts or {}, 0.0, 0, '')
+
+
+def test_overloaded_hosts_are_judged_by_slots_or_processors():
+    rule = overloaded_hosts(max_load_per_slot=1.0)
+    assert rule(snapshot(QUEUES)) == ['Host blus004 is overloaded (6 slots).']
+    hosts = {'blus001': {'load_avg': '20.0', 'num_proc': '16'}}
+    assert rule(snapshot(QUEUES, hosts)) == ['Host blus001 is overloaded (16 processors).',
+                                             'Host blus004 is overloaded (6 slots).']
+
+
+def test_overloaded_message_does_not_change_with_the_load():
+    rule = overloaded_hosts(max_load_per_slot=1.0)
+    higher = [(name, state, load + 3.5, slots) for name, state, load, slots in QUEUES]
+    assert rule(snapshot(QUEUES)) == rule(snapshot(higher))
+
+
+def test_state_rules():
+    assert disabled_queues()(snapshot(QUEUES)) == ['Queue all.q@blus002 is disabled, state d.']
+    assert unavailable_queues()(snapshot(QUEUES)) == [
+        'Queue all.q@blus003 is not available or set to ERROR, state au.']
+
+
+def test_guards_share_one_qstat_per_ttl(commands, qstat_xml):
+    commands.add('qstat', qstat_xml(QUEUES), delay=0.2)
+    shared = ClusterSnapshot(ttl=60)
+    guards = [ClusterGuard('Disabled', shared, disabled_queues()),
+              ClusterGuard('Unavailable', shared, unavailable_queues()),
+              ClusterGuard('Overloaded', shared, overloaded_hosts(1.0))]
+    alerts = Patrol(max_parallel=3).march(guards)
+    assert commands.calls('qstat') == 1
+    assert sorted(alert[0] for alert in alerts) == ['Disabled', 'Overloaded', 'Unavailable']
+    # the loop waits for the same snapshot instead of running qstat again
+    assert len(GuardLoop().march(guards)) == 3
+    assert commands.calls('qstat') == 1
+
+
+def test_failing_qstat_fails_the_guards(commands):
+    commands.add('qstat', 'qmaster down\n', status=1)
+    alerts = GuardLoop().march([ClusterGuard('Disabled', ClusterSnapshot(), disabled_queues())])
+    assert [alert[2] for alert in alerts] == [1]
+    assert alerts[0][3].startswith('Cluster snapshot failed')
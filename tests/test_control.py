@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import socket
+import stat
+
+import pytest
+
+from watchman.control import ControlClient, ControlServer
+from watchman.patrol import Patrol
+from watchman.squad import Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+class Refreshes(object):
+    """
+    Refresh callback of the server, remembers the refreshed guards.
+    """
+    def __init__(self):
+        self.refreshed = []
+
+    def __call__(self, guards):
+        self.refreshed.append([guard.name for guard in guards])
+        Patrol().march(guards)
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    guards = [Shell('Fine', 'echo fine'), Shell('Broken', 'echo broken; exit 2')]
+    Patrol().march(guards[:1])
+    refresh = Refreshes()
+    server = ControlServer(str(tmpdir.join('control.sock')), guards, refresh).start()
+    server.refresh = refresh
+    yield server
+    server.shutdown()
+
+
+def test_status_is_served_from_the_cache(daemon):
+    states = ControlClient(daemon.path, timeout=5).status()
+    assert [(state['name'], state['state'], state['return_code']) for state in states] == [
+        ('Fine', 'ok', 0), ('Broken', 'no result', None)]
+    assert daemon.refresh.refreshed == []
+    assert stat.S_IMODE(os.stat(daemon.path).st_mode) == 0o600
+
+
+def test_check_refreshes_only_stale_guards(daemon):
+    client = ControlClient(daemon.path, timeout=5)
+    reports = client.check(['Broken', 'Fine'])
+    assert reports[0] == 'Broken has no result yet.' and 'fine' in reports[1]
+    reports = client.check(['Broken', 'Fine'], max_age=60)
+    assert daemon.refresh.refreshed == [['Broken']]
+    assert 'broken' in reports[0]
+    client.check(max_age=0)
+    assert daemon.refresh.refreshed == [['Broken'], ['Fine', 'Broken']]
+
+
+def test_unknown_guard_is_an_error(daemon):
+    with pytest.raises(ValueError) as error:
+        ControlClient(daemon.path, timeout=5).check(['Gone'])
+    assert 'unknown guards Gone' in str(error.value)
+
+
+def test_stale_socket_is_replaced_and_a_live_one_kept(tmpdir):
+    path = str(tmpdir.join('control.sock'))
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = ControlServer(path, [], lambda guards: None).start()
+    try:
+        assert ControlClient(path, timeout=5).status() == []
+        with pytest.raises(ValueError):
+            ControlServer(path, [], lambda guards: None)
+    finally:
+        server.shutdown()
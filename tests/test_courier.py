@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import smtplib
+
+import pytest
+
+from watchman import courier
+from watchman.courier import Courier
+
+
+class Server(object):
+    """
+    SMTP stand-in: counts the connections, keeps the mails and fails the first ``failures`` deliveries.
+    """
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.connections = 0
+        self.quits = 0
+        self.mails = []
+
+    def __call__(self, host, port, timeout=None):
+        self.connections += 1
+        return _Connection(self)
+
+
+class _Connection(object):
+    def __init__(self, server):
+        self._server = server
+
+    def sendmail(self, from_mail, to_mails, message):
+        if message == 'broken':
+            raise UnicodeEncodeError('ascii', u'\xe4', 0, 1, 'ordinal not in range(128)')
+        if self._server.failures > 0:
+            self._server.failures -= 1
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        self._server.mails.append((from_mail, to_mails, message))
+
+    def quit(self):
+        self._server.quits += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    waits = []
+    monkeypatch.setattr(courier.time, 'sleep', waits.append)
+    return waits
+
+
+def test_failed_delivery_is_retried_with_backoff(monkeypatch, waits):
+    server = Server(failures=2)
+    monkeypatch.setattr(courier.smtplib, 'SMTP', server)
+    Courier(retries=3, backoff=0.5)._deliver('watchman@example.com', ['admin@example.com'], 'Subject: down')
+    assert server.mails == [('watchman@example.com', ['admin@example.com'], 'Subject: down')]
+    assert waits == [0.5, 1.0]
+    # a failed connection is dropped, every retry connects again
+    assert server.connections == 3
+
+
+def test_delivery_gives_up_after_the_retries(monkeypatch, waits):
+    server = Server(failures=10)
+    monkeypatch.setattr(courier.smtplib, 'SMTP', server)
+    Courier(retries=3, backoff=1.0)._deliver('watchman@example.com', ['admin@example.com'], 'Subject: down')
+    assert server.mails == []
+    assert waits == [1.0, 2.0, 4.0]
+    assert server.connections == 4
+
+
+def test_full_queue_drops_mails_without_blocking():
+    postman = Courier(maxsize=2)
+    assert postman.post('watchman@example.com', ['admin@example.com'], 'one')
+    assert postman.post('watchman@example.com', ['admin@example.com'], 'two')
+    assert not postman.post('watchman@example.com', ['admin@example.com'], 'three')
+
+
+def test_mails_share_one_connection(monkeypatch):
+    server = Server()
+    monkeypatch.setattr(courier.smtplib, 'SMTP', server)
+    postman = Courier().start()
+    for i in range(3):
+        postman.post('watchman@example.com', ['admin@example.com'], 'mail {}'.format(i))
+    postman.stop(timeout=5.0)
+    assert [mail[2] for mail in server.mails] == ['mail 0', 'mail 1', 'mail 2']
+    assert server.connections == 1
+    assert server.quits == 1
+
+
+def test_unexpected_error_drops_only_that_mail(monkeypatch):
+    server = Server()
+    monkeypatch.setattr(courier.smtplib, 'SMTP', server)
+    postman = Courier().start()
+    postman.post('watchman@example.com', ['admin@example.com'], 'broken')
+    postman.post('watchman@example.com', ['admin@example.com'], 'fine')
+    postman.stop(timeout=5.0)
+    assert [mail[2] for mail in server.mails] == ['fine']
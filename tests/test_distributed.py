@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import watchman
+from watchman.distributed import Coordinator, CoordinatorClient, HashRing, StatusCollector
+
+Guard = collections.namedtuple('Guard', ['name'])
+
+
+class Reports(object):
+    """
+    Dispatch callback of the coordinator, remembers the reports.
+    """
+    def __init__(self):
+        self.reports = []
+        self._event = threading.Event()
+
+    def __call__(self, guards, alerts):
+        self.reports.append((guards, alerts))
+        self._event.set()
+
+    def wait(self, count, timeout=5.0):
+        end = time.time() + timeout
+        while len(self.reports) < count and time.time() < end:
+            self._event.wait(0.05)
+            self._event.clear()
+        return self.reports
+
+
+@pytest.fixture
+def coordinator():
+    reports = Reports()
+    statuses = []
+    coordinator = Coordinator(('127.0.0.1', 0), reports,
+                              status=lambda worker, report: statuses.append((worker, report)),
+                              secret='s3cret').start()
+    coordinator.reports = reports
+    coordinator.statuses = statuses
+    yield coordinator
+    coordinator.shutdown()
+
+
+def sweep(client, ring, worker, guards):
+    shard = ring.shard(guards, worker)
+    client.report(shard, [(guard.name, ['ping', guard.name], 1, 'down') for guard in shard[:1]])
+    return shard
+
+
+def test_coordinator_gets_reports_of_two_workers_and_redistributes(coordinator):
+    guards = [Guard('Ping {:03d}'.format(i)) for i in range(200)]
+    ring = HashRing(['site-a', 'site-b'])
+    clients = dict((worker, CoordinatorClient(worker, coordinator.address, secret='s3cret'))
+                   for worker in ['site-a', 'site-b'])
+    shards = dict((worker, sweep(client, ring, worker, guards)) for worker, client in clients.items())
+    reports = coordinator.reports.wait(2)
+    assert len(reports) == 2
+    assert sorted(name for names, _ in reports for name in names) == sorted(guard.name for guard in guards)
+    assert all(len(alerts) == 1 for _, alerts in reports)
+    assert 0 < len(shards['site-a']) < len(guards)
+
+    # site-b drops out: its guards move to site-a, the guards of site-a stay
+    ring = HashRing(['site-a'])
+    shard = sweep(clients['site-a'], ring, 'site-a', guards)
+    assert len(coordinator.reports.wait(3)) == 3
+    assert shard == guards
+    assert set(shards['site-a']) <= set(shard)
+    for client in clients.values():
+        client.close()
+
+
+def test_hash_ring_moves_only_the_guards_of_a_removed_worker():
+    guards = [Guard('Ping {:03d}'.format(i)) for i in range(500)]
+    before = HashRing(['a', 'b', 'c'])
+    after = HashRing(['a', 'c'])
+    moved = [guard for guard in guards if before.owner(guard.name) != after.owner(guard.name)]
+    assert len(moved) > 0
+    assert all(before.owner(guard.name) == 'b' for guard in moved)
+
+
+def test_hash_ring_spreads_the_guards_evenly():
+    guards = [Guard('Ping {:04d}'.format(i)) for i in range(3000)]
+    ring = HashRing(['a', 'b', 'c'])
+    shards = [ring.shard(guards, worker) for worker in ['a', 'b', 'c']]
+    assert sum(len(shard) for shard in shards) == len(guards)
+    assert all(700 < len(shard) < 1300 for shard in shards)
+
+
+def test_coordinator_drops_unsigned_reports(coordinator):
+    client = CoordinatorClient('site-a', coordinator.address)
+    client.report([Guard('Ping 001')], [])
+    signed = CoordinatorClient('site-a', coordinator.address, secret='s3cret')
+    signed.report([Guard('Ping 002')], [])
+    reports = coordinator.reports.wait(1)
+    time.sleep(0.2)
+    assert reports == [(['Ping 002'], [])]
+    client.close()
+    signed.close()
+
+
+def test_coordinator_collects_status_reports(coordinator):
+    client = CoordinatorClient('site-b', coordinator.address, secret='s3cret')
+    client.send_status_report('all fine')
+    end = time.time() + 5
+    while len(coordinator.statuses) == 0 and time.time() < end:
+        time.sleep(0.05)
+    assert coordinator.statuses == [('site-b', 'all fine')]
+    client.close()
+
+
+def test_coordinator_needs_a_secret_beyond_localhost():
+    with pytest.raises(ValueError):
+        Coordinator(('0.0.0.0', 0), lambda guards, alerts: None)
+
+
+def test_status_collector_sends_once_all_workers_reported():
+    sent = []
+    collector = StatusCollector(['site-a', 'site-b'], sent.append, wait=60)
+    collector.collect('site-b', 'b fine')
+    assert sent == []
+    collector.collect('site-a', 'a fine')
+    assert len(sent) == 1
+    assert sent[0].index('a fine') < sent[0].index('b fine')
+
+
+def test_status_collector_names_missing_workers():
+    sent = []
+    collector = StatusCollector(['site-a', 'site-b'], sent.append, wait=60)
+    collector.collect('site-a', 'a fine')
+    collector.flush()
+    assert len(sent) == 1
+    assert 'No status report from workers site-b.' in sent[0]
+
+
+WORKER = """
+import collections, sys, time
+from watchman.distributed import CoordinatorClient, HashRing
+Guard = collections.namedtuple('Guard', ['name'])
+worker, port, sweeps = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+shard = HashRing(['site-a', 'site-b']).shard([Guard('Ping {:03d}'.format(i)) for i in range(200)], worker)
+client = CoordinatorClient(worker, ('127.0.0.1', port), secret='s3cret')
+for sweep in range(sweeps):
+    client.report(shard, [])
+    time.sleep(0.1)
+client.close()
+"""
+
+
+def test_coordinator_alerts_a_worker_process_which_stopped_reporting():
+    reports = Reports()
+    coordinator = Coordinator(('127.0.0.1', 0), reports, secret='s3cret', workers=['site-a', 'site-b'],
+                              silence=0.5).start()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(watchman.__file__))))
+    port = str(coordinator.address[1])
+    # site-b reports once and ends, site-a goes on
+    processes = [subprocess.Popen([sys.executable, '-c', WORKER, worker, port, sweeps], env=env)
+                 for worker, sweeps in [('site-a', '40'), ('site-b', '1')]]
+    try:
+        end = time.time() + 10
+        while time.time() < end and not any(alerts for guards, alerts in reports.reports[-1:]):
+            time.sleep(0.05)
+        guards, alerts = reports.reports[-1]
+        assert guards == ['Worker site-a', 'Worker site-b']
+        assert [alert[3] for alert in alerts] == ['Worker site-b stopped reporting.']
+        assert coordinator.silent_workers() == ['site-b']
+        names = set(name for guards, alerts in reports.reports for name in guards if name.startswith('Ping'))
+        assert len(names) == 200
+    finally:
+        coordinator.shutdown()
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import time
+
+import pytest
+
+from watchman.history import History, Record
+
+# noon of the 15th, so the records stay in their month in every timezone
+MAY = time.mktime((2016, 5, 15, 12, 0, 0, 0, 0, -1))
+JUNE = time.mktime((2016, 6, 15, 12, 0, 0, 0, 0, -1))
+
+
+@pytest.fixture
+def history(tmpdir):
+    history = History(str(tmpdir.join('history')))
+    for i in range(100):
+        history.append('Ping 001', MAY + i * 60, 0.1 * (i % 10), 0, 1 if i % 4 == 0 else 0)
+    for i in range(10):
+        history.append('Ping 001', JUNE + i * 60, 1.0, 1, 1)
+    history.append('Queues', MAY, 2.0, 0, 0)
+    return history
+
+
+def test_results_in_a_time_range(history):
+    records = list(history.results('Ping 001', since=MAY + 10 * 60, until=MAY + 20 * 60))
+    assert [record.timestamp for record in records] == [MAY + i * 60 for i in range(10, 20)]
+    assert records[0] == Record(MAY + 600, 0.0, 0, 0)
+
+
+def test_results_span_months(history):
+    records = list(history.results('Ping 001', since=MAY + 95 * 60, until=JUNE + 120))
+    assert len(records) == 7
+    assert [record.return_code for record in records] == [0] * 5 + [1] * 2
+
+
+def test_results_of_unknown_guard_are_empty(history):
+    assert list(history.results('Ping 999')) == []
+
+
+def test_availability_and_percentile(history):
+    assert history.availability('Ping 001', until=JUNE) == 0.75
+    assert history.availability('Ping 001', since=JUNE) == 0.0
+    assert history.percentile('Ping 001', 50, until=JUNE) == pytest.approx(0.4)
+    assert history.percentile('Ping 001', 100) == 1.0
+    assert history.percentile('Ping 001', 50, since=JUNE + 3600) is None
+
+
+def test_percentiles_at_the_ends_and_across_blocks(tmpdir):
+    history = History(str(tmpdir.join('history')))
+    # more records than one block unpacks, in shuffled order of durations
+    count = 2500
+    for i in range(count):
+        history.append('Ping 001', MAY + i, (i * 7919) % count / 1000, 0, 0)
+    assert history.percentile('Ping 001', 0) == 0.0
+    assert history.percentile('Ping 001', 1) == pytest.approx(0.024)
+    assert history.percentile('Ping 001', 50) == pytest.approx(1.249)
+    assert history.percentile('Ping 001', 99) == pytest.approx(2.474)
+    assert history.percentile('Ping 001', 100) == pytest.approx(2.499)
+    records = list(history.results('Ping 001', since=MAY + 1000, until=MAY + 2100))
+    assert [record.timestamp for record in records] == [MAY + i for i in range(1000, 2100)]
+
+
+def test_older_records_than_the_last_are_dropped(history):
+    history.append('Queues', MAY - 60, 3.0, 0, 0)
+    assert [record.duration for record in history.results('Queues')] == [2.0]
+
+
+def test_history_is_reopened(history, tmpdir):
+    reopened = History(str(tmpdir.join('history')))
+    assert reopened.guards() == ['Ping 001', 'Queues']
+    # the last record of a guard is found on disk
+    reopened.append('Queues', MAY - 60, 3.0, 0, 0)
+    reopened.append('Queues', MAY + 60, 4.0, 0, 0)
+    assert [record.duration for record in reopened.results('Queues')] == [2.0, 4.0]
+
+
+def test_rotate_deletes_old_months(history, tmpdir):
+    history = History(str(tmpdir.join('history')), retention_days=10)
+    history.rotate(now=JUNE + 24 * 60 * 60)
+    assert [record.timestamp for record in history.results('Ping 001')] == [JUNE + i * 60 for i in range(10)]
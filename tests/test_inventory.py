@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import textwrap
+import time
+
+import pytest
+
+from watchman.capture import HeadTail
+from watchman.cluster import ClusterGuard
+import watchman.inventory as inventory_module
+from watchman.inventory import Inventory, read_qconf_hosts
+from watchman.probes import TcpGuard
+from watchman.remote import RemoteGuard
+from watchman.roster import Roster
+from watchman.squad import MultiPingGuard, PingGuard, QstatFGuard
+
+GUARDS = u"""
+[hosts]
+blus = ekpblus[001-003]
+gpu = ekpgpu[01-02] ekpblus002
+all = @blus, @gpu
+exec = qconf:sel
+
+[cluster]
+ttl = 30
+
+[ssh]
+transport = local
+
+[guard:Gateway]
+type = ping
+hosts = gw-blus
+
+[guard:Ping all]
+type = ping
+hosts = @all
+interval = 300
+depends_on = Gateway
+
+[guard:Execd]
+type = tcp
+hosts = @exec
+port = 6445
+capture = head_tail 10 20
+
+[guard:Queues]
+type = qstat
+isolated = yes
+
+[guard:Overloaded hosts]
+type = cluster
+rule = overloaded
+max_load_per_slot = 1.5
+
+[guard:Node]
+type = remote
+hosts = ekpblus[001-002]
+check.execd = pgrep -x sge_execd
+"""
+
+
+def inventory(tmpdir, text=GUARDS):
+    path = tmpdir.join('guards.ini')
+    path.write(textwrap.dedent(text))
+    return Inventory(str(path), qconf_hosts=lambda: ['ekpblus001', 'ekpblus009'])
+
+
+def test_host_groups_are_resolved_without_duplicates(tmpdir):
+    hosts = inventory(tmpdir).hosts('@all, ekpblus001 gw-blus')
+    assert hosts == ['ekpblus001', 'ekpblus002', 'ekpblus003', 'ekpgpu01', 'ekpgpu02', 'gw-blus']
+
+
+def test_guards_are_created_in_the_order_of_their_sections(tmpdir):
+    guards = inventory(tmpdir).guards()
+    assert [(type(guard), guard.name) for guard in guards] == [
+        (PingGuard, 'Gateway'), (MultiPingGuard, 'Ping all'), (TcpGuard, 'Execd'), (QstatFGuard, 'Queues'),
+        (ClusterGuard, 'Overloaded hosts'), (RemoteGuard, 'Node ekpblus001'), (RemoteGuard, 'Node ekpblus002')]
+    gateway, ping, execd, queues = guards[:4]
+    assert ping.depends_on is gateway
+    assert ping.interval == 300
+    assert execd.hosts == ['ekpblus001', 'ekpblus009']
+    assert isinstance(execd.capture, HeadTail) and (execd.capture.head, execd.capture.tail) == (10, 20)
+    assert queues.isolated
+
+
+@pytest.mark.parametrize('section, message', [
+    ('[guard:X]\ntype = ping\nhosts = a\ncolour = red\n', 'unknown options colour'),
+    ('[guard:X]\ntype = teleport\nhosts = a\n', 'unknown type teleport'),
+    ('[guard:X]\ntype = tcp\n', 'has no hosts'),
+    ('[guard:X]\ntype = ping\nhosts = a\ndepends_on = Y\n', 'unknown guard Y'),
+    ('[guard:X]\ntype = ping\nhosts = @loop\n', 'contains itself'),
+    ('[guard:X]\ntype = ping\nhosts = @nothing\n', 'Unknown host group @nothing'),
+])
+def test_invalid_declarations_are_rejected(tmpdir, section, message):
+    with pytest.raises(ValueError) as error:
+        inventory(tmpdir, '[hosts]\nloop = a @loop\n' + section).guards()
+    assert message in str(error.value)
+
+
+class Jobs(object):
+    def add(self, job):
+        return job
+
+    def cancel(self, job):
+        pass
+
+
+def test_reloaded_guards_share_the_snapshot_and_pool_with_the_kept_ones(tmpdir):
+    roster = Roster(Jobs(), lambda guard: guard)
+    roster.update(inventory(tmpdir).guards())
+    kept = roster.guards[:]
+    # a new remote check and a host more, the other guards stay on duty
+    roster.update(inventory(tmpdir, GUARDS.replace('[cluster]\nttl = 30', '[cluster]\nttl = 10\nqhost = yes')
+                            + 'check.sshd = pgrep -x sshd\n'
+                            + '[guard:Load]\ntype = cluster\nrule = disabled\n').guards())
+    assert roster.guards[4] is kept[4]
+    assert roster.guards[5] is not kept[5]
+    clusters = [guard for guard in roster.guards if isinstance(guard, ClusterGuard)]
+    assert len(clusters) == 2 and clusters[0]._snapshot is clusters[1]._snapshot
+    assert clusters[0]._snapshot._ttl == 10 and clusters[0]._snapshot._qhost is not None
+    assert roster.guards[5]._pool is kept[5]._pool
+
+
+def test_exec_hosts_of_the_last_qconf_are_kept_when_it_hangs(commands, monkeypatch):
+    monkeypatch.setattr(inventory_module, '_EXEC_HOSTS', [])
+    with pytest.raises(ValueError):
+        read_qconf_hosts()
+    commands.add('qconf', 'ekpblus001\nekpblus002\n')
+    assert read_qconf_hosts() == ['ekpblus001', 'ekpblus002']
+    commands.add('qconf', 'ekpblus003\n', delay=5)
+    start = time.time()
+    assert read_qconf_hosts(timeout=0.3) == ['ekpblus001', 'ekpblus002']
+    assert time.time() - start < 2
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import errno
+import os
+import threading
+import time
+
+import pytest
+
+from watchman.isolation import WorkerPool
+from watchman.loop import GuardLoop
+from watchman.squad import QstatFGuard, RC_TIMEOUT, Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, isolated=True, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # the worker processes import the guards of this module
+    monkeypatch.setenv('PYTHONPATH', os.path.dirname(os.path.abspath(__file__)))
+    pool = WorkerPool(processes=1, max_tasks=2)
+    yield pool
+    pool.close()
+
+
+def isolated(guard, pool):
+    guard.isolation = pool
+    return guard
+
+
+def is_gone(pid, wait=2.0):
+    end = time.time() + wait
+    while time.time() < end:
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.ESRCH
+        time.sleep(0.05)
+    return False
+
+
+def test_guard_state_comes_back_from_the_worker(pool, commands, qstat_xml):
+    commands.add('qstat', qstat_xml([('all.q@blus001', 'au', 0.5, 8), ('all.q@blus002', '', 0.5, 8)]))
+    guard = isolated(QstatFGuard('Queues', isolated=True), pool)
+    alerts = []
+    guard.guard(alerts)
+    assert [alert[3] for alert in alerts] == ['Queue all.q@blus001 is not available or set to ERROR.']
+    assert guard.transitions == [('all.q@blus001', None, 'au')]
+    assert 'all.q@blus001 au' in guard.last_result.out
+
+
+def test_worker_is_replaced_after_max_tasks(pool):
+    guard = isolated(Shell('Parent', 'echo $PPID'), pool)
+    pids = []
+    for i in range(3):
+        guard.guard([])
+        pids.append(int(guard.last_result.out))
+    assert pids[0] == pids[1] != pids[2]
+    assert os.getpid() not in pids
+
+
+@pytest.mark.parametrize('runner', ['guard', 'loop'])
+def test_abort_kills_the_worker_and_the_command(pool, tmpdir, runner):
+    pid_file = tmpdir.join('pid')
+    guard = isolated(Shell('Black hole', 'echo $$ > {}; exec sleep 30'.format(pid_file)), pool)
+    alerts = []
+    if runner == 'guard':
+        watch = threading.Thread(target=guard.guard, args=(alerts,))
+    else:
+        watch = threading.Thread(target=lambda: alerts.extend(GuardLoop().march([guard])))
+    watch.start()
+    end = time.time() + 10
+    while not pid_file.exists() and time.time() < end:
+        time.sleep(0.05)
+    start = time.time()
+    guard.abort()
+    watch.join(5)
+    assert not watch.is_alive() and time.time() - start < 2.0
+    assert [(alert[2], alert[3]) for alert in alerts] == [(RC_TIMEOUT, 'Worker process aborted.')]
+    assert is_gone(int(pid_file.read()))
+
+
+def test_guard_the_worker_cannot_import_runs_in_the_daemon(monkeypatch):
+    monkeypatch.delenv('PYTHONPATH', raising=False)
+    pool = WorkerPool(processes=1)
+    try:
+        guard = isolated(Shell('Parent', 'echo $PPID'), pool)
+        guard.guard([])
+    finally:
+        pool.close()
+    assert int(guard.last_result.out) == os.getpid()
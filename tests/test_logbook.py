@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+from watchman.logbook import Logbook
+
+DOWN = ('Ping 001', ['ping', 'ekpblus001'], 1, 'Host ekpblus001 is unreachable.')
+QUEUE = ('Queues', ['qstat', '-f', '-xml'], 0, 'Queue all.q@ekpblus002 is not available or set to ERROR.')
+
+
+def test_alert_is_sent_once_and_recovers():
+    logbook = Logbook()
+    assert logbook.triage(['Ping 001'], [DOWN], now=100) == ([DOWN], [])
+    assert logbook.triage(['Ping 001'], [DOWN], now=200) == ([], [])
+    assert logbook.open_alerts() == [DOWN]
+    assert logbook.triage(['Ping 001'], [], now=300) == ([], [DOWN])
+    assert logbook.open_alerts() == []
+
+
+def test_open_alert_is_sent_again_after_the_renotify_period():
+    logbook = Logbook(renotify=3600)
+    assert logbook.triage(['Ping 001'], [DOWN], now=0) == ([DOWN], [])
+    assert logbook.triage(['Ping 001'], [DOWN], now=3000) == ([], [])
+    assert logbook.triage(['Ping 001'], [DOWN], now=3600) == ([DOWN], [])
+    assert logbook.triage(['Ping 001'], [DOWN], now=4000) == ([], [])
+
+
+def test_alerts_of_guards_off_watch_stay_open():
+    logbook = Logbook()
+    logbook.triage(['Ping 001', 'Queues'], [DOWN, QUEUE], now=100)
+    # only the queues were on watch, the ping alert is not resolved
+    assert logbook.triage(['Queues'], [], now=200) == ([], [QUEUE])
+    assert logbook.open_alerts() == [DOWN]
+
+
+def test_duplicate_alerts_of_a_sweep_are_sent_once():
+    assert Logbook().triage(['Ping 001'], [DOWN, DOWN], now=100) == ([DOWN], [])
+
+
+def test_open_alerts_survive_a_restart(tmpdir):
+    path = str(tmpdir.join('logbook.db'))
+    logbook = Logbook(path)
+    logbook.triage(['Ping 001'], [DOWN], now=100)
+    logbook.close()
+    logbook = Logbook(path)
+    assert logbook.triage(['Ping 001'], [DOWN], now=200) == ([], [])
+    assert logbook.triage(['Ping 001'], [], now=300) == ([], [DOWN])
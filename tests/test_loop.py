@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import time
+
+import pytest
+
+from watchman.loop import GuardLoop
+from watchman.patrol import Patrol
+from watchman.probes import TcpGuard
+from watchman.squad import QstatFGuard, RC_TIMEOUT, Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+RUNNERS = [lambda: GuardLoop(max_running=64), lambda: Patrol(max_parallel=64)]
+
+
+@pytest.mark.parametrize('runner', RUNNERS, ids=['loop', 'patrol'])
+def test_command_which_closes_its_output_still_times_out(runner):
+    guard = Shell('Silent', 'exec >&- 2>&-; sleep 4', timeout=0.5)
+    start = time.time()
+    alerts = runner().march([guard])
+    assert time.time() - start < 1.5
+    assert [alert[2] for alert in alerts] == [RC_TIMEOUT]
+
+
+@pytest.mark.parametrize('runner', RUNNERS, ids=['loop', 'patrol'])
+def test_output_and_return_code_arrive(runner):
+    guards = [Shell('Echo {}'.format(i), 'sleep 0.3; echo {0}; exit {0}'.format(i % 2)) for i in range(20)]
+    start = time.time()
+    alerts = runner().march(guards)
+    assert time.time() - start < 1.5
+    assert sorted(alert[0] for alert in alerts) == sorted('Echo {}'.format(i) for i in range(1, 20, 2))
+    assert guards[1].last_result.out == '1\n'
+
+
+def test_loop_and_patrol_parse_qstat_alike(commands, qstat_xml):
+    commands.add('qstat', qstat_xml([('all.q@blus{:03d}'.format(i), 'au' if i % 3 == 0 else '', 0.5, 8)
+                                     for i in range(30)]))
+    looped, threaded = QstatFGuard('Queues'), QstatFGuard('Queues')
+    assert GuardLoop().march([looped]) == Patrol().march([threaded])
+    assert looped.last_result.out == threaded.last_result.out
+    assert len(looped._failing) == 10
+
+
+def test_probes_wait_in_the_loop():
+    guard = TcpGuard('Closed port', ['127.0.0.1'], port=1)
+    alerts = GuardLoop().march([guard, Shell('Fine', 'true')])
+    assert [alert[0] for alert in alerts] == ['Closed port']
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+from watchman import metrics
+from watchman.metrics import Counter, Histogram, Registry
+from watchman.squad import Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(Histogram('duration_seconds', 'Durations.', ('guard',), buckets=(1.0, 0.1)))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, 'Ping "001"')
+    assert registry.render().splitlines() == [
+        '# HELP duration_seconds Durations.',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{guard="Ping \\"001\\"",le="0.1"} 1',
+        'duration_seconds_bucket{guard="Ping \\"001\\"",le="1.0"} 2',
+        'duration_seconds_bucket{guard="Ping \\"001\\"",le="+Inf"} 3',
+        'duration_seconds_sum{guard="Ping \\"001\\""} 5.55',
+        'duration_seconds_count{guard="Ping \\"001\\""} 3']
+
+
+def test_guard_exports_duration_exit_code_and_alerts():
+    alerts = []
+    Shell('Metrics failing', 'exit 3').guard(alerts)
+    text = metrics.REGISTRY.render()
+    assert 'watchman_guard_exit_code{guard="Metrics failing"} 3.0' in text
+    assert 'watchman_guard_alerts_total{guard="Metrics failing"} 1.0' in text
+    assert 'watchman_guard_duration_seconds_count{guard="Metrics failing"} 1' in text
+    metrics.remove_guard('Metrics failing')
+    assert 'Metrics failing' not in metrics.REGISTRY.render()
+
+
+def test_metrics_are_served_and_written(tmpdir):
+    registry = Registry()
+    registry.register(Counter('sweeps_total', 'Sweeps.')).inc()
+    path = tmpdir.join('watchman.prom')
+    metrics.write_textfile(str(path), registry)
+    assert 'sweeps_total 1.0' in path.read()
+    assert tmpdir.listdir() == [path]
+    server = metrics.serve(0, '127.0.0.1', registry)
+    try:
+        body = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1]), timeout=5).read()
+    finally:
+        server.shutdown()
+    assert body.decode('utf-8') == registry.render()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import time
+
+from watchman.patrol import Patrol
+from watchman.squad import RC_CRASHED, RC_TIMEOUT, Watchman
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+class Broken(Shell):
+    def _check_output(self, return_code, out, error):
+        raise KeyError('state')
+
+
+def sleepers(count, seconds):
+    return [Shell('Sleep {}'.format(i), 'sleep {}'.format(seconds)) for i in range(count)]
+
+
+def test_guards_watch_in_parallel_up_to_the_limit():
+    start = time.time()
+    assert Patrol(max_parallel=8).march(sleepers(8, 0.4)) == []
+    assert time.time() - start < 0.75
+    start = time.time()
+    assert Patrol(max_parallel=4).march(sleepers(8, 0.4)) == []
+    assert 0.8 <= time.time() - start < 1.3
+
+
+def test_exhausted_budget_aborts_running_and_skips_waiting_guards():
+    guards = sleepers(2, 5)
+    start = time.time()
+    alerts = Patrol(max_parallel=1, budget=0.4).march(guards)
+    assert time.time() - start < 1.0
+    assert sorted((alert[0], alert[2], alert[3]) for alert in alerts) == [
+        ('Sleep 0', RC_TIMEOUT, 'Aborted, sweep budget of 0.4s exhausted.'),
+        ('Sleep 1', RC_TIMEOUT, 'Skipped, sweep budget of 0.4s exhausted.')]
+
+
+def test_crashing_guard_gives_an_alert_and_the_others_go_on():
+    alerts = Patrol(max_parallel=2).march([Broken('Broken', 'true'), Shell('Failing', 'echo down; exit 2')])
+    assert sorted((alert[0], alert[2]) for alert in alerts) == [('Broken', RC_CRASHED), ('Failing', 2)]
+    assert "Guard crashed: 'state'" in [alert[3] for alert in alerts]
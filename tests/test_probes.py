@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import socket
+import time
+
+import pytest
+
+from watchman.probes import IcmpGuard, TcpGuard
+
+
+@pytest.fixture
+def listening():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(512)
+    yield server.getsockname()[1]
+    server.close()
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_open_port_gives_no_alert(listening):
+    guard = TcpGuard('Execd', ['127.0.0.1', 'localhost'], port=listening)
+    alerts = []
+    guard.guard(alerts)
+    assert alerts == []
+    assert guard.last_result.out == [('127.0.0.1', None), ('localhost', None)]
+
+
+def test_closed_port_and_unknown_host_give_one_alert_each():
+    port = closed_port()
+    guard = TcpGuard('Execd', ['127.0.0.1', 'no-such-host.invalid'], port=port, probe_timeout=1.0)
+    alerts = []
+    start = time.time()
+    guard.guard(alerts)
+    assert time.time() - start < 2.5
+    assert [(alert[1], alert[3].split(':')[0]) for alert in alerts] == [
+        (['tcp-connect', '127.0.0.1:{}'.format(port)], 'Host 127.0.0.1 failed'),
+        (['tcp-connect', 'no-such-host.invalid:{}'.format(port)], 'Host no-such-host.invalid failed')]
+
+
+def test_many_hosts_are_probed_at_once(listening):
+    guard = TcpGuard('Execd', ['127.0.0.1'] * 300, port=listening)
+    alerts = []
+    start = time.time()
+    guard.guard(alerts)
+    assert alerts == [] and len(guard.last_result.out) == 300
+    assert time.time() - start < 2.0
+
+
+def test_loopback_answers_icmp_echo():
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+    except socket.error:
+        pytest.skip('unprivileged ICMP sockets are not allowed here')
+    alerts = []
+    IcmpGuard('Ping loopback', ['127.0.0.1'], count=2, probe_timeout=1.0).guard(alerts)
+    assert alerts == []
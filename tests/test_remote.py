@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import collections
+import threading
+import time
+
+from watchman.loop import GuardLoop
+from watchman.patrol import Patrol
+from watchman.remote import LocalPool, RemoteGuard, SshPool
+
+
+def checks(*items):
+    return collections.OrderedDict(items)
+
+
+def test_failing_checks_raise_one_stable_alert_each():
+    guard = RemoteGuard('Node blus001', 'blus001',
+                        checks(('execd', 'true'), ('tmp', 'echo "/tmp 97% full"; exit 3'), ('load', 'exit 1')),
+                        LocalPool())
+    messages = []
+    for i in range(2):
+        alerts = []
+        guard.guard(alerts)
+        messages.append(sorted((alert[2], alert[3]) for alert in alerts))
+    assert messages[0] == messages[1] == [(1, 'Check load on blus001 failed.'), (3, 'Check tmp on blus001 failed.')]
+    # the output of the checks is in the report
+    assert '/tmp 97% full' in guard.report_back(max_age=float('inf'))
+
+
+def test_healthy_host_raises_no_alert():
+    alerts = []
+    RemoteGuard('Node blus002', 'blus002', checks(('execd', 'true')), LocalPool()).guard(alerts)
+    assert alerts == []
+
+
+def test_unfinished_check_is_reported():
+    guard = RemoteGuard('Node blus003', 'blus003', checks(('hang', 'sleep 5')), LocalPool(), timeout=0.3)
+    alerts = []
+    guard.guard(alerts)
+    assert [alert[3] for alert in alerts] == ['Command timed out after 0.3s.']
+
+
+def sleepers(pool, count, host='blus004'):
+    return [RemoteGuard('Node {} {}'.format(host, i), host, checks(('sleep', 'sleep 0.3')), pool)
+            for i in range(count)]
+
+
+def test_sessions_per_host_are_bounded_in_the_patrol():
+    start = time.time()
+    alerts = Patrol(max_parallel=4).march(sleepers(LocalPool(max_sessions=2), 4))
+    assert alerts == []
+    assert time.time() - start >= 0.6
+
+
+def test_sessions_per_host_are_bounded_in_the_loop():
+    pool = LocalPool(max_sessions=1)
+    start = time.time()
+    alerts = GuardLoop(max_running=4).march(sleepers(pool, 3) + sleepers(pool, 1, host='blus005'))
+    assert alerts == []
+    assert 0.9 <= time.time() - start < 2.0
+    assert pool.available('blus004')
+
+
+def test_session_waits_until_one_is_released():
+    pool = LocalPool(max_sessions=1)
+    pool.acquire('blus006')
+    acquired = threading.Event()
+
+    def second():
+        pool.acquire('blus006')
+        acquired.set()
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    assert pool.available('blus007')
+    pool.release('blus006')
+    assert acquired.wait(1.0)
+    thread.join()
+
+
+def closed(commands):
+    return [arguments.split()[-1] for arguments in commands.arguments('ssh')]
+
+
+def test_masters_with_running_sessions_are_not_evicted(tmpdir, commands):
+    commands.add('ssh', '')
+    pool = SshPool(max_masters=2, control_dir=str(tmpdir.join('ssh')))
+    for host in ('blus001', 'blus002'):
+        pool.acquire(host)
+        pool.checkout(host)
+    pool.release('blus002')
+    pool.acquire('blus003')
+    pool.checkout('blus003')
+    # blus001 is the least recently used one, but it is busy
+    time.sleep(0.2)
+    assert closed(commands) == ['blus002']
+
+
+def test_sessions_go_to_at_most_max_masters_hosts(tmpdir):
+    pool = SshPool(max_masters=2, control_dir=str(tmpdir.join('ssh')))
+    pool.acquire('blus001')
+    pool.acquire('blus002')
+    assert pool.available('blus001')
+    assert not pool.available('blus003')
+    pool.release('blus002')
+    assert pool.available('blus003')
+
+
+def test_closing_a_master_does_not_wait_for_ssh(tmpdir, commands):
+    commands.add('ssh', '', delay=1)
+    pool = SshPool(max_masters=1, control_dir=str(tmpdir.join('ssh')))
+    start = time.time()
+    for host in ('blus001', 'blus002', 'blus003'):
+        pool.acquire(host)
+        pool.checkout(host)
+        pool.release(host)
+    assert time.time() - start < 0.5
+    time.sleep(0.2)
+    assert sorted(closed(commands)) == ['blus001', 'blus002']
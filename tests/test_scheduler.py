@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+from watchman.scheduler import Job, Scheduler
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Runs(list):
+    """
+    Action of the jobs, remembers the items of every run.
+    """
+    __hash__ = object.__hash__
+
+    def __call__(self, items):
+        self.append(items)
+
+
+class Policy(object):
+    def __init__(self, current):
+        self.current = current
+
+
+def test_interval_job_keeps_its_rhythm():
+    job = Job(lambda items: None, interval=10)
+    assert job.plan(100, first=True) == 110
+    # a late run does not shift the following ones
+    assert job.plan(113) == 120
+    assert job.plan(121) == 130
+
+
+def test_missed_runs_are_skipped():
+    job = Job(lambda items: None, interval=10)
+    job.plan(100, first=True)
+    assert job.plan(145) == 150
+
+
+def test_jitter_does_not_accumulate():
+    job = Job(lambda items: None, interval=10, jitter=2)
+    deadlines = [job.plan(100, first=True)] + [job.plan(100 + 10 * i) for i in range(1, 50)]
+    for i, deadline in enumerate(deadlines):
+        assert abs(deadline - (110 + 10 * i)) <= 2
+
+
+def test_new_interval_of_the_policy_starts_a_new_rhythm():
+    policy = Policy(10)
+    job = Job(lambda items: None, interval=10, policy=policy)
+    assert job.plan(100, first=True) == 110
+    policy.current = 60
+    assert job.plan(112) == 172
+    assert job.plan(173) == 232
+
+
+def test_job_needs_an_interval_or_a_daily_time():
+    for kwargs in ({}, {'interval': 10, 'at': '06:00'}, {'interval': 0}):
+        try:
+            Job(lambda items: None, **kwargs)
+        except ValueError:
+            continue
+        raise AssertionError('Job accepted {}'.format(kwargs))
+
+
+def test_jobs_due_within_the_slack_run_together():
+    clock = Clock()
+    runs = Runs()
+    scheduler = Scheduler(clock=clock, sleep=lambda seconds: None, slack=1.0)
+    for item, interval in (('a', 10), ('b', 10.5), ('c', 20)):
+        scheduler.add(Job(runs, item, interval=interval))
+    assert scheduler.next_deadline() == 1010
+    clock.now = 1010
+    # b keeps its own rhythm after the early run, c is next
+    assert scheduler.run_pending() == 10
+    assert runs == [['a', 'b']]
+
+
+def test_cancelled_and_woken_jobs():
+    clock = Clock()
+    runs = Runs()
+    scheduler = Scheduler(clock=clock, sleep=lambda seconds: None, slack=0.0)
+    first = scheduler.add(Job(runs, 'a', interval=10))
+    second = scheduler.add(Job(runs, 'b', interval=10))
+    scheduler.cancel(first)
+    scheduler.wake(second)
+    scheduler.run_pending()
+    assert runs == [['b']]
+    # the early run counts as the due one, the rhythm goes on
+    clock.now = 1010
+    scheduler.run_pending()
+    assert runs == [['b']]
+    clock.now = 1020
+    scheduler.run_pending()
+    assert runs == [['b'], ['b']]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import errno
+import io
+import os
+import threading
+import time
+
+from watchman.squad import RC_TIMEOUT, QstatFGuard, Watchman, expand_hosts, iter_queue_states
+
+
+class Shell(Watchman):
+    def __init__(self, name, script, **kwargs):
+        super(Shell, self).__init__(name, **kwargs)
+        self.command = ['sh', '-c', script]
+
+    def _check_output(self, return_code, out, error):
+        return [] if return_code == 0 else [(self._name, self._command, return_code, out.strip())]
+
+
+def is_gone(pid, wait=2.0):
+    end = time.time() + wait
+    while time.time() < end:
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.ESRCH
+        time.sleep(0.05)
+    return False
+
+
+def test_plain_hostname_stays():
+    assert expand_hosts('gw-blus') == ['gw-blus']
+
+
+def test_ranges_keep_leading_zeros():
+    assert expand_hosts('ekpblus[001-003,007]') == ['ekpblus001', 'ekpblus002', 'ekpblus003', 'ekpblus007']
+    assert expand_hosts('ekpgpu[8-11]') == ['ekpgpu8', 'ekpgpu9', 'ekpgpu10', 'ekpgpu11']
+
+
+def test_several_ranges_give_the_cartesian_product():
+    assert expand_hosts('rack[1-2]-node[01-02].ekp') == ['rack1-node01.ekp', 'rack1-node02.ekp',
+                                                        'rack2-node01.ekp', 'rack2-node02.ekp']
+
+
+def test_timed_out_command_is_killed_with_its_process_group(tmpdir):
+    pid_file = tmpdir.join('pid')
+    guard = Shell('Hanging qstat', 'sleep 30 & echo $! > {}; wait'.format(pid_file), timeout=0.3)
+    alerts = []
+    start = time.time()
+    guard.guard(alerts)
+    assert time.time() - start < 1.5
+    assert alerts == [('Hanging qstat', guard.command, RC_TIMEOUT, 'Command timed out after 0.3s.')]
+    assert guard.last_result.return_code == RC_TIMEOUT
+    # the background child of the shell is gone as well
+    assert is_gone(int(pid_file.read()))
+
+
+def test_aborted_guard_ends_at_once():
+    guard = Shell('Black hole', 'sleep 30')
+    alerts = []
+    watch = threading.Thread(target=guard.guard, args=(alerts,))
+    start = time.time()
+    watch.start()
+    time.sleep(0.2)
+    guard.abort()
+    watch.join(5)
+    assert not watch.is_alive() and time.time() - start < 1.5
+    assert [alert[2] for alert in alerts] == [RC_TIMEOUT]
+
+
+class Trickle(io.BytesIO):
+    """
+    Stream which hands out its data a few bytes at a time, like a slow pipe.
+    """
+    def read(self, size=-1):
+        return super(Trickle, self).read(7)
+
+
+def test_queue_states_are_parsed_from_a_trickling_stream(qstat_xml):
+    xml = qstat_xml([('all.q@blus001', '', 0.5, 8), ('all.q@blus002', 'au', 0.0, 8), ('gpu.q@gpu01', 'E', 2, 4)])
+    # the state of the job lists is not taken for the state of the queue
+    assert list(iter_queue_states(Trickle(xml.encode('utf-8')))) == [
+        ('all.q@blus001', None), ('all.q@blus002', 'au'), ('gpu.q@gpu01', 'E')]
+
+
+def test_qstat_guard_alerts_unusable_queues(commands, qstat_xml):
+    commands.add('qstat', qstat_xml([('all.q@blus{:03d}'.format(i), 'd' if i == 1 else 'au' if i == 2 else '', 0.5, 8)
+                                     for i in range(500)]))
+    alerts = []
+    QstatFGuard('Queues').guard(alerts)
+    assert [alert[3] for alert in alerts] == ['Queue all.q@blus002 is not available or set to ERROR.']
+
+
+def test_qstat_guard_alerts_invalid_xml(commands):
+    commands.add('qstat', '<job_info><queue_info>')
+    alerts = []
+    QstatFGuard('Queues').guard(alerts)
+    assert len(alerts) == 1 and alerts[0][3].startswith('Could not parse qstat output.')
+
+
+def test_qstat_guard_reports_only_the_transitions_of_changed_queues(commands, qstat_xml):
+    guard = QstatFGuard('Queues')
+    transitions = []
+    for queues in ([('q1', 'au', 0, 8), ('q2', '', 0, 8)], [('q1', 'au', 0, 8), ('q2', '', 0, 8)],
+                   [('q1', '', 0, 8), ('q2', 'E', 0, 8)], [('q1', 'd', 0, 8)]):
+        commands.add('qstat', qstat_xml(queues))
+        alerts = []
+        guard.guard(alerts)
+        transitions.append(sorted(guard.transitions))
+    assert transitions == [[('q1', None, 'au')], [], [('q1', 'au', None), ('q2', None, 'E')], [('q2', 'E', None)]]
+    # a disabled queue is no error, the vanished one is not failing any more
+    assert alerts == []
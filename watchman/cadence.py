@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Adaptive check frequency.
+
+Guards which stay healthy are watched less and less often, up to a maximal
+interval. After a failure or any other change of its alerts a guard is
+watched at the minimal interval again. The alerts of a healthy guard which
+starts to fail are held back, its job runs it again after a short delay, and
+only alerts which are still raised after a few retries are passed on, so a
+single lost ping does not page anybody. A failure which is gone before it was
+confirmed counts as a change as well.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval(object):
+    """
+    Interval of one guard, adapted to the alerts of its watches.
+
+    * no alerts: after ``healthy_runs`` healthy watches in a row the interval is multiplied by ``factor``,
+      up to ``max_interval``
+    * alerts changed (new failure, different failure or recovery): the interval drops to ``min_interval``
+    * same alerts as before: the guard is known to fail, it is watched at its base interval
+    * failure not confirmed yet: the guard is watched again after the retry delay of the :class:`Cadence`
+
+    :param interval: base interval of the guard in seconds
+    :type interval: float
+
+    :param min_interval: interval after a change
+    :type min_interval: float
+
+    :param max_interval: longest interval of a healthy guard
+    :type max_interval: float
+
+    :param factor: stretch factor
+    :type factor: float
+
+    :param healthy_runs: healthy watches in a row before the interval is stretched
+    :type healthy_runs: int
+    """
+    def __init__(self, interval, min_interval, max_interval, factor=2.0, healthy_runs=3):
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.factor = factor
+        self.healthy_runs = healthy_runs
+        self.current = interval
+        self.state = frozenset()
+        self._streak = 0
+
+    @property
+    def healthy(self):
+        """
+        Get if the last watch raised no alerts.
+
+        :return: True if healthy
+        :rtype: bool
+        """
+        return len(self.state) == 0
+
+    def observe(self, state):
+        """
+        Adapt the interval to the result of a watch.
+
+        :param state: the alerts of the watch, as (command, message) pairs
+        :type state: frozenset
+
+        :return: the new interval
+        :rtype: float
+        """
+        changed = state != self.state
+        self.state = state
+        if changed:
+            self.current = self.min_interval
+            self._streak = 0
+        elif len(state) > 0:
+            self.current = self.interval
+            self._streak = 0
+        else:
+            self._streak += 1
+            if self._streak >= self.healthy_runs:
+                self.current = min(self.max_interval, self.current * self.factor)
+                self._streak = 0
+        return self.current
+
+    def retry(self, delay):
+        """
+        Watch the guard again after delay seconds, its state is kept until the retries are over.
+
+        :param delay: seconds until the retry
+        :type delay: float
+        """
+        self.current = delay
+        self._streak = 0
+
+    def flapped(self):
+        """
+        A failure is gone before it was confirmed: watch the guard at the minimal interval.
+        """
+        self.current = self.min_interval
+        self._streak = 0
+
+
+class Cadence(object):
+    """
+    Adaptive intervals and failure confirmation for a set of guards.
+
+    The jobs of the guards read their interval from the :class:`AdaptiveInterval` returned by :meth:`policy`.
+
+    :param min_interval: interval after a change of the alerts of a guard
+    :type min_interval: float
+
+    :param max_interval: longest interval of a healthy guard
+    :type max_interval: float
+
+    :param factor: stretch factor of healthy guards
+    :type factor: float
+
+    :param healthy_runs: healthy watches in a row before an interval is stretched
+    :type healthy_runs: int
+
+    :param retries: a healthy guard which raises alerts is sent on watch this many times again,
+                    only alerts which are still raised are passed on
+    :type retries: int
+
+    :param retry_delay: seconds between the retries
+    :type retry_delay: float
+    """
+    def __init__(self, min_interval, max_interval, factor=2.0, healthy_runs=3, retries=2, retry_delay=10.0):
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._factor = factor
+        self._healthy_runs = healthy_runs
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._policies = {}
+        # name of a guard -> retries of its failure which is not confirmed yet
+        self._retried = {}
+
+    def policy(self, guard, interval):
+        """
+        Get the adaptive interval of a guard.
+
+        :param guard: the guard
+        :type guard: Watchman
+
+        :param interval: base interval of the guard
+        :type interval: float
+
+        :return: adaptive interval
+        :rtype: AdaptiveInterval
+        """
+        if guard.name not in self._policies or self._policies[guard.name].interval != interval:
+            self._policies[guard.name] = AdaptiveInterval(interval, self._min_interval, self._max_interval,
+                                                          self._factor, self._healthy_runs)
+        return self._policies[guard.name]
+
+    def confirm(self, guards, alerts):
+        """
+        Hold back the alerts of guards which were healthy until retries confirm them.
+        The job of such a guard runs it again after ``retry_delay`` seconds.
+
+        :param guards: guards of the sweep
+        :type guards: list
+
+        :param alerts: alerts of the sweep
+        :type alerts: list
+
+        :return: guards and alerts to hand on, without the guards whose alerts are held back
+        :rtype: tuple
+        """
+        alerting = set(alert[0] for alert in alerts)
+        held = set()
+        for guard in guards:
+            policy = self._policies.get(guard.name)
+            if policy is None:
+                continue
+            retried = self._retried.pop(guard.name, None)
+            if guard.name in alerting:
+                if policy.healthy and (retried or 0) < self._retries:
+                    self._retried[guard.name] = (retried or 0) + 1
+                    policy.retry(self._retry_delay)
+                    held.add(guard.name)
+                    _logger.info('Confirm alerts of {}, retry {} in {:.0f}s.'.format(
+                        guard.name, self._retried[guard.name], self._retry_delay))
+            elif retried is not None:
+                _logger.info('{} recovered before its alerts were confirmed.'.format(guard.name))
+                policy.flapped()
+        if len(held) == 0:
+            return guards, alerts
+        return [guard for guard in guards if guard.name not in held], [alert for alert in alerts
+                                                                        if alert[0] not in held]
+
+    def observe(self, guards, alerts):
+        """
+        Adapt the intervals of the guards to the alerts of a sweep.
+
+        :param guards: guards of the sweep
+        :type guards: list
+
+        :param alerts: alerts of the sweep
+        :type alerts: list
+        """
+        states = dict((guard.name, set()) for guard in guards)
+        for name, command, return_code, message in alerts:
+            if name in states:
+                states[name].add((' '.join(command), message))
+        for guard in guards:
+            policy = self._policies.get(guard.name)
+            if policy is None:
+                continue
+            previous = policy.current
+            if policy.observe(frozenset(states[guard.name])) != previous:
+                _logger.info('Watch {} every {:.0f}s.'.format(guard.name, policy.current))
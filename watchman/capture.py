@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bounded capture of command output.
+
+By default a guard keeps the complete stdout and stderr of its command. A
+capture mode limits the memory a chatty command can take. It applies to
+stdout; stderr ends up in the alert mails, so with any capture mode only its
+first and last bytes are kept:
+
+* :class:`Discard` reads the output and throws it away
+* :class:`HeadTail` keeps the first and the last bytes
+* :class:`Spool` keeps small output in memory and moves larger output to a temporary file,
+  the guard then gets a :class:`SpooledText`, which offers the lines like a string
+
+Reports only show an :func:`excerpt` of the output in any case. A spooled output is
+closed once the guard checked it, the guard keeps its excerpt.
+"""
+from __future__ import division, print_function, absolute_import
+
+import tempfile
+
+_CHUNK = 65536
+
+
+def _skipped(count):
+    return '\n[... {} bytes skipped ...]\n'.format(count)
+
+
+class _Capture(object):
+    """
+    Base of the capture modes: :meth:`read` feeds a stream chunk by chunk into a :meth:`collector`.
+    """
+    def read(self, stream):
+        """
+        Read a stream until it ends.
+
+        :param stream: pipe of the command
+        :type stream: file
+
+        :return: the captured output
+        :rtype: str
+        """
+        collector = self.collector()
+        for chunk in iter(lambda: stream.read(_CHUNK), b''):
+            collector.write(chunk)
+        return collector.value()
+
+    def collector(self):
+        """
+        Get a collector for output which arrives in chunks, e.g. in an event loop.
+
+        :return: object with write(chunk) and value()
+        :rtype: object
+        """
+        raise NotImplementedError
+
+
+class Everything(_Capture):
+    """
+    Keep the complete output, what a guard without capture mode does.
+    """
+    def collector(self):
+        return _Chunks()
+
+    def __str__(self):
+        return 'all'
+
+
+class _Chunks(object):
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+
+    def value(self):
+        return b''.join(self._chunks)
+
+
+class Discard(_Capture):
+    """
+    Read the output and throw it away, only the return code counts.
+    """
+    def collector(self):
+        return _Nothing()
+
+    def __str__(self):
+        return 'discard'
+
+
+class _Nothing(object):
+    def write(self, chunk):
+        pass
+
+    def value(self):
+        return ''
+
+
+class HeadTail(_Capture):
+    """
+    Keep the first ``head`` and the last ``tail`` bytes of the output.
+
+    :param head: bytes kept from the beginning
+    :type head: int
+
+    :param tail: bytes kept from the end
+    :type tail: int
+    """
+    def __init__(self, head=4096, tail=4096):
+        self.head = head
+        self.tail = tail
+
+    def collector(self):
+        return _HeadTail(self.head, self.tail)
+
+    def __str__(self):
+        return 'head_tail {} {}'.format(self.head, self.tail)
+
+
+class _HeadTail(object):
+    def __init__(self, head, tail):
+        self._head_size = head
+        self._tail_size = tail
+        self._head = b''
+        self._tail = b''
+        self._skipped = 0
+
+    def write(self, chunk):
+        if len(self._head) < self._head_size:
+            missing = self._head_size - len(self._head)
+            self._head += chunk[:missing]
+            chunk = chunk[missing:]
+        self._tail += chunk
+        if len(self._tail) > self._tail_size:
+            self._skipped += len(self._tail) - self._tail_size
+            self._tail = self._tail[len(self._tail) - self._tail_size:]
+
+    def value(self):
+        if self._skipped == 0:
+            return self._head + self._tail
+        return self._head + _skipped(self._skipped) + self._tail
+
+
+class Spool(_Capture):
+    """
+    Keep the output in memory up to ``threshold`` bytes, write larger output to a temporary file.
+    The guard then gets a :class:`SpooledText` instead of a string.
+
+    :param threshold: bytes kept in memory
+    :type threshold: int
+    """
+    def __init__(self, threshold=1024 * 1024):
+        self.threshold = threshold
+
+    def collector(self):
+        return _Spool(self.threshold)
+
+    def __str__(self):
+        return 'spool {}'.format(self.threshold)
+
+
+class _Spool(object):
+    def __init__(self, threshold):
+        self._threshold = threshold
+        self._chunks = []
+        self._size = 0
+        self._spool = None
+
+    def write(self, chunk):
+        if self._spool is not None:
+            self._spool.write(chunk)
+            return
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size > self._threshold:
+            self._spool = tempfile.TemporaryFile(prefix='watchman-')
+            self._spool.write(b''.join(self._chunks))
+            self._chunks = None
+
+    def value(self):
+        if self._spool is None:
+            return b''.join(self._chunks)
+        return SpooledText(self._spool)
+
+
+class SpooledText(object):
+    """
+    Output which :class:`Spool` moved to a temporary file. It reads like a file and
+    gives its lines like a string, without loading the whole output into memory.
+
+    :param spool: the temporary file
+    :type spool: file
+    """
+    def __init__(self, spool):
+        self._spool = spool
+        self._spool.seek(0)
+
+    def read(self, size=-1):
+        return self._spool.read(size)
+
+    def seek(self, offset, whence=0):
+        self._spool.seek(offset, whence)
+
+    def tell(self):
+        return self._spool.tell()
+
+    def __iter__(self):
+        self._spool.seek(0)
+        return iter(self._spool)
+
+    def splitlines(self):
+        """
+        Get the lines without their line ends, like str.splitlines, but one after the other.
+
+        :return: generator of lines
+        :rtype: generator
+        """
+        for line in self:
+            yield line.rstrip(b'\r\n')
+
+    def close(self):
+        self._spool.close()
+
+
+def parse_capture(value):
+    """
+    Create a capture mode from its description, e.g. in an INI file.
+
+    :param value: 'all', 'discard', 'head_tail [head [tail]]' or 'spool [threshold]', sizes in bytes
+    :type value: str
+
+    :return: capture mode, None for 'all'
+    :rtype: object
+    """
+    parts = value.split()
+    kind, sizes = parts[0] if len(parts) > 0 else 'all', [int(size) for size in parts[1:]]
+    if kind == 'all' and len(sizes) == 0:
+        return None
+    if kind == 'discard' and len(sizes) == 0:
+        return Discard()
+    if kind == 'head_tail' and len(sizes) <= 2:
+        return HeadTail(*sizes)
+    if kind == 'spool' and len(sizes) <= 1:
+        return Spool(*sizes)
+    raise ValueError('Unknown capture mode {}'.format(value))
+
+
+def excerpt(output, limit=4096):
+    """
+    Shorten output for a report to its first and last bytes.
+
+    :param output: captured output, a string or a spooled output
+    :type output: str or SpooledText
+
+    :param limit: maximal number of bytes of the output shown (None: everything)
+    :type limit: int
+
+    :return: the output, shortened if it is longer than the limit
+    :rtype: str
+    """
+    if hasattr(output, 'read'):
+        output.seek(0, 2)
+        size = output.tell()
+        output.seek(0)
+        if limit is None or size <= limit:
+            text = output.read()
+        else:
+            head = output.read(limit // 2)
+            output.seek(size - (limit - limit // 2))
+            text = head + _skipped(size - limit) + output.read()
+        output.seek(0)
+        return text
+    if limit is None or not isinstance(output, (str, bytes)) or len(output) <= limit:
+        return output
+    return output[:limit // 2] + _skipped(len(output) - limit) + output[len(output) - (limit - limit // 2):]
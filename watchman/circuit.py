@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Dependencies between the guards of a sweep, shared by the runners.
+
+A guard which depends on a parent guard waits until the parent finished its
+watch in the same sweep. While the parent fails (circuit open) the guard is
+skipped, and instead of the alerts of all children the sweep reports one
+root-cause alert per failing parent. The alert only names the parent, so it is
+the same in every sweep and the Logbook sends it once. A parent which fails in
+a sweep without its children repeats the alert, so the alert is only resolved
+when the parent recovers.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import logging
+
+from watchman.squad import RC_CIRCUIT_OPEN
+
+_logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN_MESSAGE = 'Circuit open, dependent guards are skipped.'
+
+
+class CircuitBreaker(object):
+    """
+    Bookkeeping of the dependencies in one sweep. The guards are tracked by their
+    position in the sweep, a guard listed twice is watched twice, one watch after
+    the other. The breaker is not thread-safe, the Patrol calls it under its lock.
+
+    :param guards: guards of the sweep
+    :type guards: list
+    """
+    def __init__(self, guards):
+        self._guards = guards
+        self._waiting = list(reversed(range(len(guards))))
+        # index -> guard on watch, the guard objects on watch
+        self._running = {}
+        self._busy = set()
+        self._members = set(guards)
+        # guard -> number of its watches which did not finish yet
+        self._pending = collections.Counter(guards)
+        # guards which failed or were skipped in this sweep -> root cause
+        self._failed = {}
+        # failing parents which already opened the circuit in an earlier sweep
+        self._still_open = []
+        self.skipped = collections.OrderedDict()
+
+    @property
+    def waiting(self):
+        """
+        Get the number of guards which did not start yet.
+
+        :return: number of waiting guards
+        :rtype: int
+        """
+        return len(self._waiting)
+
+    def take(self):
+        """
+        Take the next waiting guard whose parent finished. A guard whose parent fails is
+        marked as skipped and returned with its root cause, it does not go on watch.
+
+        :return: index, guard and root cause (None: the guard goes on watch) or None if
+                 no guard can start until a guard on watch finished
+        :rtype: tuple
+        """
+        for position in range(len(self._waiting) - 1, -1, -1):
+            index = self._waiting[position]
+            guard = self._guards[index]
+            if self._pending[guard.depends_on] > 0 or guard in self._busy:
+                continue
+            del self._waiting[position]
+            root = self._root_cause(guard.depends_on)
+            if root is None:
+                guard.skipped_by = None
+                self._running[index] = guard
+                self._busy.add(guard)
+            else:
+                guard.skipped_by = root
+                self._failed[guard] = root
+                self.skipped.setdefault(root, []).append(guard)
+                self._pending[guard] -= 1
+            return index, guard, root
+        return None
+
+    def _root_cause(self, parent):
+        """
+        Get the guard whose failure opens the circuit for the children of parent.
+
+        :return: failing guard or None if the parent is fine
+        :rtype: Watchman
+        """
+        if parent is None:
+            return None
+        if parent in self._members:
+            return self._failed.get(parent)
+        # the parent is not on watch in this sweep, its last watch counts
+        if parent.skipped_by is not None:
+            return parent.skipped_by
+        return parent if parent.failing else None
+
+    def finish(self, index, alerts):
+        """
+        Hand in the alerts of a guard.
+
+        :param index: position of the guard in the sweep
+        :type index: int
+
+        :param alerts: alerts of the guard
+        :type alerts: list
+        """
+        guard = self._guards[index]
+        guard.failing = len(alerts) > 0
+        if guard.failing:
+            self._failed[guard] = guard
+            if guard.circuit_open:
+                self._still_open.append(guard)
+        else:
+            guard.circuit_open = False
+        self._running.pop(index, None)
+        self._busy.discard(guard)
+        self._pending[guard] -= 1
+
+    def call_off(self):
+        """
+        End the sweep.
+
+        :return: guards still running and guards never started
+        :rtype: tuple
+        """
+        running = [self._running[index] for index in sorted(self._running)]
+        waiting = [self._guards[index] for index in reversed(self._waiting)]
+        self._running.clear()
+        self._waiting = []
+        return running, waiting
+
+    def root_causes(self):
+        """
+        Create one alert per failing parent whose children are skipped.
+
+        :return: root-cause alerts
+        :rtype: list
+        """
+        roots = collections.OrderedDict(self.skipped)
+        for root in self._still_open:
+            roots.setdefault(root, [])
+        alerts = []
+        for root, children in roots.items():
+            root.circuit_open = True
+            if len(children) > 0:
+                _logger.warning('{} fails, skipped {} dependent guards: {}'.format(
+                    root, len(children), ', '.join(sorted(child.name for child in children))))
+            alerts.append((root.name, root.command, RC_CIRCUIT_OPEN, CIRCUIT_OPEN_MESSAGE))
+        return alerts
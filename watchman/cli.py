@@ -3,15 +3,20 @@
 from __future__ import division, print_function, absolute_import
 
 import click
-import sys
+import collections
+import functools
 import logging
-from logging.handlers import SysLogHandler
-import daemon
+import os
+import signal
+import threading
 import time
-import schedule
 
-from watchman import __version__
+from watchman import __version__, metrics
 from watchman.squad import PingGuard, RadioOperator, QstatFGuard
+from watchman.logbook import Logbook
+from watchman.patrol import Patrol
+from watchman.roster import ConfigWatcher, Roster
+from watchman.scheduler import Job, Scheduler
 
 __author__ = "Michael Ziegler"
 __copyright__ = "Michael Ziegler"
@@ -21,20 +26,116 @@ _logger = logging.getLogger()
 #_handler = SysLogHandler(address='/dev/log')
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('--as_daemon', '-d', is_flag=True, default=False, help='Start watchman as a daemon.')
 @click.option('--config', '-c', type=str, default='/usr/share/watchman_config/default.py', help='path to config file')
-def cli(config, as_daemon):
-    config = __load_config(config)
+@click.option('--role', type=click.Choice(['standalone', 'coordinator', 'worker']), default='standalone',
+              help='run all guards, only collect the alerts of the workers or run the shard of one worker')
+@click.option('--worker', '-w', type=str, default=None, help='name of the worker, one of the workers in the config')
+@click.pass_context
+def cli(ctx, config, as_daemon, role, worker):
+    config_file = config
+    if ctx.invoked_subcommand is not None:
+        # the subcommands load the config themselves, so --help works without it
+        ctx.obj = config_file
+        return
+    config = __load_config(config_file)
+    if role == 'worker' and worker not in getattr(config, 'workers', []):
+        raise click.BadParameter('A worker needs a name out of the workers in the config.', param_hint='--worker')
     if as_daemon:
+        import daemon
         with daemon.DaemonContext():
-            run(config)
+            run(config, role, worker, config_file)
     else:
         _stream_handler = logging.StreamHandler()
         _formatter = logging.Formatter(fmt='[%(asctime)s][%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         _stream_handler.setFormatter(_formatter)
         _logger.addHandler(_stream_handler)
-        run(config)
+        run(config, role, worker, config_file)
+
+
+@cli.command()
+@click.argument('guards', nargs=-1)
+@click.option('--days', type=float, default=30, help='look back this many days')
+@click.option('--percentile', '-p', type=float, multiple=True, default=[50, 95], help='duration percentiles to show')
+@click.pass_obj
+def history(config_file, guards, days, percentile):
+    """
+    Show availability and durations of guards from the history.
+    """
+    from watchman.history import History
+    config = __load_config(config_file)
+    if getattr(config, 'history_dir', None) is None:
+        raise click.ClickException('No history_dir in the config.')
+    store = History(config.history_dir)
+    since = time.time() - days * 24 * 60 * 60
+    for name in guards or store.guards():
+        availability = store.availability(name, since=since)
+        if availability is None:
+            click.echo('{}: no results'.format(name))
+            continue
+        durations = ', '.join('p{:g} {:.2f}s'.format(q, store.percentile(name, q, since=since)) for q in percentile)
+        click.echo('{}: availability {:.2%}, duration {}'.format(name, availability, durations))
+
+
+@cli.command()
+@click.pass_obj
+def status(config_file):
+    """
+    Show the last results of all guards of the running watchman.
+    """
+    now = time.time()
+    for guard in __ask_watchman(__load_config(config_file), lambda client: client.status(), timeout=10):
+        if guard['timestamp'] is None:
+            click.echo('{}: {}'.format(guard['name'], guard['state']))
+            continue
+        click.echo('{}: {}, return code {}, {:.0f}s ago, took {:.1f}s'.format(
+            guard['name'], guard['state'], guard['return_code'], now - guard['timestamp'], guard['duration']))
+
+
+@cli.command()
+@click.argument('guards', nargs=-1)
+@click.option('--max-age', type=float, default=None, help='run guards whose last result is older (seconds)')
+@click.option('--refresh', '-r', is_flag=True, default=False, help='run the guards now')
+@click.pass_obj
+def check(config_file, guards, max_age, refresh):
+    """
+    Report guards of the running watchman, from their cached results unless they are refreshed.
+    """
+    config = __load_config(config_file)
+    # a refresh waits for the sweep on the scheduler thread of the watchman
+    timeout = getattr(config, 'sweep_budget', config.interval) + 60
+    reports = __ask_watchman(config, lambda client: client.check(guards, max_age=0 if refresh else max_age),
+                             timeout=timeout)
+    click.echo('\n\n-----------------\n'.join(reports))
+
+
+def __ask_watchman(config, ask, timeout=None):
+    """
+    Ask the running watchman over its control socket.
+
+    :param config: loaded config
+    :type config: module
+
+    :param ask: callable getting the ControlClient
+    :type ask: callable
+
+    :param timeout: socket timeout in seconds
+    :type timeout: float
+
+    :return: answer of ask
+    """
+    import socket
+    from watchman.control import ControlClient
+    path = getattr(config, 'control_socket', None)
+    if path is None:
+        raise click.ClickException('No control_socket in the config.')
+    try:
+        return ask(ControlClient(os.path.expanduser(path), timeout=timeout))
+    except socket.error as e:
+        raise click.ClickException('Cannot reach watchman at {}: {}'.format(path, e))
+    except ValueError as e:
+        raise click.ClickException(str(e))
 
 
 def __load_config(config):
@@ -43,52 +144,282 @@ def __load_config(config):
     return config
 
 
-def __send_status_report(rto, guards):
+def __send_status_report(rto, guards, watch, max_age):
     """
-    Send a status report of all guards to the admin
+    Send a status report of all guards to the admin.
+    Guards without a result younger than max_age are sent on watch again, their alerts are handed on as in a sweep.
+    Guards which the refresh skipped or aborted are reported from their last result, they are never run
+    again while the report is built.
 
-    :param rto: Actual RadioOperator
+    :param rto: Actual RadioOperator, the CoordinatorClient on a worker
     :type rto: RadioOperator
 
     :param guards: list of guards
     :type guards: list
+
+    :param watch: callable which sends a list of guards on watch and hands their alerts on
+    :type watch: callable
+
+    :param max_age: seconds a result may be old to be reported
+    :type max_age: float
+    """
+    start = time.time()
+    stale = [guard for guard in guards
+             if guard.last_result is None or start - guard.last_result.timestamp > max_age]
+    if len(stale) > 0:
+        _logger.info('Refresh {} stale guards for the status report.'.format(len(stale)))
+        watch(stale)
+    reports = []
+    for guard in guards:
+        result = guard.last_result
+        if guard.skipped_by is not None:
+            note = 'was skipped in the last sweep, {} fails'.format(guard.skipped_by.name)
+        else:
+            note = 'did not finish in the last sweep'
+        if result is None:
+            reports.append('{} has no result, it {}.'.format(guard.name, note))
+            continue
+        report = guard.report_back(max_age=float('inf'))
+        if result.timestamp < start and guard in stale:
+            report = '{} {}, its last result follows.\n{}'.format(guard.name, note, report)
+        reports.append(report)
+    rto.send_status_report('\n\n-----------------\n'.join(reports))
+
+
+def __select_guards(config, role, worker):
+    """
+    Get the guards of this watchman: all guards or the shard of a worker.
     """
-    reports = '\n\n-----------------\n'.join([guard.report_back() for guard in guards])
-    rto.send_status_report(reports)
+    if role != 'worker':
+        return config.guards
+    from watchman.distributed import HashRing
+    return HashRing(config.workers).shard(config.guards, worker)
 
 
-def __start_the_watch(guards, rto):
+def __dispatch_alerts(guards, alerts, rto, logbook):
     """
-    Send the guards on watch and send possible alerts via the rto
+    Send new, repeated or resolved alerts via the rto
 
-    :param guards: list of guards
+    :param guards: guards which were on watch or their names
     :type guards: list
 
+    :param alerts: alerts of the sweep
+    :type alerts: list
+
     :param rto: RadioOperator
     :type rto: RadioOperator
+
+    :param logbook: Logbook with the open alerts
+    :type logbook: Logbook
     """
-    alerts = []
-    for guard in guards:
-        guard.guard(alerts)
+    alerts, recoveries = logbook.triage(guards, alerts)
     if len(alerts) > 0:
         rto.send_alerts(alerts)
+    if len(recoveries) > 0:
+        rto.send_recoveries(recoveries)
 
 
-def run(config):
+def __refresh_guards(guards, scheduler, watch, timeout):
+    """
+    Let the scheduler thread send guards on watch and wait for it, so refreshes
+    do not race with the scheduled sweeps and their alerts are handed on.
+
+    :param guards: guards to refresh
+    :type guards: list
+
+    :param scheduler: Scheduler running the sweeps
+    :type scheduler: Scheduler
+
+    :param watch: callable which sends a list of guards on watch and hands their alerts on
+    :type watch: callable
+
+    :param timeout: seconds to wait for the refresh, afterwards the cached results are reported
+    :type timeout: float
+    """
+    done = threading.Event()
+
+    def refresh():
+        try:
+            watch(guards)
+        finally:
+            done.set()
+    scheduler.call(refresh)
+    if not done.wait(timeout):
+        _logger.warning('Refresh of {} guards did not finish within {}s.'.format(len(guards), timeout))
+
+
+def __retire_guards(guards, dispatch):
+    """
+    Close the open alerts of guards which are not on duty any more and drop their metrics.
+
+    :param guards: guards removed from the config
+    :type guards: list
+
+    :param dispatch: callable getting the guards and the alerts of a sweep
+    :type dispatch: callable
+    """
+    _logger.info('Retire {} guards: {}'.format(len(guards), ', '.join(guard.name for guard in guards)))
+    # a sweep without alerts resolves the open alerts of the guards
+    dispatch(guards, [])
+    for guard in guards:
+        metrics.remove_guard(guard.name)
+
+
+def __start_the_watch(guards, patrol, dispatch, history=None, metrics_file=None, cadence=None):
+    """
+    Send the guards on watch and hand their alerts on
+
+    :param guards: list of guards
+    :type guards: list
+
+    :param patrol: Patrol which sends the guards on watch in parallel
+    :type patrol: Patrol
+
+    :param dispatch: callable getting the guards and the alerts of the sweep,
+                     sends them via the rto or reports them to the coordinator
+    :type dispatch: callable
+
+    :param history: History which records the results of the guards
+    :type history: History
+
+    :param metrics_file: the metrics are written to this file after the sweep
+    :type metrics_file: str
+
+    :param cadence: Cadence which confirms new alerts and adapts the intervals of the guards
+    :type cadence: Cadence
+    """
+    start = time.time()
+    alerts = patrol.march(guards)
+    # guards skipped because their parent fails keep their state
+    guards = [guard for guard in guards if guard.skipped_by is None]
+    if cadence is not None:
+        # held back alerts are neither sent nor resolved, the guards are watched again soon
+        guards, alerts = cadence.confirm(guards, alerts)
+        cadence.observe(guards, alerts)
+    duration = time.time() - start
+    metrics.SWEEP_DURATION.observe(duration)
+    _logger.info('Sweep over {} guards took {:.1f}s.'.format(len(guards), duration))
+    if history is not None:
+        counts = collections.Counter(alert[0] for alert in alerts)
+        for guard in guards:
+            # aborted or skipped guards still hold the result of an earlier sweep
+            if guard.last_result is not None and guard.last_result.timestamp >= start:
+                history.record(guard, counts[guard.name])
+    dispatch(guards, alerts)
+    if metrics_file is not None:
+        metrics.write_textfile(metrics_file)
+
+
+def run(config, role='standalone', worker=None, config_file=None):
+    """
+    Run the watch until the process ends.
+
+    :param config: loaded config
+    :type config: module
+
+    :param role: 'standalone' runs all guards, 'coordinator' sends the alerts reported by the workers,
+                 'worker' runs the guards of its shard and reports their alerts to the coordinator
+    :type role: str
+
+    :param worker: name of the worker, one of config.workers
+    :type worker: str
+
+    :param config_file: path of the config, the guards are reloaded when it changes or on SIGHUP
+    :type config_file: str
+    """
     _handler = logging.FileHandler(config.log_file)
     _formatter = logging.Formatter(fmt='[%(asctime)s][%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     _handler.setFormatter(_formatter)
     _logger.addHandler(_handler)
     _logger.setLevel(logging.INFO)
 
-    _logger.info('Start watchman')
+    _logger.info('Start watchman as {}'.format(worker or role))
+
+    from watchman.courier import Courier
+    courier = Courier(host=getattr(config, 'smtp_host', 'localhost'), port=getattr(config, 'smtp_port', 25),
+                      retries=getattr(config, 'smtp_retries', 3)).start()
+    rto = RadioOperator('RTO1', from_mail=config.from_mail, admin_mail=config.admin_email,
+                        courier=courier, digest_window=getattr(config, 'digest_window', 0))
+    if getattr(config, 'metrics_port', None) is not None:
+        metrics.serve(config.metrics_port)
+
+    # the status reports of the workers are mailed by the coordinator
+    reporter = rto
+    if role == 'worker':
+        from watchman.distributed import CoordinatorClient
+        reporter = CoordinatorClient(worker, config.coordinator_address,
+                                     secret=getattr(config, 'coordinator_secret', None))
+        dispatch = reporter.report
+    else:
+        logbook = Logbook(getattr(config, 'state_file', None), renotify=getattr(config, 'renotify_interval', None))
+        dispatch = functools.partial(__dispatch_alerts, rto=rto, logbook=logbook)
+    if role == 'coordinator':
+        from watchman.distributed import Coordinator, StatusCollector
+        collector = StatusCollector(config.workers, rto.send_status_report,
+                                    wait=getattr(config, 'status_wait', 600))
+        Coordinator(config.coordinator_address, dispatch, status=collector.collect,
+                    secret=getattr(config, 'coordinator_secret', None), workers=config.workers,
+                    silence=getattr(config, 'worker_silence', None)).serve_forever()
+        return
+
+    if getattr(config, 'runner', 'threads') == 'loop':
+        from watchman.loop import GuardLoop
+        patrol = GuardLoop(max_running=getattr(config, 'max_running', 256),
+                           budget=getattr(config, 'sweep_budget', config.interval))
+    else:
+        patrol = Patrol(max_parallel=getattr(config, 'max_parallel', 16),
+                        budget=getattr(config, 'sweep_budget', config.interval))
+    scheduler = Scheduler()
+    history = None
+    if getattr(config, 'history_dir', None) is not None:
+        from watchman.history import History
+        history = History(config.history_dir, retention_days=getattr(config, 'history_retention_days', None))
+        scheduler.add(Job(lambda items: history.rotate(), interval=24 * 60 * 60))
+    cadence = None
+    if getattr(config, 'max_interval', None) is not None:
+        from watchman.cadence import Cadence
+        cadence = Cadence(getattr(config, 'min_interval', config.interval), config.max_interval,
+                          retries=getattr(config, 'confirm_retries', 2), retry_delay=getattr(config, 'retry_delay', 10))
+    watch = functools.partial(__start_the_watch, patrol=patrol, dispatch=dispatch, history=history,
+                              metrics_file=getattr(config, 'metrics_file', None), cadence=cadence)
+
+    isolation = None
+    if getattr(config, 'isolation_workers', 0) > 0:
+        from watchman.isolation import WorkerPool
+        isolation = WorkerPool(processes=config.isolation_workers,
+                               max_tasks=getattr(config, 'isolation_max_tasks', 100),
+                               max_rss=getattr(config, 'isolation_max_rss', 256 * 1024 * 1024))
+
+    def schedule(guard):
+        if guard.timeout is None:
+            guard.timeout = getattr(config, 'guard_timeout', None)
+        if guard.isolated:
+            guard.isolation = isolation
+        interval = guard.interval or config.interval
+        return Job(watch, item=guard, interval=interval, jitter=guard.jitter or getattr(config, 'jitter', 0.0),
+                   policy=None if cadence is None else cadence.policy(guard, interval))
+
+    roster = Roster(scheduler, schedule, retire=functools.partial(__retire_guards, dispatch=dispatch))
+    roster.update(__select_guards(config, role, worker))
+    _logger.info('{} of {} guards on duty.'.format(len(roster.guards), len(config.guards)))
+    if config_file is not None:
+        watcher = ConfigWatcher(config_file, lambda path: __select_guards(__load_config(path), role, worker), roster,
+                                watched=[path for path in [getattr(config, 'guards_file', None)] if path is not None])
+        reload_job = scheduler.add(Job(watcher.check, interval=getattr(config, 'config_check_interval', 60)))
 
-    rto = RadioOperator('RTO1', from_mail=config.from_mail, admin_mail=config.admin_email)
+        def request_reload(signum, frame):
+            watcher.requested = True
+            scheduler.wake(reload_job)
+        signal.signal(signal.SIGHUP, request_reload)
 
-    schedule.every(config.interval).seconds.do(__start_the_watch, config.guards, rto)
-    schedule.every().day.at(config.status_time).do(__send_status_report, rto, config.guards)
+    if getattr(config, 'control_socket', None) is not None:
+        from watchman.control import ControlServer
+        refresh = functools.partial(__refresh_guards, scheduler=scheduler, watch=watch,
+                                    timeout=getattr(config, 'sweep_budget', config.interval) + 30)
+        ControlServer(os.path.expanduser(config.control_socket), roster.guards, refresh).start()
 
-    while True:
-        schedule.run_pending()
-        time.sleep(10)
+    report_max_age = getattr(config, 'report_max_age', config.interval)
+    scheduler.add(Job(lambda items: __send_status_report(reporter, roster.guards, watch, report_max_age),
+                      at=config.status_time))
 
+    scheduler.run_forever()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+One view of the cluster for many guards.
+
+A :class:`ClusterSnapshot` runs ``qstat -f -xml`` (and optionally ``qhost -xml``)
+at most once per ``ttl`` seconds, no matter how many :class:`ClusterGuard` s
+evaluate their rules against it. Adding checks therefore adds no load on the qmaster.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import logging
+import threading
+import time
+
+from watchman.squad import Watchman, Result, RC_NOT_FOUND, RC_TIMEOUT, QueueTarget, XmlItems, iter_parsed, run_steps
+
+_logger = logging.getLogger(__name__)
+
+QUEUE_FIELDS = ('name', 'qtype', 'slots_used', 'slots_resv', 'slots_total', 'load_avg', 'arch', 'state')
+
+# state of the cluster at one point in time
+# queues: list of dicts with the QUEUE_FIELDS, hosts: dict host name -> dict of qhost values
+Snapshot = collections.namedtuple('Snapshot', ['queues', 'hosts', 'timestamp', 'return_code', 'error'])
+
+
+class HostTarget(object):
+    """
+    Parser target which picks the hosts out of ``qhost -xml`` output, see :class:`watchman.squad.XmlItems`.
+    The items are (host name, dict of host values) tuples, the global host is left out.
+    """
+    def __init__(self):
+        self.items = []
+        self._host = None
+        self._values = None
+        self._value = None
+        self._text = None
+
+    def start(self, tag, attrib):
+        if tag == 'host':
+            self._host = attrib.get('name')
+            self._values = {}
+        elif tag == 'hostvalue' and self._values is not None:
+            self._value = attrib.get('name')
+            self._text = []
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        if tag == 'hostvalue' and self._text is not None:
+            self._values[self._value] = ''.join(self._text) or None
+            self._text = None
+        elif tag == 'host':
+            if self._host != 'global':
+                self.items.append((self._host, self._values))
+            self._values = None
+
+    def close(self):
+        return self.items
+
+
+def iter_hosts(stream):
+    """
+    Read the hosts from ``qhost -xml`` output as it streams in.
+
+    :param stream: file-like object with the xml output
+    :type stream: file
+
+    :return: generator of (host name, dict of host values) tuples
+    :rtype: generator
+    """
+    return iter_parsed(stream, HostTarget())
+
+
+class _XmlReader(Watchman):
+    """
+    Runs one of the xml commands of the snapshot and parses its output while it streams in.
+
+    :param target: function creating the parser target of a run
+    :type target: callable
+    """
+    def __init__(self, name, command, target, **kwargs):
+        super(_XmlReader, self).__init__(name, **kwargs)
+        self.command = command
+        self._target = target
+
+    def _collector(self):
+        return XmlItems(self._target())
+
+    def _check_output(self, return_code, out, error):
+        return []
+
+
+class ClusterSnapshot(object):
+    """
+    TTL-cached state of the queues and, optionally, of the hosts.
+
+    Guards of the same sweep asking at the same time wait for one refresh.
+
+    :param ttl: seconds a snapshot is reused
+    :type ttl: float
+
+    :param qhost: also run ``qhost -xml`` for the host values (load, memory, ...)
+    :type qhost: bool
+
+    :param timeout: seconds a command may run before its process group is killed,
+                    unless the guard asking for the snapshot has its own timeout
+    :type timeout: float
+    """
+    def __init__(self, ttl=60.0, qhost=False, timeout=None):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._qstat = _XmlReader('ClusterSnapshot qstat', ['qstat', '-f', '-xml'],
+                                 lambda: QueueTarget(QUEUE_FIELDS), timeout=timeout)
+        self._qhost = None
+        self.configure(ttl, qhost, timeout)
+
+    def configure(self, ttl=60.0, qhost=False, timeout=None):
+        """
+        Change the settings, e.g. on a reload of the config. The guards keep sharing this snapshot.
+        The parameters are the ones of the constructor.
+        """
+        self._ttl = ttl
+        self._timeout = timeout
+        if qhost and self._qhost is None:
+            self._qhost = _XmlReader('ClusterSnapshot qhost', ['qhost', '-xml'], HostTarget, timeout=timeout)
+            # the current snapshot has no host values
+            self._snapshot = None
+        elif not qhost:
+            self._qhost = None
+
+    @property
+    def command(self):
+        """
+        Get the command of the snapshot.
+
+        :return: qstat command
+        :rtype: list
+        """
+        return self._qstat.command
+
+    def get(self, timeout=None):
+        """
+        Get the current snapshot, refresh it if it is older than the ttl.
+
+        :param timeout: seconds each command of a refresh may run (None: timeout of the snapshot)
+        :type timeout: float
+
+        :return: snapshot
+        :rtype: Snapshot
+        """
+        return run_steps(self.steps(timeout), Snapshot)
+
+    def steps(self, timeout=None):
+        """
+        Get the current snapshot like :meth:`get`, as steps of :meth:`watchman.squad.Watchman.watch`.
+        The generator yields (file descriptors, wake-up time) while it waits for a refresh
+        or for the output of the commands and finally the snapshot.
+
+        :param timeout: seconds each command of a refresh may run (None: timeout of the snapshot)
+        :type timeout: float
+
+        :return: generator of (file descriptors, wake-up time) tuples, the last item is the Snapshot
+        :rtype: generator
+        """
+        pause = 0.001
+        while not self._lock.acquire(False):
+            # another guard refreshes the snapshot
+            yield [], time.time() + pause
+            pause = min(0.1, pause * 2)
+        try:
+            if self._is_stale(timeout):
+                timestamp = time.time()
+                results = []
+                for reader in (self._qstat, self._qhost):
+                    if reader is None:
+                        continue
+                    steps = reader._steps()
+                    try:
+                        wanted = next(steps)
+                        while not isinstance(wanted, Result):
+                            wanted = steps.send((yield wanted))
+                    finally:
+                        steps.close()
+                    results.append(reader._record(wanted))
+                    if wanted.return_code != 0 or wanted.out is None:
+                        break
+                self._snapshot = self._build(timestamp, results)
+            snapshot = self._snapshot
+        finally:
+            self._lock.release()
+        yield snapshot
+
+    def abort(self):
+        """
+        Kill the running commands of a refresh, the guards waiting for it get a failed snapshot.
+        """
+        for reader in (self._qstat, self._qhost):
+            if reader is not None:
+                reader.abort()
+
+    def _is_stale(self, timeout):
+        """
+        Check if the snapshot needs a refresh and set the timeout of the commands if so.
+        The lock has to be held.
+
+        :return: True if the snapshot is older than the ttl
+        :rtype: bool
+        """
+        if self._snapshot is not None and time.time() - self._snapshot.timestamp <= self._ttl:
+            return False
+        for reader in (self._qstat, self._qhost):
+            if reader is not None:
+                reader.timeout = self._timeout if timeout is None else timeout
+        return True
+
+    def _build(self, timestamp, results):
+        """
+        Build a snapshot from the results of the commands.
+
+        :param timestamp: unix timestamp of the start of the refresh
+        :type timestamp: float
+
+        :param results: result of qstat and, unless qstat failed or the snapshot has no qhost, of qhost
+        :type results: list
+
+        :return: snapshot
+        :rtype: Snapshot
+        """
+        qstat = results[0]
+        if qstat.return_code != 0 or qstat.out is None:
+            return Snapshot(None, None, timestamp, qstat.return_code, self._describe(qstat))
+
+        hosts = {}
+        if len(results) > 1:
+            qhost = results[1]
+            if qhost.return_code != 0 or qhost.out is None:
+                return Snapshot(qstat.out, None, timestamp, qhost.return_code, self._describe(qhost))
+            hosts = dict(qhost.out)
+        return Snapshot(qstat.out, hosts, timestamp, 0, '')
+
+    @staticmethod
+    def _describe(result):
+        if result.return_code == RC_NOT_FOUND:
+            return 'Command not found.'
+        if result.return_code == RC_TIMEOUT:
+            return 'Command timed out.'
+        if result.out is None:
+            return 'Could not parse output. {}'.format(result.error)
+        return result.error
+
+
+class ClusterGuard(Watchman):
+    """
+    Guard which evaluates a rule against a shared cluster snapshot.
+
+    :param name: name of the guard
+    :type name: str
+
+    :param snapshot: shared snapshot
+    :type snapshot: ClusterSnapshot
+
+    :param rule: callable which gets the Snapshot and returns a list of error messages, see the rules below
+    :type rule: callable
+
+    Further keyword arguments like ``interval`` are passed to :class:`Watchman`.
+    """
+    def __init__(self, name, snapshot, rule, **kwargs):
+        super(ClusterGuard, self).__init__(name, **kwargs)
+        self._snapshot = snapshot
+        self._rule = rule
+        self.command = snapshot.command
+
+    def _steps(self, streaming=True):
+        start = time.time()
+        steps = self._snapshot.steps(timeout=self.timeout)
+        try:
+            wanted = next(steps)
+            while not isinstance(wanted, Snapshot):
+                wanted = steps.send((yield wanted))
+        finally:
+            steps.close()
+        yield Result(wanted.return_code, wanted, wanted.error, start, time.time() - start)
+
+    def abort(self):
+        self._snapshot.abort()
+
+    def _format_output(self, out):
+        if out.queues is None:
+            return ''
+        return '\n'.join(self._rule(out)) or 'ok'
+
+    def _check_output(self, return_code, out, error):
+        if return_code != 0 or out.queues is None:
+            return [(self._name, self._command, return_code, 'Cluster snapshot failed: {}'.format(error))]
+        return [(self._name, self._command, return_code, message) for message in self._rule(out)]
+
+
+def queues_in_state(states, description='is in state'):
+    """
+    Rule: report queue instances with one of the given state letters.
+
+    :param states: state letters, e.g. 'auE' for alarm, unknown and Error or 'd' for disabled
+    :type states: str
+
+    :param description: text put between queue name and state in the message
+    :type description: str
+
+    :return: rule
+    :rtype: callable
+    """
+    def rule(snapshot):
+        return ['Queue {} {} {}.'.format(queue['name'], description, queue['state'])
+                for queue in snapshot.queues
+                if queue.get('state') and any(state in queue['state'] for state in states)]
+    return rule
+
+
+def unavailable_queues():
+    """
+    Rule: report queue instances in alarm, unknown or Error state, like QstatFGuard.
+    """
+    return queues_in_state('auE', 'is not available or set to ERROR, state')
+
+
+def disabled_queues():
+    """
+    Rule: report disabled queue instances.
+    """
+    return queues_in_state('dD', 'is disabled, state')
+
+
+def suspended_queues():
+    """
+    Rule: report suspended queue instances.
+    """
+    return queues_in_state('sSC', 'is suspended, state')
+
+
+def overloaded_hosts(max_load_per_slot=1.5):
+    """
+    Rule: report hosts whose load average per processor (qhost) or per slot (qstat) is too high.
+    Hosts without qhost values are judged by the slots of their queues.
+
+    :param max_load_per_slot: tolerated load average per processor or slot
+    :type max_load_per_slot: float
+
+    :return: rule
+    :rtype: callable
+    """
+    def rule(snapshot):
+        loads = {}
+        for queue in snapshot.queues:
+            host = queue['name'].partition('@')[2]
+            load, slots = _number(queue.get('load_avg')), _number(queue.get('slots_total'))
+            known_load, known_slots, _ = loads.get(host, (None, None, 'slots'))
+            if slots is None:
+                slots = known_slots
+            elif known_slots is not None:
+                slots += known_slots
+            loads[host] = (known_load if load is None else load, slots, 'slots')
+        for host, values in (snapshot.hosts or {}).items():
+            load, processors = _number(values.get('load_avg')), _number(values.get('num_proc'))
+            if load is not None and processors:
+                loads[host] = (load, processors, 'processors')
+        messages = []
+        for host, (load, count, unit) in sorted(loads.items()):
+            if load is not None and count and load / count > max_load_per_slot:
+                # the load changes from sweep to sweep, the alert has to stay the same
+                _logger.info('Host {} has load {:g} on {:g} {}.'.format(host, load, count, unit))
+                messages.append('Host {} is overloaded ({:g} {}).'.format(host, count, unit))
+        return messages
+    return rule
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
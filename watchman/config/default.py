@@ -1,18 +1,16 @@
 #!/usr/bin/env python
-from watchman.squad import PingGuard, QstatFGuard
+import os
+
+from watchman.squad import PingGuard
+from watchman.inventory import load_guards
 
 # log to this file
 log_file = '~/watchman.log'
 
-# define your list of guards you want send to watch
-#
-# A PingGuard pings the host and checks the return code of the ping command.
-# The QstatFGuard greps the qstat -f command for some unavailable queues.
-guards = [PingGuard('PingGuard 001', host='ekpblus001'),
-          PingGuard('PingGuard 002', host='ekpblus002'),
-          PingGuard('PingGuard 003', host='ekpblus003'),
-          PingGuard('PingGuard 007', host='ekpblus007'),
-          QstatFGuard('QStatFGuard')]
+# the guards are declared in guards_file, see guards.ini. Guards can also be built in Python:
+# guards = load_guards(guards_file) + [PingGuard('PingGuard 042', host='ekpblus042')]
+guards_file = os.path.join(os.path.dirname(__file__), 'guards.ini')
+guards = load_guards(guards_file)
 
 # EMail address FROM
 from_email = 'root@example.com'
@@ -20,8 +18,97 @@ from_email = 'root@example.com'
 # EMail address of the admin who will be noticed by errors
 admin_email = 'admin@host'
 
-# defines the waiting time between two checks (in seconds)
+# defines the waiting time between two checks (in seconds).
+# Guards can have their own interval, e.g. PingGuard('PingGuard 001', host='ekpblus001', interval=30)
 interval = 600
 
+# every check is shifted randomly by up to this many seconds to spread the load
+jitter = 10
+
+# adaptive intervals (max_interval = None: always use the interval), e.g. max_interval = 3600:
+# guards which stay healthy are checked less often, up to max_interval, after a failure or
+# a recovery they are checked every min_interval seconds. New failures are confirmed by
+# confirm_retries checks retry_delay seconds apart before they are sent.
+min_interval = 120
+max_interval = None
+confirm_retries = 2
+retry_delay = 10
+
+# maximal number of guards which are on watch at the same time
+max_parallel = 16
+
+# runner = 'loop' drives up to max_running guards from one thread with a poll loop instead
+# of max_parallel threads, for thousands of guards
+runner = 'threads'
+max_running = 256
+
+# default seconds a guard command may run before its process group is killed
+# and a timeout is reported (None: wait forever). Guards can set their own timeout.
+guard_timeout = 60
+
+# seconds a whole sweep may take, guards still running afterwards are aborted
+sweep_budget = 300
+
+# guards with isolated = yes run their command and parse its output in one of isolation_workers
+# worker processes (0: in the daemon), which keeps the peak memory of the parsing out of the daemon.
+# A worker process is replaced after isolation_max_tasks watches or when its resident memory
+# grew by more than isolation_max_rss bytes.
+isolation_workers = 2
+isolation_max_tasks = 100
+isolation_max_rss = 256 * 1024 * 1024
+
+# SMTP server which delivers the mails and number of retries if a delivery fails
+smtp_host = 'localhost'
+smtp_port = 25
+smtp_retries = 3
+
+# alerts arriving within this many seconds are sent as one digest mail
+digest_window = 30
+
+# open alerts are remembered in this file, so an alert is only sent when it is new,
+# resolved or still open after renotify_interval seconds (None: only once)
+state_file = '~/watchman.db'
+renotify_interval = 24 * 60 * 60
+
+# every guard result is appended to a compact history in this directory (None: no history),
+# query it with: watchman -c <config> history [guard ...] --days 30
+history_dir = '~/watchman_history'
+history_retention_days = 400
+
+# metrics in the Prometheus text format: served over HTTP on metrics_port and/or
+# written to metrics_file after every sweep (e.g. for the node exporter textfile collector)
+metrics_port = None
+metrics_file = None
+
+# the guards are reloaded when this file or the guards_file changed (checked every config_check_interval seconds)
+# or on SIGHUP; unchanged guards keep running undisturbed, the open alerts of removed guards are closed
+config_check_interval = 60
+
 # send a status report to the admin every day at that time:
 status_time = '10:00'
+
+# the status report uses the last result of a guard if it is younger than this many seconds
+report_max_age = 900
+
+# the running watchman answers on this Unix socket (None: no socket), query it with:
+#   watchman -c <config> status
+#   watchman -c <config> check [guard ...] [--max-age 60 | --refresh]
+# check reports the cached results; guards with older results than --max-age, or all given
+# guards with --refresh, are run first
+control_socket = '~/.watchman/control.sock'
+
+# distributed mode: the guards are sharded over the workers by their names,
+#   watchman -c <config> --role coordinator
+#   watchman -c <config> --role worker --worker site-a
+# the workers report their alerts and status reports to the coordinator, which sends the mails;
+# it waits up to status_wait seconds for the status reports of all workers. A worker which sends
+# no report for worker_silence seconds (None: never) is alerted as the guard 'Worker <name>',
+# the silence has to be longer than the intervals of the guards.
+# Workers on the same host need their own history_dir, metrics_port and control_socket.
+# A coordinator on another address than localhost needs a coordinator_secret shared by all
+# workers, it drops reports which are not signed with it.
+workers = ['site-a', 'site-b']
+coordinator_address = ('localhost', 7710)
+coordinator_secret = None
+status_wait = 600
+worker_silence = 1800
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Queries of the running watchman from the command line.
+
+The daemon answers on a Unix socket, one JSON object per line and connection:
+``watchman status`` lists the last results of all guards and ``watchman check``
+reports selected guards. Both are served from the cached results, so asking
+costs no command on the cluster. A guard is only sent on watch again if its
+result is older than the requested ``max_age``; refreshes are done one after
+the other, so operators asking at the same time share one run of a guard.
+Only the owner of the daemon can use the socket (mode 0600).
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import logging
+import errno
+import os
+import socket
+import stat
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+_logger = logging.getLogger(__name__)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _native(value):
+    # json gives unicode on Python 2, the guards are named by utf-8 str
+    if isinstance(value, type(u'')) and not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def _remove_stale(path):
+    """
+    Remove the socket of a watchman which is not running any more.
+
+    :raises ValueError: if path is no socket or another watchman listens on it
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise ValueError('{} exists and is no socket.'.format(path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        _logger.info('Remove stale control socket {}'.format(path))
+        os.remove(path)
+        return
+    finally:
+        sock.close()
+    raise ValueError('Another watchman listens on {}.'.format(path))
+
+
+class ControlServer(object):
+    """
+    Answers the queries of ``watchman status`` and ``watchman check``.
+
+    :param path: path of the Unix socket
+    :type path: str
+
+    :param guards: the guards on duty, the list may change in place
+    :type guards: list
+
+    :param refresh: callable which sends a list of guards on watch and hands their alerts on,
+                    it is called from the threads of the server
+    :type refresh: callable
+    """
+    def __init__(self, path, guards, refresh):
+        self._path = path
+        self._guards = guards
+        self._refresh = refresh
+        self._refresh_lock = threading.Lock()
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return  # e.g. a starting watchman which checks if the socket is in use
+                self.wfile.write((json.dumps(control._answer(line)) + '\n').encode('utf-8'))
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        _remove_stale(path)
+        self._server = Server(path, Handler)
+        os.chmod(path, 0o600)
+
+    @property
+    def path(self):
+        """
+        Get the path of the socket.
+
+        :return: path
+        :rtype: str
+        """
+        return self._path
+
+    def serve_forever(self):
+        _logger.info('Control socket listens on {}'.format(self._path))
+        self._server.serve_forever()
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        :return: the ControlServer
+        :rtype: ControlServer
+        """
+        thread = threading.Thread(target=self.serve_forever, name='control')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def _answer(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+            if command == 'status':
+                return {'guards': [self._status(guard) for guard in list(self._guards)]}
+            if command == 'check':
+                return {'reports': self._check([_native(name) for name in request['guards']],
+                                               request.get('max_age'))}
+            raise ValueError('unknown command {}'.format(command))
+        except (ValueError, KeyError, TypeError) as e:
+            _logger.warning('Invalid control request: {}'.format(e))
+            return {'error': 'Invalid request: {}'.format(e)}
+        except Exception as e:
+            _logger.exception('Control request failed.')
+            return {'error': 'Request failed: {}'.format(e)}
+
+    def _status(self, guard):
+        result = guard.last_result
+        if result is None:
+            state = 'no result'
+        elif guard.skipped_by is not None:
+            state = 'skipped, {} fails'.format(guard.skipped_by.name)
+        else:
+            state = 'failing' if guard.failing else 'ok'
+        return {'name': _text(guard.name), 'state': state,
+                'return_code': None if result is None else result.return_code,
+                'timestamp': None if result is None else result.timestamp,
+                'duration': None if result is None else result.duration}
+
+    def _check(self, names, max_age):
+        """
+        Report the given guards, the ones with a result older than max_age are sent on watch first.
+
+        :param names: names of the guards, all guards if empty
+        :type names: list
+
+        :param max_age: seconds a result may be old (None: any cached result)
+        :type max_age: float
+
+        :return: reports of the guards
+        :rtype: list
+        """
+        guards = list(self._guards)
+        if len(names) > 0:
+            by_name = dict((guard.name, guard) for guard in guards)
+            unknown = [name for name in names if name not in by_name]
+            if len(unknown) > 0:
+                raise ValueError('unknown guards {}'.format(', '.join(unknown)))
+            guards = [by_name[name] for name in names]
+        if max_age is not None:
+            # results of refreshes which started after the request came in are fresh enough
+            fresh_since = time.time() - max_age
+            with self._refresh_lock:
+                stale = [guard for guard in guards
+                         if guard.last_result is None or guard.last_result.timestamp < fresh_since]
+                if len(stale) > 0:
+                    _logger.info('Refresh {} guards for a check.'.format(len(stale)))
+                    self._refresh(stale)
+        return [_text(guard.report_back(max_age=float('inf'))) if guard.last_result is not None
+                else u'{} has no result yet.'.format(_text(guard.name)) for guard in guards]
+
+
+class ControlClient(object):
+    """
+    Asks the running watchman over its control socket.
+
+    :param path: path of the Unix socket
+    :type path: str
+
+    :param timeout: socket timeout in seconds, refreshes may take a while
+    :type timeout: float
+    """
+    def __init__(self, path, timeout=None):
+        self._path = path
+        self._timeout = timeout
+
+    def status(self):
+        """
+        Get the state of all guards.
+
+        :return: dicts with name, state, return_code, timestamp and duration
+        :rtype: list
+        """
+        return self._request({'command': 'status'})['guards']
+
+    def check(self, names=(), max_age=None):
+        """
+        Get the reports of guards.
+
+        :param names: names of the guards, all guards if empty
+        :type names: list
+
+        :param max_age: seconds a result may be old, older ones are refreshed (None: any cached result)
+        :type max_age: float
+
+        :return: reports
+        :rtype: list
+        """
+        return self._request({'command': 'check', 'guards': [_text(name) for name in names], 'max_age': max_age})[
+            'reports']
+
+    def _request(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self._path)
+            sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            answer = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+        finally:
+            sock.close()
+        if 'error' in answer:
+            raise ValueError(answer['error'])
+        return answer
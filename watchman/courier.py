@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+
+import logging
+import smtplib
+import socket
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from watchman import metrics
+
+_logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Courier(object):
+    """
+    A Courier delivers mails in the background.
+
+    Mails are put into a bounded queue and a worker thread hands them to the
+    SMTP server over one connection, which is kept open while mails keep
+    coming and closed after ``idle_timeout`` seconds without mail. Failed
+    deliveries are retried with exponential backoff. A slow or unreachable
+    MTA therefore never blocks the caller.
+
+    :param host: host of the SMTP server
+    :type host: str
+
+    :param port: port of the SMTP server
+    :type port: int
+
+    :param maxsize: maximal number of mails waiting for delivery, further mails are dropped
+    :type maxsize: int
+
+    :param retries: number of retries of a failed delivery
+    :type retries: int
+
+    :param backoff: seconds to wait before the first retry, doubled for every further retry
+    :type backoff: float
+
+    :param idle_timeout: seconds without mail after which the connection is closed
+    :type idle_timeout: float
+
+    :param timeout: socket timeout of the SMTP connection in seconds
+    :type timeout: float
+    """
+    def __init__(self, host='localhost', port=25, maxsize=100, retries=3, backoff=1.0,
+                 idle_timeout=60.0, timeout=30.0):
+        self._host = host
+        self._port = port
+        self._retries = retries
+        self._backoff = backoff
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._queue = queue.Queue(maxsize)
+        self._smtp = None
+        self._worker = None
+
+    def start(self):
+        """
+        Start the worker thread.
+
+        :return: the Courier
+        :rtype: Courier
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='courier')
+            self._worker.daemon = True
+            self._worker.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Deliver the waiting mails and stop the worker thread.
+
+        :param timeout: seconds to wait for the worker
+        :type timeout: float
+        """
+        if self._worker is None:
+            return
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        self._worker = None
+
+    def post(self, from_mail, to_mails, message):
+        """
+        Hand a mail to the Courier. Never blocks.
+
+        :param from_mail: address of the sender
+        :type from_mail: str
+
+        :param to_mails: addresses of the recipients
+        :type to_mails: list
+
+        :param message: the complete mail
+        :type message: str
+
+        :return: False if the queue is full and the mail was dropped
+        :rtype: bool
+        """
+        try:
+            self._queue.put_nowait((from_mail, to_mails, message))
+        except queue.Full:
+            _logger.error('Outbound mail queue is full, drop mail to {}.'.format(to_mails))
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                mail = self._queue.get(timeout=self._idle_timeout if self._smtp is not None else None)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            if mail is _STOP:
+                self._disconnect()
+                return
+            self._deliver(*mail)
+
+    def _deliver(self, from_mail, to_mails, message):
+        """
+        Send one mail, retry with backoff if the server or the connection fails.
+        Any other error drops the mail, the worker goes on with the next one.
+        """
+        for attempt in range(self._retries + 1):
+            start = time.time()
+            try:
+                self._connection().sendmail(from_mail, to_mails, message)
+                metrics.SMTP_DURATION.observe(time.time() - start)
+                return
+            except (smtplib.SMTPException, socket.error) as e:
+                metrics.SMTP_FAILURES.inc()
+                self._disconnect()
+                if attempt == self._retries:
+                    _logger.error('Could not deliver mail to {}: {}'.format(to_mails, e))
+                    return
+                wait = self._backoff * 2 ** attempt
+                _logger.warning('Delivery to {} failed ({}), retry in {}s.'.format(to_mails, e, wait))
+                time.sleep(wait)
+            except Exception:
+                # e.g. an address which cannot be encoded, retrying does not help
+                metrics.SMTP_FAILURES.inc()
+                _logger.exception('Could not deliver mail to {}.'.format(to_mails))
+                self._disconnect()
+                return
+
+    def _connection(self):
+        """
+        Get the open SMTP connection or open a new one.
+
+        :return: connection to the SMTP server
+        :rtype: smtplib.SMTP
+        """
+        if self._smtp is None:
+            _logger.debug('Connect to SMTP server {}:{}'.format(self._host, self._port))
+            self._smtp = smtplib.SMTP(self._host, self._port, timeout=self._timeout)
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            self._smtp.close()
+        self._smtp = None
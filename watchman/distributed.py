@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Several watchman instances sharing one guard list.
+
+The guards are sharded over the workers by consistent hashing of their names,
+so adding or removing a worker only moves the guards of that worker. Every
+worker sends the alerts of its sweeps to the coordinator, one JSON object per
+line over TCP. The coordinator passes them through one Logbook and one
+RadioOperator, so an alert is deduplicated and mailed only once. The daily
+status reports of the workers are collected by the coordinator as well and
+mailed as one report. A worker which sends no report for a while is alerted
+like a failing guard named ``Worker <name>``, its guards are not watched until
+it is back or the workers in the config are changed.
+
+A coordinator listening on another address than the loopback interface needs
+a shared secret: every line is signed with an HMAC of the secret and reports
+with a wrong signature are dropped.
+"""
+from __future__ import division, print_function, absolute_import
+
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import socket
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+_logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring assigning guard names to workers.
+
+    :param workers: names of the workers
+    :type workers: list
+
+    :param replicas: points per worker on the ring, more points spread the guards more evenly
+    :type replicas: int
+    """
+    def __init__(self, workers, replicas=100):
+        if len(workers) == 0:
+            raise ValueError('A hash ring needs at least one worker.')
+        points = sorted((_hash('{}#{}'.format(worker, i)), worker) for worker in workers for i in range(replicas))
+        self._keys = [key for key, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def owner(self, name):
+        """
+        Get the worker responsible for a guard.
+
+        :param name: name of the guard
+        :type name: str
+
+        :return: name of the worker
+        :rtype: str
+        """
+        index = bisect.bisect(self._keys, _hash(name)) % len(self._keys)
+        return self._workers[index]
+
+    def shard(self, guards, worker):
+        """
+        Get the guards of a worker.
+
+        :param guards: all guards
+        :type guards: list
+
+        :param worker: name of the worker
+        :type worker: str
+
+        :return: guards of the worker
+        :rtype: list
+        """
+        return [guard for guard in guards if self.owner(guard.name) == worker]
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _native(value):
+    # json gives unicode on Python 2, the mails are written from utf-8 str
+    if isinstance(value, type(u'')) and not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def _signature(message, secret):
+    if not isinstance(secret, bytes):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, json.dumps(message, sort_keys=True).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _is_loopback(host):
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+
+class CoordinatorClient(object):
+    """
+    Connection of a worker to the coordinator.
+
+    :param worker: name of the worker
+    :type worker: str
+
+    :param address: (host, port) of the coordinator
+    :type address: tuple
+
+    :param timeout: socket timeout in seconds
+    :type timeout: float
+
+    :param secret: shared secret signing the reports (None: unsigned)
+    :type secret: str
+    """
+    def __init__(self, worker, address, timeout=10.0, secret=None):
+        self._worker = worker
+        self._address = tuple(address)
+        self._timeout = timeout
+        self._secret = secret
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def report(self, guards, alerts):
+        """
+        Send the guards of a sweep and their alerts to the coordinator.
+        A broken connection is opened again once, afterwards the report is dropped.
+
+        :param guards: guards which were on watch
+        :type guards: list
+
+        :param alerts: alerts of the sweep
+        :type alerts: list
+
+        :return: True if the report was sent
+        :rtype: bool
+        """
+        return self._send({'guards': [_text(guard.name) for guard in guards],
+                           'alerts': [[_text(name), [_text(part) for part in command], return_code, _text(message)]
+                                      for name, command, return_code, message in alerts]},
+                          '{} guards with {} alerts'.format(len(guards), len(alerts)))
+
+    def send_status_report(self, report):
+        """
+        Send the status report of the guards of this worker to the coordinator,
+        which mails it together with the reports of the other workers.
+        The counterpart of :meth:`watchman.squad.RadioOperator.send_status_report`.
+
+        :param report: status report
+        :type report: str
+
+        :return: True if the report was sent
+        :rtype: bool
+        """
+        return self._send({'status': _text(report)}, 'status report')
+
+    def _send(self, message, what):
+        message['worker'] = _text(self._worker)
+        if self._secret is not None:
+            message['signature'] = _signature(message, self._secret)
+        line = json.dumps(message) + '\n'
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.create_connection(self._address, self._timeout)
+                    self._sock.sendall(line.encode('utf-8'))
+                    return True
+                except socket.error as e:
+                    _logger.warning('Could not report to coordinator {}: {}'.format(self._address, e))
+                    self.close()
+        _logger.error('Drop report of {}.'.format(what))
+        return False
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class Coordinator(object):
+    """
+    Receives the reports of the workers and hands them to a callback, one report at a time.
+
+    :param address: (host, port) to listen on, a host other than the loopback interface needs a secret
+    :type address: tuple
+
+    :param dispatch: callable getting the names of the guards and the alerts of a report
+    :type dispatch: callable
+
+    :param status: callable getting the name of a worker and its status report (None: drop status reports)
+    :type status: callable
+
+    :param secret: shared secret of the workers, reports without its signature are dropped (None: unsigned)
+    :type secret: str
+
+    :param workers: names of the workers which are expected to report
+    :type workers: list
+
+    :param silence: seconds without a report after which a worker is alerted (None: never)
+    :type silence: float
+    """
+    def __init__(self, address, dispatch, status=None, secret=None, workers=(), silence=None):
+        if secret is None and not _is_loopback(address[0]):
+            raise ValueError('A coordinator listening on {} needs a secret.'.format(address[0]))
+        self._dispatch = dispatch
+        self._status = status
+        self._secret = secret
+        self._silence = silence
+        self._lock = threading.Lock()
+        # the workers get the silence to start up
+        self._seen = dict((worker, time.time()) for worker in workers)
+        self._silent = set()
+        self._stopped = threading.Event()
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    coordinator._receive(line, self.client_address)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server(tuple(address), Handler)
+
+    @property
+    def address(self):
+        """
+        Get the address the coordinator listens on.
+
+        :return: (host, port)
+        :rtype: tuple
+        """
+        return self._server.server_address
+
+    def serve_forever(self):
+        _logger.info('Coordinator listens on {}'.format(self.address))
+        if self._silence is not None:
+            thread = threading.Thread(target=self._watch_workers, name='coordinator workers')
+            thread.daemon = True
+            thread.start()
+        self._server.serve_forever()
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        :return: the Coordinator
+        :rtype: Coordinator
+        """
+        thread = threading.Thread(target=self.serve_forever, name='coordinator')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def shutdown(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def silent_workers(self, now=None):
+        """
+        Get the workers which sent no report for more than the silence.
+
+        :return: names of the workers
+        :rtype: list
+        """
+        if self._silence is None:
+            return []
+        now = time.time() if now is None else now
+        with self._lock:
+            return sorted(worker for worker, seen in self._seen.items() if now - seen > self._silence)
+
+    def check_workers(self, now=None):
+        """
+        Alert the silent workers and resolve the alerts of the ones which report again.
+        """
+        if self._silence is None:
+            return
+        silent = self.silent_workers(now)
+        with self._lock:
+            for worker in sorted(set(silent) - self._silent):
+                _logger.warning('Worker {} sent no report for {:g}s.'.format(worker, self._silence))
+            for worker in sorted(self._silent - set(silent)):
+                _logger.info('Worker {} reports again.'.format(worker))
+            self._silent = set(silent)
+            guards = ['Worker {}'.format(worker) for worker in sorted(self._seen)]
+            alerts = [('Worker {}'.format(worker), ['watchman', '--worker', worker], 1,
+                       'Worker {} stopped reporting.'.format(worker)) for worker in silent]
+            try:
+                self._dispatch(guards, alerts)
+            except Exception:
+                _logger.exception('Could not dispatch the state of the workers.')
+
+    def _watch_workers(self):
+        while not self._stopped.wait(self._silence / 4):
+            self.check_workers()
+
+    def _receive(self, line, client):
+        try:
+            report = json.loads(line.decode('utf-8'))
+            if self._secret is not None:
+                signature = report.pop('signature', None)
+                if not isinstance(signature, type(u'')) or not hmac.compare_digest(
+                        signature, type(u'')(_signature(report, self._secret))):
+                    raise ValueError('wrong signature')
+            worker = _native(report['worker'])
+            with self._lock:
+                self._seen[worker] = time.time()
+            if 'status' in report:
+                self._receive_status(worker, _native(report['status']), client)
+                return
+            guards = [_native(name) for name in report['guards']]
+            alerts = [(_native(name), [_native(part) for part in command], return_code, _native(message))
+                      for name, command, return_code, message in report['alerts']]
+        except (ValueError, KeyError, TypeError) as e:
+            _logger.warning('Invalid report from {}: {}'.format(client, e))
+            return
+        _logger.debug('Report of {} with {} guards and {} alerts.'.format(worker, len(guards), len(alerts)))
+        with self._lock:
+            try:
+                self._dispatch(guards, alerts)
+            except Exception:
+                _logger.exception('Could not dispatch report from {}.'.format(client))
+
+    def _receive_status(self, worker, report, client):
+        if self._status is None:
+            _logger.debug('Drop status report of {}.'.format(worker))
+            return
+        with self._lock:
+            try:
+                self._status(worker, report)
+            except Exception:
+                _logger.exception('Could not hand on status report from {}.'.format(client))
+
+
+class StatusCollector(object):
+    """
+    Collects the daily status reports of the workers and sends them as one report,
+    as soon as all workers reported or ``wait`` seconds after the first report.
+
+    :param workers: names of the workers
+    :type workers: list
+
+    :param send: callable getting the report, e.g. RadioOperator.send_status_report
+    :type send: callable
+
+    :param wait: seconds to wait for the other workers after the first report
+    :type wait: float
+    """
+    def __init__(self, workers, send, wait=600.0):
+        self._workers = list(workers)
+        self._send = send
+        self._wait = wait
+        self._lock = threading.Lock()
+        self._reports = {}
+        self._timer = None
+
+    def collect(self, worker, report):
+        """
+        Take the status report of a worker.
+
+        :param worker: name of the worker
+        :type worker: str
+
+        :param report: status report of the worker
+        :type report: str
+        """
+        with self._lock:
+            if worker in self._reports:
+                # the last day was not complete, do not hold back the next one
+                self._flush()
+            self._reports[worker] = report
+            if all(name in self._reports for name in self._workers):
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Send the collected reports, missing workers are named.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self._reports) == 0:
+            return
+        workers = self._workers + sorted(name for name in self._reports if name not in self._workers)
+        reports = ['Worker {}:\n\n{}'.format(name, self._reports[name]) for name in workers if name in self._reports]
+        missing = [name for name in self._workers if name not in self._reports]
+        if len(missing) > 0:
+            _logger.warning('No status report from workers {}.'.format(', '.join(missing)))
+            reports.append('No status report from workers {}.'.format(', '.join(missing)))
+        self._reports = {}
+        self._send('\n\n=================\n'.join(reports))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk history of guard results.
+
+Every result is appended as a fixed-width record of 18 bytes
+(timestamp, duration, return code, number of alerts) to a file per guard
+and month::
+
+    <directory>/guards              names of the guards, the line number is the guard id
+    <directory>/<guard id>/2016-05  records of the guard in May 2016
+
+Records are appended in time order, a record older than the last one of its
+guard is dropped. So a query finds both ends of its time range by binary
+search in the memory-mapped files and unpacks only the records in between,
+of the guard it asks for, a block of records per call. Months older than the
+retention are deleted.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import datetime
+import heapq
+import io
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+_RECORD = struct.Struct('<dfiH')
+# records unpacked by one call, a block has 18 kB
+_BLOCK_RECORDS = 1024
+_BLOCK = struct.Struct('<' + _RECORD.format.lstrip('<') * _BLOCK_RECORDS)
+
+Record = collections.namedtuple('Record', ['timestamp', 'duration', 'return_code', 'alerts'])
+
+
+class History(object):
+    """
+    Append-only store of guard results with fast per-guard queries.
+
+    :param directory: directory of the history
+    :type directory: str
+
+    :param retention_days: records older than this many days are deleted (None: keep everything)
+    :type retention_days: int
+    """
+    def __init__(self, directory, retention_days=None):
+        self._directory = os.path.expanduser(directory)
+        self._retention_days = retention_days
+        self._lock = threading.Lock()
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+        # guard id -> timestamp of its last record
+        self._last = {}
+        self._ids = {}
+        index = os.path.join(self._directory, 'guards')
+        if os.path.exists(index):
+            with io.open(index, encoding='utf-8') as names:
+                for guard_id, name in enumerate(names):
+                    self._ids[name.rstrip('\n')] = guard_id
+
+    def record(self, guard, alerts):
+        """
+        Append the last result of a guard.
+
+        :param guard: guard which was on watch
+        :type guard: Watchman
+
+        :param alerts: number of alerts of the guard
+        :type alerts: int
+        """
+        result = guard.last_result
+        if result is None:
+            return
+        self.append(guard.name, result.timestamp, result.duration, result.return_code, alerts)
+
+    def append(self, name, timestamp, duration, return_code, alerts):
+        """
+        Append a record. Records have to come in time order, an older one than the last is dropped.
+
+        :param name: name of the guard
+        :type name: str
+
+        :param timestamp: start of the execution as unix timestamp
+        :type timestamp: float
+
+        :param duration: seconds the execution took
+        :type duration: float
+
+        :param return_code: return code of the command
+        :type return_code: int
+
+        :param alerts: number of alerts
+        :type alerts: int
+        """
+        with self._lock:
+            guard_id = self._guard_id(name, create=True)
+            path = self._chunk_path(guard_id, timestamp)
+            if guard_id not in self._last:
+                self._last[guard_id] = self._last_timestamp(path)
+            if timestamp < self._last[guard_id]:
+                _logger.warning('Drop history record of {} older than its last one.'.format(name))
+                return
+            self._last[guard_id] = timestamp
+            with open(path, 'ab') as chunk:
+                chunk.write(_RECORD.pack(timestamp, duration, return_code, min(alerts, 0xffff)))
+
+    def results(self, name, since=None, until=None):
+        """
+        Get the records of a guard in a time range.
+
+        :param name: name of the guard
+        :type name: str
+
+        :param since: unix timestamp of the first record (None: from the beginning)
+        :type since: float
+
+        :param until: unix timestamp after the last record (None: until now)
+        :type until: float
+
+        :return: generator of records in time order
+        :rtype: generator
+        """
+        for fields in self._blocks(name, since, until):
+            for index in range(0, len(fields), 4):
+                yield Record(*fields[index:index + 4])
+
+    def availability(self, name, since=None, until=None):
+        """
+        Get the fraction of watches of a guard without alerts.
+
+        :return: availability between 0 and 1 or None if there are no records
+        :rtype: float
+        """
+        total = healthy = 0
+        for record in self.results(name, since, until):
+            total += 1
+            healthy += record.alerts == 0
+        return None if total == 0 else healthy / total
+
+    def percentile(self, name, q, since=None, until=None):
+        """
+        Get a percentile of the durations of a guard.
+
+        :param q: percentile between 0 and 100
+        :type q: float
+
+        :return: duration in seconds or None if there are no records
+        :rtype: float
+        """
+        durations = []
+        for fields in self._blocks(name, since, until):
+            durations.extend(fields[1::4])
+        count = len(durations)
+        if count == 0:
+            return None
+        rank = max(0, min(count - 1, int(math.ceil(q / 100 * count)) - 1))
+        # the common percentiles are near an end, a heap of that end is cheaper than sorting everything
+        if 8 * (rank + 1) <= count:
+            return heapq.nsmallest(rank + 1, durations)[-1]
+        if 8 * (count - rank) <= count:
+            return heapq.nlargest(count - rank, durations)[-1]
+        durations.sort()
+        return durations[rank]
+
+    def guards(self):
+        """
+        Get the names of all guards in the history.
+
+        :return: names
+        :rtype: list
+        """
+        return sorted(self._ids)
+
+    def rotate(self, now=None):
+        """
+        Delete the months which are completely older than the retention.
+        """
+        if self._retention_days is None:
+            return
+        now = time.time() if now is None else now
+        limit = now - self._retention_days * 24 * 60 * 60
+        for guard_id in self._ids.values():
+            directory = os.path.join(self._directory, str(guard_id))
+            if not os.path.isdir(directory):
+                continue
+            for month in os.listdir(directory):
+                if not self._month_overlaps(month, limit, float('inf')):
+                    _logger.info('Delete history {}/{}'.format(guard_id, month))
+                    os.remove(os.path.join(directory, month))
+
+    def _blocks(self, name, since, until):
+        """
+        Get the fields of the records of a guard in a time range, flat and a block at a time.
+        """
+        guard_id = self._guard_id(name)
+        if guard_id is None:
+            return
+        since = 0.0 if since is None else since
+        until = float('inf') if until is None else until
+        directory = os.path.join(self._directory, str(guard_id))
+        for month in sorted(os.listdir(directory)):
+            if not self._month_overlaps(month, since, until):
+                continue
+            for fields in self._read_chunk(os.path.join(directory, month), since, until):
+                yield fields
+
+    def _guard_id(self, name, create=False):
+        guard_id = self._ids.get(name)
+        if guard_id is None and create:
+            guard_id = len(self._ids)
+            with io.open(os.path.join(self._directory, 'guards'), 'a', encoding='utf-8') as names:
+                names.write(u'{}\n'.format(name.replace('\n', ' ')))
+            self._ids[name] = guard_id
+            os.makedirs(os.path.join(self._directory, str(guard_id)))
+        return guard_id
+
+    def _chunk_path(self, guard_id, timestamp):
+        month = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m')
+        return os.path.join(self._directory, str(guard_id), month)
+
+    @staticmethod
+    def _month_overlaps(month, since, until):
+        start = datetime.datetime.strptime(month, '%Y-%m')
+        end = datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return time.mktime(start.timetuple()) < until and time.mktime(end.timetuple()) > since
+
+    @staticmethod
+    def _last_timestamp(path):
+        # the newest chunk of a guard is the one of the current month
+        if not os.path.exists(path) or os.path.getsize(path) < _RECORD.size:
+            return 0.0
+        with open(path, 'rb') as chunk:
+            chunk.seek((os.path.getsize(path) // _RECORD.size - 1) * _RECORD.size)
+            return _RECORD.unpack(chunk.read(_RECORD.size))[0]
+
+    @staticmethod
+    def _read_chunk(path, since, until):
+        size = os.path.getsize(path)
+        count = size // _RECORD.size
+        if count == 0:
+            return
+        with open(path, 'rb') as chunk:
+            data = mmap.mmap(chunk.fileno(), count * _RECORD.size, access=mmap.ACCESS_READ)
+        try:
+            first = _bisect(data, count, since)
+            last = _bisect(data, count, until, first)
+            # one unpack per block instead of a call per record, the rest record by record
+            for index in range(first, last - _BLOCK_RECORDS + 1, _BLOCK_RECORDS):
+                yield _BLOCK.unpack_from(data, index * _RECORD.size)
+            rest = []
+            for index in range(last - (last - first) % _BLOCK_RECORDS, last):
+                rest.extend(_RECORD.unpack_from(data, index * _RECORD.size))
+            if rest:
+                yield rest
+        finally:
+            data.close()
+
+
+def _bisect(data, count, timestamp, low=0):
+    """
+    Find the index of the first record not older than timestamp, searching from low.
+    """
+    high = count
+    while low < high:
+        middle = (low + high) // 2
+        if _RECORD.unpack_from(data, middle * _RECORD.size)[0] < timestamp:
+            low = middle + 1
+        else:
+            high = middle
+    return low
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Guards declared in an INI file.
+
+Every ``[guard:<name>]`` section becomes one guard for all of its hosts, so a
+thousand hosts cost one guard object and one host list, not a thousand guards::
+
+    [hosts]
+    blus = ekpblus[001-500]
+    gpu = ekpgpu[01-08] ekpgpu[11,12]
+    # all exec hosts known to the qmaster, read with qconf -sel
+    exec = qconf:sel
+
+    [cluster]
+    ttl = 60
+    qhost = yes
+    timeout = 60
+
+    [guard:Gateway]
+    type = ping
+    hosts = gw-blus
+
+    [guard:Ping blus]
+    type = ping
+    hosts = @blus, @gpu
+    interval = 300
+    depends_on = Gateway
+
+    [guard:Execd]
+    type = tcp
+    hosts = @exec
+    port = 6445
+
+    [guard:Queues]
+    type = qstat
+
+    [guard:Overloaded hosts]
+    type = cluster
+    rule = overloaded
+    max_load_per_slot = 1.5
+
+    [ssh]
+    max_masters = 64
+    max_sessions = 4
+    options = -o ConnectTimeout=5
+
+    [guard:Node]
+    type = remote
+    hosts = @blus
+    check.execd = pgrep -x sge_execd
+    check.tmp = df -P /tmp | awk 'NR == 2 && $5 + 0 > 90 {exit 1}'
+
+Hosts are separated by commas or whitespace and may be hostname patterns
+(see :func:`watchman.squad.expand_hosts`), ``@group`` references to the
+``[hosts]`` section or ``qconf:sel``. A remote guard runs its ``check.<name>``
+shell commands on every host, one :class:`watchman.remote.RemoteGuard` per host
+over the connections of the ``[ssh]`` section (``transport = local`` runs them
+locally for tests). Every guard takes ``interval``,
+``timeout``, ``jitter``, ``depends_on``, the name of its parent guard, and
+``capture`` (``discard``, ``head_tail <head> <tail>`` or ``spool <threshold>``,
+see :mod:`watchman.capture`) and ``isolated = yes``, which runs the guard in a
+worker process (see :mod:`watchman.isolation`).
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import logging
+import os
+import re
+
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+from watchman.capture import parse_capture
+from watchman.squad import (PingGuard, MultiPingGuard, QstatFGuard, Watchman, RC_TIMEOUT, expand_hosts,
+                            run_steps)
+from watchman.probes import TcpGuard, IcmpGuard, SGE_EXECD_PORT
+from watchman.remote import RemoteGuard, SshPool, LocalPool
+from watchman.cluster import (ClusterSnapshot, ClusterGuard, unavailable_queues, disabled_queues, suspended_queues,
+                              overloaded_hosts)
+
+_logger = logging.getLogger(__name__)
+
+# a hostname pattern, commas inside the brackets of a range do not separate hosts
+_HOST_TOKEN = re.compile(r'[^\s,\[]+(?:\[[^\]]*\][^\s,\[]*)*')
+
+_GUARD_PREFIX = 'guard:'
+
+
+# the exec hosts of the last successful qconf -sel, used while qconf fails
+_EXEC_HOSTS = []
+
+
+class _QconfReader(Watchman):
+    """
+    Runs ``qconf -sel`` like a guard, so a hanging qmaster cannot block the reload.
+    """
+    def __init__(self, timeout):
+        super(_QconfReader, self).__init__('Inventory qconf', timeout=timeout)
+        self.command = ['qconf', '-sel']
+
+    def _check_output(self, return_code, out, error):
+        return []
+
+
+def read_qconf_hosts(timeout=30.0):
+    """
+    Get the exec hosts of the cluster from ``qconf -sel``. If qconf fails or does not answer
+    within the timeout, the hosts of its last successful run are used.
+
+    :param timeout: seconds qconf may run before its process group is killed
+    :type timeout: float
+
+    :return: hostnames
+    :rtype: list
+    """
+    result = run_steps(_QconfReader(timeout)._steps(streaming=False))
+    if result.return_code == 0:
+        _EXEC_HOSTS[:] = [str(host) for host in result.out.decode('utf-8').split()]
+        return list(_EXEC_HOSTS)
+    if result.return_code == RC_TIMEOUT:
+        reason = 'timed out after {:g}s'.format(timeout)
+    else:
+        reason = result.error.strip() or 'return code {}'.format(result.return_code)
+    if len(_EXEC_HOSTS) == 0:
+        raise ValueError('Could not read the exec hosts with qconf -sel: {}'.format(reason))
+    _logger.warning('Could not read the exec hosts with qconf -sel, use the last ones: {}'.format(reason))
+    return list(_EXEC_HOSTS)
+
+
+# path of a guard file -> objects shared by its guards, they outlive reloads of the file
+_SHARED = {}
+
+
+class Inventory(object):
+    """
+    Guard declarations read from an INI file, see the module documentation for the format.
+
+    The cluster snapshot and the SSH pool are shared by all guards of the file and
+    survive a reload: guards kept by the :class:`watchman.roster.Roster` and new
+    guards use the same objects, changed settings are applied to them.
+
+    :param path: path of the INI file
+    :type path: str
+
+    :param qconf_hosts: callable returning the exec hosts for ``qconf:sel``
+    :type qconf_hosts: callable
+
+    :param shared: dict keeping the shared objects between the inventories of the file
+                   (None: the one of the path)
+    :type shared: dict
+    """
+    def __init__(self, path, qconf_hosts=read_qconf_hosts, shared=None):
+        self._path = path
+        self._qconf_hosts = qconf_hosts
+        self._parser = configparser.RawConfigParser()
+        if len(self._parser.read(path)) == 0:
+            raise ValueError('Cannot read guard file {}'.format(path))
+        self._groups = {}
+        self._shared = _SHARED.setdefault(os.path.realpath(path), {}) if shared is None else shared
+        self._snapshot = None
+        self._pool = None
+
+    def guards(self):
+        """
+        Create the guards in the order of their sections.
+
+        :return: guards
+        :rtype: list
+        """
+        guards = []
+        parents = {}
+        for section in self._parser.sections():
+            if section.startswith(_GUARD_PREFIX):
+                options = collections.OrderedDict(self._parser.items(section))
+                parent = options.pop('depends_on', None)
+                created = self._create(section[len(_GUARD_PREFIX):].strip(), options)
+                created = created if isinstance(created, list) else [created]
+                guards += created
+                if parent is not None:
+                    parents.update((guard, parent.strip()) for guard in created)
+        by_name = dict((guard.name, guard) for guard in guards)
+        for guard, parent in parents.items():
+            if parent not in by_name:
+                raise ValueError('Guard {} depends on unknown guard {}'.format(guard.name, parent))
+            guard.depends_on = by_name[parent]
+        return guards
+
+    def hosts(self, value):
+        """
+        Resolve a host list of the file.
+
+        :param value: hosts, patterns, @groups and qconf:sel separated by commas or whitespace
+        :type value: str
+
+        :return: hostnames without duplicates, in their order
+        :rtype: list
+        """
+        return self._resolve(value, ())
+
+    def _resolve(self, value, parents):
+        hosts = []
+        for token in _HOST_TOKEN.findall(value):
+            if token.startswith('@'):
+                hosts += self._group(token[1:], parents)
+            elif token == 'qconf:sel':
+                hosts += self._qconf_hosts()
+            else:
+                hosts += expand_hosts(token)
+        seen = set()
+        return [host for host in hosts if not (host in seen or seen.add(host))]
+
+    def _group(self, name, parents):
+        if name in parents:
+            raise ValueError('Host group @{} contains itself.'.format(name))
+        if name not in self._groups:
+            if not self._parser.has_option('hosts', name):
+                raise ValueError('Unknown host group @{} in {}'.format(name, self._path))
+            self._groups[name] = self._resolve(self._parser.get('hosts', name), parents + (name,))
+        return self._groups[name]
+
+    def _cluster(self):
+        if self._snapshot is None:
+            options = dict(self._parser.items('cluster')) if self._parser.has_section('cluster') else {}
+            timeout = options.get('timeout')
+            settings = dict(ttl=float(options.get('ttl', 60)),
+                            qhost=options.get('qhost', 'no').lower() in ('yes', 'true', 'on', '1'),
+                            timeout=None if timeout is None else float(timeout))
+            self._snapshot = self._shared.get('cluster')
+            if self._snapshot is None:
+                self._snapshot = self._shared['cluster'] = ClusterSnapshot(**settings)
+            else:
+                self._snapshot.configure(**settings)
+        return self._snapshot
+
+    def _ssh(self):
+        if self._pool is None:
+            options = dict(self._parser.items('ssh')) if self._parser.has_section('ssh') else {}
+            max_sessions = int(options.get('max_sessions', 4))
+            max_masters = int(options.get('max_masters', 64))
+            transport = options.get('transport', 'ssh')
+            # settings which change the commands of the guards need a new pool, the guards are replaced anyway
+            key = (transport, int(options.get('persist', 300)), options.get('control_dir', '~/.watchman/ssh'),
+                   tuple(options.get('options', '').split()))
+            known_key, self._pool = self._shared.get('ssh', (None, None))
+            if known_key != key:
+                if transport == 'local':
+                    self._pool = LocalPool(max_sessions=max_sessions)
+                else:
+                    self._pool = SshPool(max_masters=max_masters, max_sessions=max_sessions, persist=key[1],
+                                         control_dir=key[2], options=list(key[3]))
+                self._shared['ssh'] = (key, self._pool)
+            elif transport == 'local':
+                self._pool.limit(max_sessions)
+            else:
+                self._pool.limit(max_sessions, max_masters)
+        return self._pool
+
+    def _create(self, name, options):
+        kind = options.pop('type', None)
+        kwargs = {}
+        for key in ('interval', 'timeout', 'jitter'):
+            if key in options:
+                kwargs[key] = float(options.pop(key))
+        if 'capture' in options:
+            kwargs['capture'] = parse_capture(options.pop('capture'))
+        if 'isolated' in options:
+            kwargs['isolated'] = options.pop('isolated').lower() in ('yes', 'true', 'on', '1')
+        hosts = self.hosts(options.pop('hosts', ''))
+        needs_hosts = kind in ('ping', 'tcp', 'icmp', 'remote')
+        if needs_hosts and len(hosts) == 0:
+            raise ValueError('Guard {} has no hosts.'.format(name))
+
+        if kind == 'ping':
+            retries = int(options.pop('retries', 3))
+            if len(hosts) == 1:
+                guard = PingGuard(name, hosts[0], **kwargs)
+            else:
+                guard = MultiPingGuard(name, hosts, retries=retries, **kwargs)
+        elif kind == 'tcp':
+            guard = TcpGuard(name, hosts, port=int(options.pop('port', SGE_EXECD_PORT)),
+                             probe_timeout=float(options.pop('probe_timeout', 2.0)), **kwargs)
+        elif kind == 'icmp':
+            guard = IcmpGuard(name, hosts, count=int(options.pop('count', 3)),
+                              probe_timeout=float(options.pop('probe_timeout', 2.0)), **kwargs)
+        elif kind == 'qstat':
+            guard = QstatFGuard(name, **kwargs)
+        elif kind == 'cluster':
+            guard = ClusterGuard(name, self._cluster(), self._rule(name, options), **kwargs)
+        elif kind == 'remote':
+            checks = collections.OrderedDict((key[len('check.'):], options.pop(key))
+                                             for key in list(options) if key.startswith('check.'))
+            if len(checks) == 0:
+                raise ValueError('Remote guard {} has no checks.'.format(name))
+            guard = [RemoteGuard('{} {}'.format(name, host), host, checks, self._ssh(), **kwargs) for host in hosts]
+        else:
+            raise ValueError('Guard {} has unknown type {}'.format(name, kind))
+
+        if len(options) > 0:
+            raise ValueError('Guard {} has unknown options {}'.format(name, ', '.join(sorted(options))))
+        return guard
+
+    @staticmethod
+    def _rule(name, options):
+        rule = options.pop('rule', None)
+        if rule == 'unavailable':
+            return unavailable_queues()
+        if rule == 'disabled':
+            return disabled_queues()
+        if rule == 'suspended':
+            return suspended_queues()
+        if rule == 'overloaded':
+            return overloaded_hosts(max_load_per_slot=float(options.pop('max_load_per_slot', 1.5)))
+        raise ValueError('Guard {} has unknown rule {}'.format(name, rule))
+
+
+def load_guards(path):
+    """
+    Create the guards declared in an INI file.
+
+    :param path: path of the INI file
+    :type path: str
+
+    :return: guards
+    :rtype: list
+    """
+    return Inventory(path).guards()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watches of heavy guards in recycled worker processes.
+
+Parsing large command output, e.g. ``qstat -f -xml`` of a big cluster, raises
+the peak memory of the process, and the long-lived daemon would keep that
+memory after the heap fragmented. An isolated guard (``isolated=True``) runs
+its command and :meth:`watchman.squad.Watchman._check_output` in a worker
+process of a :class:`WorkerPool` instead. Only the alerts, the result with its
+output shortened for reports and the attributes the guard lists in
+``_worker_state`` come back. A worker is replaced after ``max_tasks`` watches
+or when its resident memory grew by more than ``max_rss`` bytes since it started.
+
+The workers are started with fork and exec (``python -m watchman.isolation``),
+never with a bare fork of the multi-threaded daemon, whose locks could be held
+by other threads at the time of the fork. The daemon and a worker exchange
+pickled messages, each one prefixed by its length, over the stdin and stdout
+of the worker.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import os
+import pickle
+import resource
+import select
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from watchman import metrics
+from watchman.capture import excerpt
+from watchman.squad import Result, RC_CRASHED, RC_TIMEOUT
+
+_logger = logging.getLogger(__name__)
+
+# seconds a worker may need beyond the timeout of the guard, e.g. to parse the output
+_GRACE = 30
+
+_LENGTH = struct.Struct('!I')
+
+
+def _rss():
+    """
+    Get the current resident memory of this process in bytes.
+
+    :return: bytes or None where /proc is not available
+    :rtype: int
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return None
+
+
+def _send(stream, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+def _receive(stream):
+    """
+    Read one message.
+
+    :raises EOFError: if the other side closed the pipe
+    """
+    length = _LENGTH.unpack(_read_exactly(stream, _LENGTH.size))[0]
+    return pickle.loads(_read_exactly(stream, length))
+
+
+def _read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError('pipe closed')
+        data += chunk
+    return data
+
+
+def _serve(requests, answers):
+    """
+    Main loop of a worker process: watch the guards sent over the pipe.
+
+    :param requests: pipe of the daemon to the worker
+    :type requests: file
+
+    :param answers: pipe of the worker to the daemon
+    :type answers: file
+    """
+    baseline = _rss()
+    running = []
+
+    def terminate(signum, frame):
+        # the command of the guard runs in its own process group
+        for guard in running:
+            guard.abort()
+        os._exit(1)
+    signal.signal(signal.SIGTERM, terminate)
+
+    while True:
+        try:
+            length = _LENGTH.unpack(_read_exactly(requests, _LENGTH.size))[0]
+            data = _read_exactly(requests, length)
+        except EOFError:
+            return
+        growth = None
+        try:
+            guard = pickle.loads(data)
+        except Exception as e:
+            # e.g. a guard class defined in the config, which the worker cannot import
+            _send(answers, ('unpicklable', str(e), growth))
+            continue
+        running.append(guard)
+        try:
+            alerts = []
+            guard._conclude(guard._perform(), alerts)
+            result = guard.last_result
+            out = result.out if isinstance(result.out, (str, bytes)) else guard._format_output(result.out)
+            result = result._replace(out=excerpt(out, guard.report_limit),
+                                     error=excerpt(result.error, guard.report_limit))
+            state = dict((key, getattr(guard, key)) for key in guard._worker_state)
+            answer = ('done', alerts, result, state)
+        except Exception as e:
+            _logger.exception('{} crashed in worker process.'.format(guard))
+            answer = ('crashed', 'Guard crashed in worker process: {}'.format(e))
+        finally:
+            del running[:]
+        rss = _rss()
+        if rss is not None and baseline is not None:
+            growth = rss - baseline
+        _send(answers, answer + (growth,))
+
+
+def main():
+    """
+    Entry point of a worker process.
+    """
+    logging.basicConfig(level=logging.WARNING, format='[%(asctime)s][%(levelname)s] worker: %(message)s')
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+    answers = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    # output of the guards must not end up in the answers
+    with open(os.devnull, 'rb') as devnull:
+        os.dup2(devnull.fileno(), sys.stdin.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    _serve(requests, answers)
+
+
+class _Worker(object):
+    """
+    One worker process and the pipes to it.
+    """
+    def __init__(self):
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.environ.get('PYTHONPATH')
+        env = dict(os.environ, PYTHONPATH=package if not path else os.pathsep.join([package, path]))
+        self.process = subprocess.Popen([sys.executable, '-m', 'watchman.isolation'], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, bufsize=0, close_fds=True, env=env)
+        self.tasks = 0
+        self.rss = 0
+        self.aborted = False
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def send(self, task):
+        """
+        Send a pickled guard.
+
+        :raises IOError: if the worker died
+        """
+        self.process.stdin.write(_LENGTH.pack(len(task)) + task)
+        self.process.stdin.flush()
+
+    def fileno(self):
+        """
+        Get the file descriptor the answers arrive on.
+
+        :return: file descriptor
+        :rtype: int
+        """
+        return self.process.stdout.fileno()
+
+    def poll(self, timeout):
+        """
+        Wait until an answer arrives.
+
+        :param timeout: seconds to wait (None: forever)
+        :type timeout: float
+
+        :return: True if an answer or the end of the pipe arrived
+        :rtype: bool
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                readable = select.select([self.process.stdout], [], [],
+                                         None if end is None else max(0.0, end - time.time()))[0]
+                return len(readable) > 0
+            except select.error:
+                pass  # interrupted by a signal
+
+    def receive(self):
+        """
+        Read an answer.
+
+        :raises EOFError: if the worker died
+        """
+        return _receive(self.process.stdout)
+
+    def terminate(self):
+        if self.is_alive():
+            self.process.terminate()
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        end = time.time() + 1.0
+        while self.is_alive() and time.time() < end:
+            time.sleep(0.01)
+        if self.is_alive():
+            self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class WorkerPool(object):
+    """
+    Small pool of worker processes running isolated guards, started when needed.
+
+    :param processes: maximal number of worker processes
+    :type processes: int
+
+    :param max_tasks: watches after which a worker process is replaced
+    :type max_tasks: int
+
+    :param max_rss: bytes the resident memory of a worker process may grow before it is replaced (None: no limit)
+    :type max_rss: int
+    """
+    def __init__(self, processes=2, max_tasks=100, max_rss=256 * 1024 * 1024):
+        if processes < 1:
+            raise ValueError('processes has to be at least 1, got {}'.format(processes))
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss
+        # idle workers, None is a worker which is not started yet
+        self._idle = queue.Queue()
+        for i in range(processes):
+            self._idle.put(None)
+        self._lock = threading.Lock()
+        # guard -> worker watching it
+        self._busy = {}
+
+    def guard(self, guard, alerts):
+        """
+        Let a worker process watch a guard. The counterpart of :meth:`watchman.squad.Watchman.guard`.
+
+        :param guard: isolated guard
+        :type guard: Watchman
+
+        :param alerts: the alerts of the guard are added to it
+        :type alerts: list
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.is_alive():
+                worker = _Worker()
+            worker = self._watch(worker, guard, alerts)
+        finally:
+            self._idle.put(worker)
+
+    def steps(self, guard, alerts):
+        """
+        Let a worker process watch a guard without blocking, the counterpart of
+        :meth:`watchman.squad.Watchman.watch` for the :class:`watchman.loop.GuardLoop`.
+
+        The generator yields (file descriptors, wake-up time) while it waits for an
+        idle worker and for the answer, and concludes the watch itself. Closing it
+        kills the worker process.
+
+        :param guard: isolated guard
+        :type guard: Watchman
+
+        :param alerts: the alerts of the guard are added to it
+        :type alerts: list
+
+        :return: generator of (file descriptors, wake-up time) tuples
+        :rtype: generator
+        """
+        pause = 0.001
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+                break
+            except queue.Empty:
+                yield [], time.time() + pause
+                pause = min(0.1, pause * 2)
+        try:
+            if worker is None or not worker.is_alive():
+                worker = _Worker()
+            task = self._pickle(guard)
+            if task is not None:
+                timeout = None if guard.timeout is None else guard.timeout + _GRACE
+                with self._lock:
+                    self._busy[guard] = worker
+                try:
+                    worker.send(task)
+                    fd = yield [worker.fileno()], None if timeout is None else time.time() + timeout
+                    answer = None if fd is None else worker.receive()
+                except (EOFError, IOError, OSError):
+                    worker = self._died(worker, guard, alerts)
+                    return
+                except GeneratorExit:
+                    worker.terminate()
+                    worker = self._retire(worker)
+                    raise
+                finally:
+                    with self._lock:
+                        self._busy.pop(guard, None)
+                if answer is None:
+                    worker = self._timed_out(worker, guard, timeout, alerts)
+                    return
+                worker = self._take(worker, guard, answer, alerts)
+                if answer[0] != 'unpicklable':
+                    return
+            # run the guard in the daemon, the worker stays reserved meanwhile
+            steps = guard._steps()
+            try:
+                wanted = next(steps)
+                while not isinstance(wanted, Result):
+                    wanted = steps.send((yield wanted))
+            finally:
+                steps.close()
+            guard._conclude(wanted, alerts)
+        finally:
+            self._idle.put(worker)
+
+    def abort(self, guard):
+        """
+        Kill the worker process watching a guard, e.g. when the sweep budget is exhausted.
+        The worker kills the command of the guard and is replaced.
+
+        :param guard: isolated guard
+        :type guard: Watchman
+        """
+        with self._lock:
+            worker = self._busy.get(guard)
+            if worker is not None:
+                worker.aborted = True
+                worker.terminate()
+
+    @staticmethod
+    def _pickle(guard):
+        """
+        Pickle a guard for a worker.
+
+        :return: pickled guard or None if the guard has to be watched in the daemon
+        :rtype: bytes
+        """
+        try:
+            return pickle.dumps(guard, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError) as e:
+            # e.g. guards sharing a snapshot or a connection pool, which hold locks
+            _logger.warning('{} cannot run in a worker process, watch it in the daemon: {}'.format(guard, e))
+            return None
+
+    def _watch(self, worker, guard, alerts):
+        """
+        Send the guard to the worker and take over its result.
+
+        :return: the worker if it can be used again, None otherwise
+        :rtype: _Worker
+        """
+        task = self._pickle(guard)
+        if task is None:
+            guard._conclude(guard._perform(), alerts)
+            return worker
+        timeout = None if guard.timeout is None else guard.timeout + _GRACE
+        with self._lock:
+            self._busy[guard] = worker
+        try:
+            worker.send(task)
+            if not worker.poll(timeout):
+                return self._timed_out(worker, guard, timeout, alerts)
+            answer = worker.receive()
+        except (EOFError, IOError, OSError):
+            return self._died(worker, guard, alerts)
+        finally:
+            with self._lock:
+                self._busy.pop(guard, None)
+        worker = self._take(worker, guard, answer, alerts)
+        if answer[0] == 'unpicklable':
+            guard._conclude(guard._perform(), alerts)
+        return worker
+
+    def _timed_out(self, worker, guard, timeout, alerts):
+        """
+        Kill a worker which did not answer in time.
+
+        :return: None, the worker cannot be used again
+        :rtype: _Worker
+        """
+        _logger.error('Worker process of {} did not answer within {}s, kill it.'.format(guard, timeout))
+        worker.terminate()
+        alerts.append((guard.name, guard.command, RC_TIMEOUT,
+                       'Worker process did not answer within {}s.'.format(timeout)))
+        return self._retire(worker)
+
+    def _died(self, worker, guard, alerts):
+        """
+        Report a worker which died or was aborted while it watched a guard.
+
+        :return: None, the worker cannot be used again
+        :rtype: _Worker
+        """
+        worker.process.wait()
+        if worker.aborted:
+            _logger.warning('Aborted worker process of {}.'.format(guard))
+            alerts.append((guard.name, guard.command, RC_TIMEOUT, 'Worker process aborted.'))
+        else:
+            _logger.error('Worker process of {} died with exit code {}.'.format(guard, worker.process.returncode))
+            alerts.append((guard.name, guard.command, RC_CRASHED,
+                           'Worker process died with exit code {}.'.format(worker.process.returncode)))
+        return self._retire(worker)
+
+    def _take(self, worker, guard, answer, alerts):
+        """
+        Take over the answer of a worker. A guard the worker could not unpickle is
+        left to the caller, which watches it in the daemon.
+
+        :return: the worker if it can be used again, None otherwise
+        :rtype: _Worker
+        """
+        worker.tasks += 1
+        worker.rss = answer[-1] or 0
+        if answer[0] == 'unpicklable':
+            _logger.warning('{} cannot run in a worker process, watch it in the daemon: {}'.format(guard, answer[1]))
+            return worker
+        if answer[0] == 'done':
+            own_alerts, result, state = answer[1:4]
+            for key, value in state.items():
+                setattr(guard, key, value)
+            guard._record(result)
+        else:
+            own_alerts = [(guard.name, guard.command, RC_CRASHED, answer[1])]
+        if len(own_alerts) > 0:
+            alerts += own_alerts
+            metrics.GUARD_ALERTS.add(len(own_alerts), guard.name)
+        if worker.tasks >= self._max_tasks or (self._max_rss is not None and worker.rss > self._max_rss):
+            _logger.info('Replace worker process after {} watches with {} MB more resident memory.'.format(
+                worker.tasks, worker.rss // (1024 * 1024)))
+            return self._retire(worker)
+        return worker
+
+    @staticmethod
+    def _retire(worker):
+        worker.stop()
+        return None
+
+    def close(self):
+        """
+        Stop the idle worker processes, the pool cannot be used afterwards.
+        """
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class Logbook(object):
+    """
+    The Logbook remembers which alerts are open, so the admin is only
+    informed when something changes: a new failure, a recovery or a failure
+    which is still open after the re-notify period.
+
+    Every alert is identified by guard name, command and message. The open
+    alerts are kept in a SQLite database and survive restarts of the daemon.
+
+    :param path: path of the database file (None: keep the alerts in memory only)
+    :type path: str
+
+    :param renotify: seconds after which an open alert is sent again (None: never)
+    :type renotify: float
+    """
+    def __init__(self, path=None, renotify=None):
+        self._path = ':memory:' if path is None else os.path.expanduser(path)
+        self._renotify = renotify
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS open_alerts ('
+                             'guard TEXT NOT NULL, '
+                             'command TEXT NOT NULL, '
+                             'message TEXT NOT NULL, '
+                             'return_code INTEGER, '
+                             'first_seen REAL NOT NULL, '
+                             'last_seen REAL NOT NULL, '
+                             'last_sent REAL NOT NULL, '
+                             'PRIMARY KEY (guard, command, message))')
+
+    def triage(self, guards, alerts, now=None):
+        """
+        Record the alerts of a sweep and decide which of them have to be sent.
+
+        Open alerts of guards which were on watch in this sweep but did not
+        report them again are closed and returned as recovered.
+
+        :param guards: guards which were on watch or their names
+        :type guards: list
+
+        :param alerts: alerts of the sweep: [(guard_name, command, return_code, error message)]
+        :type alerts: list
+
+        :param now: time of the sweep as unix timestamp (None: now)
+        :type now: float
+
+        :return: alerts which have to be sent and alerts which recovered
+        :rtype: tuple
+        """
+        now = time.time() if now is None else now
+        names = set(getattr(guard, 'name', guard) for guard in guards)
+        to_send = []
+        seen = set()
+
+        with self._lock, self._db:
+            for alert in alerts:
+                key = self._key(alert)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                row = self._db.execute('SELECT last_sent FROM open_alerts '
+                                       'WHERE guard = ? AND command = ? AND message = ?', key).fetchone()
+                if row is None:
+                    self._db.execute('INSERT INTO open_alerts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     key + (alert[2], now, now, now))
+                    to_send.append(alert)
+                elif self._renotify is not None and now - row[0] >= self._renotify:
+                    self._db.execute('UPDATE open_alerts SET return_code = ?, last_seen = ?, last_sent = ? '
+                                     'WHERE guard = ? AND command = ? AND message = ?', (alert[2], now, now) + key)
+                    to_send.append(alert)
+                else:
+                    self._db.execute('UPDATE open_alerts SET return_code = ?, last_seen = ? '
+                                     'WHERE guard = ? AND command = ? AND message = ?', (alert[2], now) + key)
+
+            recovered = []
+            for name in names:
+                for guard, command, message, return_code in self._db.execute(
+                        'SELECT guard, command, message, return_code FROM open_alerts WHERE guard = ?',
+                        (name,)).fetchall():
+                    if (guard, command, message) not in seen:
+                        recovered.append((guard, json.loads(command), return_code, message))
+                        self._db.execute('DELETE FROM open_alerts WHERE guard = ? AND command = ? AND message = ?',
+                                         (guard, command, message))
+
+        _logger.debug('{} alerts, {} to send, {} recovered.'.format(len(alerts), len(to_send), len(recovered)))
+        return to_send, recovered
+
+    def open_alerts(self):
+        """
+        Get all open alerts.
+
+        :return: list with alerts: [(guard_name, command, return_code, error message)]
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT guard, command, return_code, message FROM open_alerts '
+                                    'ORDER BY first_seen').fetchall()
+        return [(guard, json.loads(command), return_code, message) for guard, command, return_code, message in rows]
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _key(alert):
+        """
+        Get the identity of an alert.
+
+        :param alert: (guard_name, command, return_code, error message)
+        :type alert: tuple
+
+        :return: guard name, command as json and message
+        :rtype: tuple
+        """
+        message = alert[3]
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        return alert[0], json.dumps(alert[1]), u'{}'.format(message)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watches of many guards on one thread.
+
+The :class:`GuardLoop` is a drop-in replacement of the :class:`watchman.patrol.Patrol`.
+Instead of a thread per running guard it drives the :meth:`watchman.squad.Watchman.watch`
+generators of up to ``max_running`` guards from one poll loop: the commands run as
+child processes, their pipes, the sockets of the probes and the pipes to the
+worker processes of isolated guards are multiplexed, and every guard is resumed
+when its file descriptor is ready or its wake-up time passes. The guards check
+their output with their usual ``_check_output``, so every guard runs in the loop unchanged.
+
+Dependent guards wait for their parent and are skipped while it fails, the
+same way as in the Patrol (see :mod:`watchman.circuit`).
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import logging
+import time
+
+from watchman.circuit import CircuitBreaker
+from watchman.poller import Poller, READ
+from watchman.squad import RC_CRASHED, RC_TIMEOUT
+
+_logger = logging.getLogger(__name__)
+
+
+class GuardLoop(object):
+    """
+    Sends many guards on watch at the same time without threads.
+
+    :param max_running: maximal number of guards on watch at the same time
+    :type max_running: int
+
+    :param budget: seconds a whole sweep may take (None: no limit)
+    :type budget: float
+    """
+    def __init__(self, max_running=256, budget=None):
+        if max_running < 1:
+            raise ValueError('max_running has to be at least 1, got {}'.format(max_running))
+        self._max_running = max_running
+        self._budget = budget
+
+    def march(self, guards):
+        """
+        Send all guards on watch and collect their alerts.
+
+        :param guards: list of guards
+        :type guards: list
+
+        :return: list with alerts of all guards
+        :rtype: list
+        """
+        sweep = _LoopSweep(list(guards))
+        deadline = None if self._budget is None else time.time() + self._budget
+        while True:
+            while len(sweep.tasks) < self._max_running:
+                taken = sweep.circuit.take()
+                if taken is None:
+                    break
+                index, guard, root = taken
+                if root is None:
+                    sweep.start(index, guard)
+            if len(sweep.tasks) == 0:
+                break
+            if deadline is not None and time.time() >= deadline:
+                self._call_off(sweep)
+                break
+            sweep.wait(deadline)
+        return sweep.alerts + sweep.circuit.root_causes()
+
+    def _call_off(self, sweep):
+        """
+        Abort the running guards and skip the waiting ones after the budget is exhausted.
+
+        :param sweep: the running sweep
+        :type sweep: _LoopSweep
+        """
+        running, waiting = sweep.circuit.call_off()
+        for guard in running:
+            _logger.warning('Sweep budget of {}s exhausted, abort {}.'.format(self._budget, guard))
+            sweep.alerts.append((guard.name, guard.command, RC_TIMEOUT,
+                                 'Aborted, sweep budget of {}s exhausted.'.format(self._budget)))
+        for index in list(sweep.tasks):
+            sweep.abort(index)
+        for guard in waiting:
+            sweep.alerts.append((guard.name, guard.command, RC_TIMEOUT,
+                                 'Skipped, sweep budget of {}s exhausted.'.format(self._budget)))
+        if len(waiting) > 0:
+            _logger.warning('Sweep budget of {}s exhausted, skipped {} guards.'.format(self._budget, len(waiting)))
+
+
+class _LoopSweep(object):
+    """
+    Bookkeeping of one sweep of the GuardLoop.
+
+    :param guards: guards of the sweep
+    :type guards: list
+    """
+    def __init__(self, guards):
+        self.circuit = CircuitBreaker(guards)
+        self.alerts = []
+        # index -> (guard, generator, own alerts)
+        self.tasks = collections.OrderedDict()
+        # index -> file descriptor -> events it waits for, index -> wake-up time, file descriptor -> index
+        self._registered = {}
+        self._wakeups = {}
+        self._owners = {}
+        self._poller = Poller()
+
+    def start(self, index, guard):
+        own_alerts = []
+        self.tasks[index] = (guard, guard.watch(own_alerts), own_alerts)
+        self._resume(index, None)
+
+    def abort(self, index):
+        self._forget(index)
+        guard, task, _ = self.tasks.pop(index)
+        task.close()
+
+    def wait(self, sweep_deadline):
+        """
+        Wait until a file descriptor is ready or a wake-up time passes and resume the guards concerned.
+        A guard is resumed once per round, for the first of its ready file descriptors.
+        """
+        wakeups = [wakeup for wakeup in self._wakeups.values() if wakeup is not None]
+        if sweep_deadline is not None:
+            wakeups.append(sweep_deadline)
+        wait = 1.0 if len(wakeups) == 0 else max(0.0, min(wakeups) - time.time())
+        resumed = set()
+        for fd, events in self._poller.poll(wait):
+            index = self._owners.get(fd)
+            if index is not None and index not in resumed:
+                resumed.add(index)
+                self._resume(index, fd)
+        now = time.time()
+        for index, wakeup in list(self._wakeups.items()):
+            if wakeup is not None and wakeup <= now and index not in resumed:
+                self._resume(index, None)
+
+    def _resume(self, index, value):
+        guard, task, own_alerts = self.tasks[index]
+        try:
+            waits, wakeup = task.send(value)
+        except StopIteration:
+            self._finish(index)
+            return
+        except Exception as e:
+            _logger.exception('{} failed on watch.'.format(guard))
+            own_alerts.append((guard.name, guard.command, RC_CRASHED, 'Guard crashed: {}'.format(e)))
+            self._finish(index)
+            return
+        if not isinstance(waits, dict):
+            waits = dict.fromkeys(waits, READ)
+        registered = self._registered.get(index, {})
+        self._poller.update(registered, waits)
+        for fd in registered:
+            if fd not in waits:
+                del self._owners[fd]
+        for fd in waits:
+            self._owners[fd] = index
+        self._registered[index] = dict(waits)
+        self._wakeups[index] = wakeup
+
+    def _forget(self, index):
+        registered = self._registered.pop(index, {})
+        self._poller.update(registered, {})
+        for fd in registered:
+            del self._owners[fd]
+        self._wakeups.pop(index, None)
+
+    def _finish(self, index):
+        self._forget(index)
+        _, _, own_alerts = self.tasks.pop(index)
+        self.circuit.finish(index, own_alerts)
+        self.alerts += own_alerts
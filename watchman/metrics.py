@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of watchman in the Prometheus text format.
+
+The metrics are collected in :data:`REGISTRY` and can be scraped over HTTP
+(:func:`serve`) or written for the textfile collector of the node exporter
+(:func:`write_textfile`).
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return '{}'.format(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    """
+    Base of all metrics: a family of values, one per combination of label values.
+
+    :param name: name of the metric
+    :type name: str
+
+    :param documentation: help text
+    :type documentation: str
+
+    :param labels: names of the labels
+    :type labels: tuple
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError('{} needs the labels {}, got {}'.format(self.name, self.labels, labels))
+        return tuple(labels)
+
+    def remove(self, *labels):
+        """
+        Drop the value of a label combination, e.g. of a guard which does not exist any more.
+        """
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format.
+
+        :return: lines of the metric
+        :rtype: list
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines += self._render_value(labels, value)
+        return lines
+
+    def _render_value(self, labels, value):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, labels), _format_value(value))]
+
+
+class Counter(_Metric):
+    """
+    A value which only goes up.
+    """
+    type = 'counter'
+
+    def inc(self, *labels):
+        """
+        Increase the counter of the given label values by one.
+        """
+        self.add(1, *labels)
+
+    def add(self, amount, *labels):
+        """
+        Increase the counter of the given label values.
+
+        :param amount: increment
+        :type amount: float
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value which can go up and down.
+    """
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        """
+        Set the gauge of the given label values.
+
+        :param value: new value
+        :type value: float
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+
+    :param buckets: upper bounds of the buckets
+    :type buckets: tuple
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        """
+        Add an observation to the histogram of the given label values.
+
+        :param value: observed value
+        :type value: float
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_value(self, labels, value):
+        counts, total = value
+        lines = ['{}_bucket{} {}'.format(self.name, _format_labels(self.labels, labels, [('le', _format_value(bound))]),
+                                         count)
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labels, labels), _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labels, labels), counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """
+    Collection of metrics.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        :param metric: new metric
+        :type metric: _Metric
+
+        :return: the metric
+        :rtype: _Metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text format.
+
+        :return: exposition text
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+GUARD_DURATION = REGISTRY.register(Histogram(
+    'watchman_guard_duration_seconds', 'Execution time of the guard commands.', ('guard',)))
+GUARD_EXIT_CODE = REGISTRY.register(Gauge(
+    'watchman_guard_exit_code', 'Return code of the last guard command (negative: not found, timeout, ...).',
+    ('guard',)))
+GUARD_ALERTS = REGISTRY.register(Counter(
+    'watchman_guard_alerts_total', 'Alerts raised by the guards.', ('guard',)))
+SWEEP_DURATION = REGISTRY.register(Histogram(
+    'watchman_sweep_duration_seconds', 'Wall time of the sweeps.'))
+SCHEDULER_LAG = REGISTRY.register(Histogram(
+    'watchman_scheduler_lag_seconds', 'Delay between the deadline of a job and its start.'))
+SMTP_DURATION = REGISTRY.register(Histogram(
+    'watchman_smtp_send_duration_seconds', 'Time to hand a mail to the SMTP server.'))
+SMTP_FAILURES = REGISTRY.register(Counter(
+    'watchman_smtp_failures_total', 'Failed attempts to hand a mail to the SMTP server.'))
+
+
+def remove_guard(name):
+    """
+    Drop the values of a guard which is not on duty any more.
+
+    :param name: name of the guard
+    :type name: str
+    """
+    for metric in (GUARD_DURATION, GUARD_EXIT_CODE, GUARD_ALERTS):
+        metric.remove(name)
+
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    Write the metrics for the textfile collector of the node exporter.
+    The file is replaced atomically, so the collector never reads half a file.
+
+    :param path: path of the .prom file
+    :type path: str
+
+    :param registry: metrics to write
+    :type registry: Registry
+    """
+    path = os.path.expanduser(path)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as prom:
+        prom.write(registry.render())
+    os.rename(tmp, path)
+
+
+def serve(port, address='', registry=REGISTRY):
+    """
+    Serve the metrics over HTTP in a background thread.
+
+    :param port: TCP port
+    :type port: int
+
+    :param address: address to bind to ('' for all)
+    :type address: str
+
+    :param registry: metrics to serve
+    :type registry: Registry
+
+    :return: the running server, stop it with ``shutdown()``
+    :rtype: HTTPServer
+    """
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            _logger.debug('Metrics request from {}: {}'.format(self.client_address[0], format % args))
+
+    server = HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    _logger.info('Serve metrics on port {}'.format(port))
+    return server
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from watchman.circuit import CircuitBreaker
+from watchman.squad import RC_CRASHED, RC_TIMEOUT
+
+_logger = logging.getLogger(__name__)
+
+
+class Patrol(object):
+    """
+    A Patrol sends several guards on watch at the same time.
+
+    The guards are handed to a bounded pool of worker threads. Every guard
+    collects its alerts in its own list, the lists are passed back to the
+    Patrol over a queue, so no alert list is shared between the workers.
+    A sweep therefore takes about as long as the slowest guard.
+
+    If the sweep exceeds its budget, the Patrol aborts the running guards,
+    skips the waiting ones and returns, so the caller never blocks longer
+    than the budget.
+
+    A guard which depends on a parent guard waits until the parent finished
+    its watch in the same sweep. While the parent fails (circuit open) the
+    guard is skipped, and instead of the alerts of all children the sweep
+    reports one root-cause alert per failing parent, see :mod:`watchman.circuit`.
+
+    :param max_parallel: maximal number of guards on watch at the same time
+    :type max_parallel: int
+
+    :param budget: seconds a whole sweep may take (None: no limit)
+    :type budget: float
+    """
+    def __init__(self, max_parallel=16, budget=None):
+        if max_parallel < 1:
+            raise ValueError('max_parallel has to be at least 1, got {}'.format(max_parallel))
+        self._max_parallel = max_parallel
+        self._budget = budget
+
+    def march(self, guards):
+        """
+        Send all guards on watch and collect their alerts.
+
+        :param guards: list of guards
+        :type guards: list
+
+        :return: list with alerts of all guards
+        :rtype: list
+        """
+        guards = list(guards)
+        if len(guards) == 0:
+            return []
+
+        sweep = _Sweep(guards)
+        for i in range(min(self._max_parallel, len(guards))):
+            worker = threading.Thread(target=self._work, args=(sweep,),
+                                      name='patrol-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+
+        deadline = None if self._budget is None else time.time() + self._budget
+        alerts = []
+        pending = len(guards)
+        while pending > 0:
+            wait = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                own_alerts = sweep.done.get(timeout=wait)
+            except queue.Empty:
+                alerts += self._call_off(sweep)
+                break
+            alerts += own_alerts
+            pending -= 1
+
+        return alerts + sweep.root_causes()
+
+    def _work(self, sweep):
+        """
+        Worker loop: take guards from the sweep until none is left.
+
+        :param sweep: the running sweep
+        :type sweep: _Sweep
+        """
+        while True:
+            taken = sweep.take()
+            if taken is None:
+                return
+
+            index, guard = taken
+            own_alerts = []
+            try:
+                guard.guard(own_alerts)
+            except Exception as e:
+                _logger.exception('{} failed on watch.'.format(guard))
+                own_alerts.append((guard.name, guard.command, RC_CRASHED, 'Guard crashed: {}'.format(e)))
+            sweep.finish(index, own_alerts)
+
+    def _call_off(self, sweep):
+        """
+        Abort the running guards and skip the waiting ones after the budget is exhausted.
+
+        :param sweep: the running sweep
+        :type sweep: _Sweep
+
+        :return: alerts for every guard which did not finish
+        :rtype: list
+        """
+        running, waiting = sweep.call_off()
+        alerts = []
+        for guard in running:
+            _logger.warning('Sweep budget of {}s exhausted, abort {}.'.format(self._budget, guard))
+            guard.abort()
+            alerts.append((guard.name, guard.command, RC_TIMEOUT,
+                           'Aborted, sweep budget of {}s exhausted.'.format(self._budget)))
+        for guard in waiting:
+            alerts.append((guard.name, guard.command, RC_TIMEOUT,
+                           'Skipped, sweep budget of {}s exhausted.'.format(self._budget)))
+        if len(waiting) > 0:
+            _logger.warning('Sweep budget of {}s exhausted, skipped {} guards.'.format(self._budget, len(waiting)))
+        return alerts
+
+
+class _Sweep(object):
+    """
+    Bookkeeping of one sweep, shared by the Patrol and its workers.
+
+    :param guards: guards of the sweep
+    :type guards: list
+    """
+    def __init__(self, guards):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._circuit = CircuitBreaker(guards)
+        self._called_off = False
+        self.done = queue.Queue()
+
+    def take(self):
+        """
+        Take the next waiting guard whose parent finished. Guards whose parent fails are skipped.
+
+        :return: index and guard or None if the sweep is over
+        :rtype: tuple
+        """
+        with self._lock:
+            while True:
+                if self._called_off or self._circuit.waiting == 0:
+                    return None
+                taken = self._circuit.take()
+                if taken is None:
+                    self._changed.wait()
+                    continue
+                index, guard, root = taken
+                if root is None:
+                    return index, guard
+                self._changed.notify_all()
+                self.done.put([])
+
+    def finish(self, index, alerts):
+        """
+        Hand in the alerts of a guard.
+
+        :param index: position of the guard in the sweep
+        :type index: int
+
+        :param alerts: alerts of the guard
+        :type alerts: list
+        """
+        with self._lock:
+            self._circuit.finish(index, alerts)
+            self._changed.notify_all()
+            if self._called_off:
+                return  # the Patrol did not wait for this guard
+        self.done.put(alerts)
+
+    def call_off(self):
+        """
+        End the sweep.
+
+        :return: guards still running and guards never started
+        :rtype: tuple
+        """
+        with self._lock:
+            self._called_off = True
+            running, waiting = self._circuit.call_off()
+            self._changed.notify_all()
+        return running, waiting
+
+    def root_causes(self):
+        with self._lock:
+            return self._circuit.root_causes()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Readiness of many file descriptors, shared by the probes and the GuardLoop.
+
+:class:`Poller` uses poll() where available and falls back to select().
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import errno
+import select
+import time
+
+if hasattr(select, 'poll'):
+    READ, WRITE, FAIL = select.POLLIN, select.POLLOUT, select.POLLERR | select.POLLHUP
+else:
+    READ, WRITE, FAIL = 1, 4, 8
+
+
+class Poller(object):
+    """
+    poll() where available, select() otherwise. Errors and hangups are always reported.
+    """
+    def __init__(self):
+        self._poll = select.poll() if hasattr(select, 'poll') else None
+        self._fds = {}
+
+    def register(self, fd, events):
+        """
+        Wait for events of a file descriptor.
+
+        :param fd: file descriptor
+        :type fd: int
+
+        :param events: READ and/or WRITE
+        :type events: int
+        """
+        if self._poll is not None:
+            self._poll.register(fd, events | FAIL)
+        self._fds[fd] = events
+
+    def modify(self, fd, events):
+        if self._poll is not None:
+            self._poll.modify(fd, events | FAIL)
+        self._fds[fd] = events
+
+    def unregister(self, fd):
+        if self._poll is not None:
+            self._poll.unregister(fd)
+        del self._fds[fd]
+
+    def update(self, old, new):
+        """
+        Change the registered file descriptors of one user of the poller.
+
+        :param old: file descriptor -> events registered so far
+        :type old: dict
+
+        :param new: file descriptor -> events to wait for from now on
+        :type new: dict
+        """
+        for fd in old:
+            if fd not in new:
+                self.unregister(fd)
+        for fd, events in new.items():
+            if fd not in old:
+                self.register(fd, events)
+            elif old[fd] != events:
+                self.modify(fd, events)
+
+    def poll(self, timeout):
+        """
+        Wait until a file descriptor is ready, a signal does not end the wait early.
+
+        :param timeout: seconds to wait (None: until a file descriptor is ready)
+        :type timeout: float
+
+        :return: (file descriptor, events) pairs
+        :rtype: list
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                return self._poll_once(None if end is None else max(0.0, end - time.time()))
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _poll_once(self, timeout):
+        if self._poll is not None:
+            return self._poll.poll(None if timeout is None else timeout * 1000)
+        readable = [fd for fd, events in self._fds.items() if events & READ]
+        writable = [fd for fd, events in self._fds.items() if events & WRITE]
+        readable, writable, failed = select.select(readable, writable, list(self._fds), timeout)
+        ready = collections.defaultdict(int)
+        for fds, event in ((readable, READ), (writable, WRITE), (failed, FAIL)):
+            for fd in fds:
+                ready[fd] |= event
+        return list(ready.items())
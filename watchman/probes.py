@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Guards which probe hosts from within the watchman process.
+
+Instead of starting a command per host, the probes open non-blocking sockets
+and are driven by one poll loop, so thousands of hosts can be checked
+concurrently from a single thread without any fork/exec. The hostnames are
+resolved before the loop starts, by a few threads with a bounded wait, and the
+addresses are cached, so a slow name server cannot stall the loop.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import errno
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+from watchman.poller import READ, WRITE
+from watchman.squad import Watchman, Result, expand_hosts
+
+_logger = logging.getLogger(__name__)
+
+# well known ports of the exec hosts
+SGE_EXECD_PORT = 6445
+SSH_PORT = 22
+
+_ICMP_ECHO_REQUEST = 8
+_ICMP_ECHO_REPLY = 0
+
+
+class _Lookup(object):
+    """
+    Lookups of the hostnames of one guard, :attr:`done` is set when all of them finished.
+    """
+    def __init__(self, hosts, addresses, lock):
+        self.hosts = hosts
+        self.addresses = addresses
+        self.errors = {}
+        self.done = threading.Event()
+        # the lock of the resolver, its threads fill addresses and errors
+        self._lock = lock
+
+    def results(self, waited):
+        """
+        Get the addresses found so far.
+
+        :param waited: seconds waited for the lookups, for the failure of unresolved hosts
+        :type waited: float
+
+        :return: host -> address, host -> reason of the failure for the hosts without address
+        :rtype: tuple
+        """
+        with self._lock:
+            addresses = dict(self.addresses)
+            errors = dict(self.errors)
+        for host in self.hosts:
+            if host not in addresses and host not in errors:
+                errors[host] = 'name not resolved within {}s'.format(waited)
+        return addresses, errors
+
+
+class _Resolver(object):
+    """
+    Resolves hostnames in a few threads and caches the addresses.
+
+    :param ttl: seconds an address is cached
+    :type ttl: float
+
+    :param max_threads: maximal number of threads resolving at the same time
+    :type max_threads: int
+    """
+    def __init__(self, ttl=300.0, max_threads=16):
+        self._ttl = ttl
+        self._max_threads = max_threads
+        self._lock = threading.Lock()
+        # host -> (address, expiry)
+        self._cache = {}
+
+    def lookup(self, hosts):
+        """
+        Start to resolve hostnames, cached addresses are found right away.
+        Lookups which are not waited for go on in the background and fill the cache.
+
+        :param hosts: hostnames
+        :type hosts: list
+
+        :return: the running lookups
+        :rtype: _Lookup
+        """
+        now = time.time()
+        addresses = {}
+        with self._lock:
+            for host in hosts:
+                cached = self._cache.get(host)
+                if cached is not None and cached[1] > now:
+                    addresses[host] = cached[0]
+        lookup = _Lookup(hosts, addresses, self._lock)
+        missing = collections.deque(sorted(set(host for host in hosts if host not in addresses)))
+        if len(missing) == 0:
+            lookup.done.set()
+            return lookup
+        left = [len(missing)]
+
+        def resolve():
+            while True:
+                try:
+                    host = missing.popleft()
+                except IndexError:
+                    return
+                try:
+                    address = socket.gethostbyname(host)
+                    with self._lock:
+                        self._cache[host] = (address, time.time() + self._ttl)
+                        lookup.addresses[host] = address
+                except (socket.error, socket.herror, socket.gaierror) as e:
+                    with self._lock:
+                        lookup.errors[host] = str(e)
+                with self._lock:
+                    left[0] -= 1
+                    if left[0] == 0:
+                        lookup.done.set()
+
+        for i in range(min(self._max_threads, len(missing))):
+            thread = threading.Thread(target=resolve, name='resolver')
+            thread.daemon = True
+            thread.start()
+        return lookup
+
+
+_RESOLVER = _Resolver()
+
+
+class _Probe(object):
+    """
+    A single non-blocking check of one host.
+    After :meth:`start` the probe waits for the events it returns,
+    :meth:`handle` gets the events and decides if the probe is done.
+    A probe which sets ``timer`` gets :meth:`tick` called at that time.
+
+    :param host: hostname
+    :type host: str
+
+    :param address: IP address of the host
+    :type address: str
+    """
+    def __init__(self, host, address):
+        self.host = host
+        self.address = address
+        self.sock = None
+        self.done = False
+        self.error = None
+        self.timer = None
+
+    def start(self):
+        """
+        Open the socket and start the probe.
+
+        :return: events to wait for
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def handle(self, events):
+        """
+        Handle the events of the socket.
+
+        :return: events to wait for next
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def tick(self):
+        """
+        Called when the timer passed.
+        """
+        self.timer = None
+
+    def finish(self, error=None):
+        """
+        End the probe.
+
+        :param error: reason of the failure, None if the host answered
+        :type error: str
+        """
+        self.done = True
+        self.error = error
+        if self.sock is not None:
+            self.sock.close()
+
+
+class _TcpProbe(_Probe):
+    """
+    Probe which connects to a TCP port.
+    """
+    def __init__(self, host, address, port):
+        super(_TcpProbe, self).__init__(host, address)
+        self.port = port
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        rc = self.sock.connect_ex((self.address, self.port))
+        if rc == 0:
+            self.finish()
+        elif rc not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            self.finish(os.strerror(rc))
+        return WRITE
+
+    def handle(self, events):
+        rc = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self.finish(None if rc == 0 else os.strerror(rc))
+        return 0
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class _IcmpProbe(_Probe):
+    """
+    Probe which sends ICMP echo requests over an unprivileged datagram socket, spacing seconds apart.
+    The kernel has to allow it for the group of the daemon (sysctl net.ipv4.ping_group_range).
+    """
+    def __init__(self, host, address, count, spacing=1.0):
+        super(_IcmpProbe, self).__init__(host, address)
+        self.count = count
+        self.spacing = spacing
+        self._sent = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        self.sock.setblocking(0)
+        self._send()
+        return READ
+
+    def tick(self):
+        self.timer = None
+        self._send()
+
+    def _send(self):
+        self._sent += 1
+        # the kernel replaces the identifier and the checksum of datagram sockets
+        header = struct.pack('!BBHHH', _ICMP_ECHO_REQUEST, 0, 0, 0, self._sent)
+        payload = b'watchman'
+        header = struct.pack('!BBHHH', _ICMP_ECHO_REQUEST, 0, _checksum(header + payload), 0, self._sent)
+        self.sock.sendto(header + payload, (self.address, 0))
+        if self._sent < self.count:
+            self.timer = time.time() + self.spacing
+
+    def handle(self, events):
+        try:
+            packet = self.sock.recv(1024)
+        except socket.error as e:
+            self.finish(os.strerror(e.errno) if e.errno else str(e))
+            return 0
+        if len(packet) >= 8 and struct.unpack('!B', packet[:1])[0] == _ICMP_ECHO_REPLY:
+            self.finish()
+            return 0
+        return READ
+
+
+def drive_probes(probes, timeout, max_open=512, deadline=None):
+    """
+    Run probes concurrently, driven by the poll loop of the caller.
+
+    The generator yields (file descriptor -> events, wake-up time) whenever it
+    waits; the dict is changed by the generator, the caller must not keep it.
+    It gets back the list of ready file descriptors, empty if the wake-up time
+    passed, and ends when all probes are done. Closing it fails the running probes.
+
+    :param probes: probes to run
+    :type probes: list
+
+    :param timeout: seconds a single probe may take
+    :type timeout: float
+
+    :param max_open: maximal number of sockets open at the same time
+    :type max_open: int
+
+    :param deadline: unix timestamp after which the probes still running or waiting fail (None: no limit)
+    :type deadline: float
+
+    :return: generator of (dict, float) tuples
+    :rtype: generator
+    """
+    waiting = collections.deque(probe for probe in probes if not probe.done)
+    # file descriptor -> (probe, deadline of the probe), file descriptor -> events the probe waits for
+    running = {}
+    waits = {}
+    ready = []
+    try:
+        while True:
+            for fd in ready:
+                if fd not in running:
+                    continue
+                probe = running[fd][0]
+                try:
+                    waits[fd] = probe.handle(waits[fd])
+                except socket.error as e:
+                    probe.finish(str(e))
+                if probe.done:
+                    del running[fd]
+                    del waits[fd]
+
+            now = time.time()
+            for fd, (probe, probe_deadline) in list(running.items()):
+                if probe_deadline <= now:
+                    probe.finish('no answer within {}s'.format(timeout))
+                elif probe.timer is not None and probe.timer <= now:
+                    try:
+                        probe.tick()
+                    except socket.error as e:
+                        probe.finish(str(e))
+                if probe.done:
+                    del running[fd]
+                    del waits[fd]
+            if deadline is not None and now >= deadline:
+                break
+
+            while len(waiting) > 0 and len(running) < max_open:
+                probe = waiting.popleft()
+                try:
+                    events = probe.start()
+                except socket.error as e:
+                    probe.finish(str(e))
+                    continue
+                if not probe.done:
+                    running[probe.sock.fileno()] = (probe, time.time() + timeout)
+                    waits[probe.sock.fileno()] = events
+            if len(running) == 0:
+                return
+
+            wakeups = [probe_deadline for _, probe_deadline in running.values()]
+            wakeups += [probe.timer for probe, _ in running.values() if probe.timer is not None]
+            if deadline is not None:
+                wakeups.append(deadline)
+            ready = (yield waits, min(wakeups)) or []
+    finally:
+        for probe, _ in running.values():
+            probe.finish('not probed within the timeout of the guard')
+        for probe in waiting:
+            probe.finish('not probed within the timeout of the guard')
+
+
+class ProbeGuard(Watchman):
+    """
+    Base of the guards which probe a list of hosts in-process instead of running a command.
+    The result of a watch lists every host together with the reason of its failure (None if it answered).
+
+    :param name: name of the guard
+    :type name: str
+
+    :param hosts: list of hosts or hostname pattern, e.g. ``'ekpblus[001-400]'``
+    :type hosts: list or str
+
+    :param probe_timeout: seconds a single host may take to answer, also the time the names are resolved in
+    :type probe_timeout: float
+
+    Further keyword arguments like ``interval`` are passed to :class:`Watchman`. Hosts which are
+    not probed within the ``timeout`` of the guard fail.
+    """
+    def __init__(self, name, hosts, probe_timeout=2.0, **kwargs):
+        super(ProbeGuard, self).__init__(name, **kwargs)
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self._hosts = [host for pattern in hosts for host in expand_hosts(pattern)]
+        self._probe_timeout = probe_timeout
+
+    @property
+    def hosts(self):
+        """
+        Get the hosts watched by the guard.
+
+        :return: hosts
+        :rtype: list
+        """
+        return self._hosts
+
+    def _probe(self, host, address):
+        """
+        Create the probe of a host.
+
+        :param host: hostname
+        :type host: str
+
+        :param address: IP address of the host
+        :type address: str
+
+        :return: probe
+        :rtype: _Probe
+        """
+        raise NotImplementedError
+
+    def _probe_command(self, host):
+        """
+        Describe the probe of a host like a command, for the alerts.
+
+        :return: command-like description
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def _probes(self, addresses, errors):
+        """
+        Create the probes of the hosts, the ones of unresolved hosts are done already.
+
+        :param addresses: host -> address
+        :type addresses: dict
+
+        :param errors: host -> reason why it has no address
+        :type errors: dict
+
+        :return: probes
+        :rtype: list
+        """
+        probes = []
+        for host in self._hosts:
+            probe = self._probe(host, addresses.get(host))
+            if host not in addresses:
+                probe.finish(errors.get(host, 'name not resolved'))
+            probes.append(probe)
+        return probes
+
+    @staticmethod
+    def _result(probes, start):
+        out = [(probe.host, probe.error) for probe in probes]
+        return_code = 0 if all(error is None for _, error in out) else 1
+        return Result(return_code, out, '', start, time.time() - start)
+
+    def _steps(self, streaming=True):
+        start = time.time()
+        deadline = None if self._timeout is None else start + self._timeout
+        lookup = _RESOLVER.lookup(self._hosts)
+        end = start + self._probe_timeout
+        pause = 0.001
+        while not lookup.done.is_set() and time.time() < end:
+            yield {}, min(end, time.time() + pause)
+            pause = min(0.1, pause * 2)
+        probes = self._probes(*lookup.results(self._probe_timeout))
+        steps = drive_probes(probes, self._probe_timeout, deadline=deadline)
+        ready = None
+        try:
+            while True:
+                try:
+                    waits, wake = steps.send(ready)
+                except StopIteration:
+                    break
+                fd = yield waits, wake
+                ready = [] if fd is None else [fd]
+        finally:
+            steps.close()
+        yield self._result(probes, start)
+
+    def _format_output(self, out):
+        return '\n'.join('{}: {}'.format(host, 'ok' if error is None else error) for host, error in out)
+
+    def _check_output(self, return_code, out, error):
+        return [(self._name, self._probe_command(host), return_code, 'Host {} failed: {}'.format(host, reason))
+                for host, reason in out if reason is not None]
+
+
+class TcpGuard(ProbeGuard):
+    """
+    Guard connects to a TCP port of every host, e.g. the sge_execd or sshd port.
+
+    :param port: TCP port
+    :type port: int
+    """
+    def __init__(self, name, hosts, port=SGE_EXECD_PORT, **kwargs):
+        super(TcpGuard, self).__init__(name, hosts, **kwargs)
+        self._port = port
+        self.command = ['tcp-connect', str(port)] + self._hosts
+
+    def _probe(self, host, address):
+        return _TcpProbe(host, address, self._port)
+
+    def _probe_command(self, host):
+        return ['tcp-connect', '{}:{}'.format(host, self._port)]
+
+
+class IcmpGuard(ProbeGuard):
+    """
+    Guard pings every host with ICMP echo requests over an unprivileged datagram socket.
+
+    :param count: number of echo requests per host, one reply is enough;
+                  they are spread over the probe_timeout, at most one second apart
+    :type count: int
+    """
+    def __init__(self, name, hosts, count=3, **kwargs):
+        super(IcmpGuard, self).__init__(name, hosts, **kwargs)
+        self._count = count
+        self.command = ['icmp-echo'] + self._hosts
+
+    def _probe(self, host, address):
+        return _IcmpProbe(host, address, self._count, spacing=min(1.0, self._probe_timeout / self._count))
+
+    def _probe_command(self, host):
+        return ['icmp-echo', host]
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Guards which run checks on the exec hosts themselves.
+
+A :class:`RemoteGuard` runs all of its checks on its host in one SSH session.
+The sessions go through OpenSSH control masters (``ControlMaster=auto``), so
+only the first watch of a host pays the SSH handshake. The :class:`SshPool`
+keeps at most ``max_masters`` of them alive and closes the least recently
+used idle ones, a master with running sessions is never closed. Sessions go to
+at most ``max_masters`` hosts at the same time and guards of the same host share
+its master, at most ``max_sessions`` of them run at the same time, the others
+wait. If the guards watch more hosts than ``max_masters``, the masters are opened
+again and again, so ``max_masters`` should cover all watched hosts. A
+:class:`LocalPool` runs the checks locally instead, e.g. for tests.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import logging
+import os
+import re
+import subprocess
+import threading
+
+from watchman.capture import excerpt
+from watchman.squad import Watchman
+
+_logger = logging.getLogger(__name__)
+
+_BEGIN = '__watchman_check_begin__'
+_END = '__watchman_check_end__'
+_CHECK_RESULT = re.compile(r'^{} (\d+)\n(.*?)\n?{} \1 (-?\d+)$'.format(_BEGIN, _END), re.MULTILINE | re.DOTALL)
+
+# return code of ssh if the connection failed
+SSH_FAILED = 255
+
+
+class _Sessions(object):
+    """
+    Counts the sessions per host and bounds them.
+
+    :param max_sessions: maximal number of sessions per host at the same time
+    :type max_sessions: int
+    """
+    def __init__(self, max_sessions):
+        if max_sessions < 1:
+            raise ValueError('max_sessions has to be at least 1, got {}'.format(max_sessions))
+        self._max_sessions = max_sessions
+        self._condition = threading.Condition()
+        self._open = collections.Counter()
+
+    def limit(self, max_sessions):
+        """
+        Change the maximal number of sessions per host, e.g. on a reload of the config.
+
+        :param max_sessions: maximal number of sessions per host at the same time
+        :type max_sessions: int
+        """
+        if max_sessions < 1:
+            raise ValueError('max_sessions has to be at least 1, got {}'.format(max_sessions))
+        with self._condition:
+            self._max_sessions = max_sessions
+            self._condition.notify_all()
+
+    def available(self, host):
+        """
+        Get if a session to a host can be opened without waiting.
+
+        :param host: hostname
+        :type host: str
+
+        :return: True if less than max_sessions sessions are open
+        :rtype: bool
+        """
+        with self._condition:
+            return self._free(host)
+
+    def acquire(self, host):
+        """
+        Open a session to a host, wait while max_sessions sessions are open.
+
+        :param host: hostname
+        :type host: str
+        """
+        with self._condition:
+            while not self._free(host):
+                self._condition.wait()
+            self._open[host] += 1
+
+    def release(self, host):
+        """
+        Close a session to a host.
+
+        :param host: hostname
+        :type host: str
+        """
+        with self._condition:
+            self._open[host] -= 1
+            if self._open[host] <= 0:
+                del self._open[host]
+            self._condition.notify_all()
+
+    def _free(self, host):
+        # called with the condition held
+        return self._open[host] < self._max_sessions
+
+
+class SshPool(_Sessions):
+    """
+    Bounded pool of multiplexed SSH connections, one control master per host.
+
+    :param max_masters: maximal number of control masters kept alive, sessions go to at most
+                        as many hosts at the same time
+    :type max_masters: int
+
+    :param max_sessions: maximal number of sessions per host at the same time,
+                         at most the MaxSessions of the sshd (10 by default)
+    :type max_sessions: int
+
+    :param persist: seconds an idle control master stays alive
+    :type persist: int
+
+    :param control_dir: directory of the control sockets
+    :type control_dir: str
+
+    :param options: further ssh options, e.g. ['-o', 'ConnectTimeout=5']
+    :type options: list
+    """
+    def __init__(self, max_masters=64, persist=300, control_dir='~/.watchman/ssh', options=(), max_sessions=4):
+        super(SshPool, self).__init__(max_sessions)
+        self._max_masters = max_masters
+        self._control_path = os.path.join(os.path.expanduser(control_dir), '%C')
+        if not os.path.isdir(os.path.dirname(self._control_path)):
+            os.makedirs(os.path.dirname(self._control_path), 0o700)
+        self._options = ['-o', 'ControlMaster=auto', '-o', 'ControlPath={}'.format(self._control_path),
+                         '-o', 'ControlPersist={}'.format(persist), '-o', 'BatchMode=yes'] + list(options)
+        self._lock = threading.Lock()
+        self._hosts = collections.OrderedDict()
+        self._closing = []
+        self._thrashing = False
+
+    def limit(self, max_sessions, max_masters=None):
+        """
+        Change the limits of the pool, e.g. on a reload of the config.
+
+        :param max_sessions: maximal number of sessions per host at the same time
+        :type max_sessions: int
+
+        :param max_masters: maximal number of control masters kept alive (None: unchanged)
+        :type max_masters: int
+        """
+        if max_masters is not None:
+            self._max_masters = max_masters
+        # wakes the waiting sessions
+        super(SshPool, self).limit(max_sessions)
+
+    def _free(self, host):
+        if host not in self._open and len(self._open) >= self._max_masters:
+            return False
+        return super(SshPool, self)._free(host)
+
+    def command(self, host, script):
+        """
+        Get the command which runs a script on a host.
+
+        :param host: hostname
+        :type host: str
+
+        :param script: shell script
+        :type script: str
+
+        :return: command
+        :rtype: list
+        """
+        return ['ssh'] + self._options + [host, script]
+
+    def checkout(self, host):
+        """
+        Mark the connection of a host as used and close the least recently used idle ones beyond max_masters.
+
+        :param host: hostname
+        :type host: str
+        """
+        with self._lock:
+            self._hosts.pop(host, None)
+            self._hosts[host] = True
+            with self._condition:
+                idle = [old for old in self._hosts if old not in self._open]
+            evicted = idle[:max(0, len(self._hosts) - self._max_masters)]
+            for old in evicted:
+                del self._hosts[old]
+            if evicted and not self._thrashing:
+                self._thrashing = True
+                _logger.warning('More hosts than max_masters ({}), ssh control masters are closed and opened '
+                                'again.'.format(self._max_masters))
+            self._closing = [process for process in self._closing if process.poll() is None]
+        for old in evicted:
+            self.close(old)
+
+    def close(self, host):
+        """
+        Stop the control master of a host. Does not wait for ssh, it is reaped by a later checkout.
+
+        :param host: hostname
+        :type host: str
+        """
+        _logger.debug('Close ssh control master of {}'.format(host))
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(['ssh', '-o', 'ControlPath={}'.format(self._control_path), '-O', 'exit', host],
+                                       stdin=devnull, stdout=devnull, stderr=devnull)
+        with self._lock:
+            self._closing.append(process)
+
+
+class LocalPool(_Sessions):
+    """
+    Runs the scripts of the RemoteGuards on the local host, no matter which host they are meant for.
+
+    :param max_sessions: maximal number of sessions per host at the same time
+    :type max_sessions: int
+    """
+    def __init__(self, max_sessions=4):
+        super(LocalPool, self).__init__(max_sessions)
+
+    def command(self, host, script):
+        return ['sh', '-c', script]
+
+    def checkout(self, host):
+        pass
+
+    def close(self, host):
+        pass
+
+
+class RemoteGuard(Watchman):
+    """
+    Guard runs several shell checks on a host over one SSH session, every failing check gives its own alert.
+
+    :param name: name of the guard
+    :type name: str
+
+    :param host: hostname
+    :type host: str
+
+    :param checks: check name -> shell command, a check fails if its command exits with a return code other than 0
+    :type checks: collections.OrderedDict
+
+    :param pool: pool of the connections
+    :type pool: SshPool or LocalPool
+
+    Further keyword arguments like ``timeout`` or ``interval`` are passed to :class:`Watchman`.
+    """
+    def __init__(self, name, host, checks, pool, **kwargs):
+        super(RemoteGuard, self).__init__(name, **kwargs)
+        self._host = host
+        self._checks = list(checks.items())
+        self._pool = pool
+        self.command = pool.command(host, self._script())
+
+    @property
+    def host(self):
+        """
+        Get the host of the guard.
+
+        :return: hostname
+        :rtype: str
+        """
+        return self._host
+
+    def _script(self):
+        parts = []
+        for index, (check, command) in enumerate(self._checks):
+            parts.append("printf '{} {}\\n'; ( {} ) </dev/null 2>&1; printf '\\n{} {} %d\\n' $?".format(
+                _BEGIN, index, command, _END, index))
+        return '; '.join(parts)
+
+    def _ready(self):
+        return self._pool.available(self._host)
+
+    def _spawn(self):
+        self._pool.acquire(self._host)
+        try:
+            self._pool.checkout(self._host)
+            return super(RemoteGuard, self)._spawn()
+        except BaseException:
+            self._pool.release(self._host)
+            raise
+
+    def _reaped(self, process):
+        self._pool.release(self._host)
+
+    def _split(self, out):
+        """
+        Split the output of the session into the results of the checks.
+
+        :return: check index -> (return code, output)
+        :rtype: dict
+        """
+        if out is None:
+            return {}
+        if not isinstance(out, (str, bytes)):
+            out = excerpt(out, None)
+        return dict((int(index), (int(return_code), output))
+                    for index, output, return_code in _CHECK_RESULT.findall(out))
+
+    def _format_output(self, out):
+        results = self._split(out)
+        lines = []
+        for index, (check, command) in enumerate(self._checks):
+            if index not in results:
+                lines.append('{}: no result'.format(check))
+                continue
+            return_code, output = results[index]
+            lines.append('{}: {}'.format(check, 'ok' if return_code == 0 else 'failed ({})'.format(return_code)))
+            if output.strip():
+                lines.append(output.rstrip())
+        return '\n'.join(lines)
+
+    def _check_output(self, return_code, out, error):
+        # the messages stay the same from watch to watch, the output is in the report of the result
+        results = self._split(out)
+        if len(results) == 0 and return_code == SSH_FAILED:
+            _logger.warning('SSH to {} failed: {}'.format(self._host, error.strip()))
+            return [(self._name, ['ssh', self._host], return_code, 'SSH to {} failed.'.format(self._host))]
+        alerts = []
+        for index, (check, command) in enumerate(self._checks):
+            if index not in results:
+                alerts.append((self._name, ['ssh', self._host, command], return_code,
+                               'Check {} on {} did not finish.'.format(check, self._host)))
+                continue
+            check_code, output = results[index]
+            if check_code != 0:
+                _logger.info('Check {} on {} failed: {}'.format(check, self._host, excerpt(output.strip(), 512)))
+                alerts.append((self._name, ['ssh', self._host, command], check_code,
+                               'Check {} on {} failed.'.format(check, self._host)))
+        return alerts
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The guards on duty and their jobs, updated in place when the config changes.
+
+A guard is identified by its name, command, parent and its settings (interval,
+timeout, jitter, capture mode, isolation). On a reload only the guards whose
+identity is new get a job, the jobs of the ones which are gone are cancelled and
+the guards are retired, all other guards stay the same objects with their last
+results and keep their rhythm.
+"""
+from __future__ import division, print_function, absolute_import
+
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+
+def _identity(guard):
+    command = guard.command
+    parent = guard.depends_on
+    capture = guard.capture
+    return (guard.name, tuple(command) if isinstance(command, list) else command, guard.interval,
+            None if parent is None else parent.name, guard.timeout, guard.jitter,
+            None if capture is None else str(capture), guard.isolated)
+
+
+class Roster(object):
+    """
+    The guards on duty.
+
+    :param scheduler: Scheduler running the jobs
+    :type scheduler: Scheduler
+
+    :param schedule: callable which creates the job of a guard
+    :type schedule: callable
+
+    :param retire: callable which gets the guards gone from the duty, e.g. to close their alerts
+    :type retire: callable
+    """
+    def __init__(self, scheduler, schedule, retire=None):
+        self._scheduler = scheduler
+        self._schedule = schedule
+        self._retire = retire
+        self._jobs = {}
+        self.guards = []
+
+    def update(self, guards):
+        """
+        Put the given guards on duty: add the new ones, stop the ones which are gone and keep the others.
+
+        :param guards: all guards which should be on duty
+        :type guards: list
+
+        :return: number of added and number of removed guards
+        :rtype: tuple
+        """
+        # the identities are taken before scheduling, which may fill in defaults like the timeout
+        keyed = [(_identity(guard), guard) for guard in guards]
+        wanted = dict(keyed)
+        removed = [key for key in self._jobs if key not in wanted]
+        retired = []
+        for key in removed:
+            guard, job = self._jobs.pop(key)
+            self._scheduler.cancel(job)
+            retired.append(guard)
+        added = [key for key in wanted if key not in self._jobs]
+        for key in added:
+            guard = wanted[key]
+            self._jobs[key] = (guard, self._scheduler.add(self._schedule(guard)))
+        # the list object stays the same, e.g. for the status report
+        self.guards[:] = [self._jobs[key][0] for key, guard in keyed]
+        # kept children depend on the parent of the new config
+        by_name = dict((guard.name, guard) for guard in self.guards)
+        for guard in self.guards:
+            parent = guard.depends_on
+            if parent is not None and by_name.get(parent.name, parent) is not parent:
+                guard.depends_on = by_name[parent.name]
+        # a changed guard keeps its name, it is not retired
+        retired = [guard for guard in retired if guard.name not in by_name]
+        if self._retire is not None and len(retired) > 0:
+            self._retire(retired)
+        return len(added), len(removed)
+
+
+class ConfigWatcher(object):
+    """
+    Reloads the guards when the config file changed or a reload was requested, e.g. on SIGHUP.
+
+    :param path: path of the config file
+    :type path: str
+
+    :param load: callable which loads the guards from the config file
+    :type load: callable
+
+    :param roster: the guards on duty
+    :type roster: Roster
+
+    :param watched: further files whose changes cause a reload, e.g. the guards file
+    :type watched: list
+    """
+    def __init__(self, path, load, roster, watched=()):
+        self._path = path
+        self._load = load
+        self._roster = roster
+        self._watched = [path] + list(watched)
+        self._mtimes = self._stat()
+        self.requested = False
+
+    def check(self, items=None):
+        """
+        Reload the guards if needed. The signature fits a scheduled action.
+        A config which cannot be loaded is logged and the guards are left alone.
+        """
+        try:
+            mtimes = self._stat()
+        except OSError as e:
+            _logger.error('Cannot watch config: {}'.format(e))
+            return
+        if not self.requested and mtimes == self._mtimes:
+            return
+        self.requested = False
+        self._mtimes = mtimes
+        try:
+            guards = self._load(self._path)
+        except Exception:
+            _logger.exception('Could not reload {}, keep the current guards.'.format(self._path))
+            return
+        added, removed = self._roster.update(guards)
+        _logger.info('Reloaded {}: {} guards added, {} removed, {} on duty.'.format(self._path, added, removed,
+                                                                                   len(self._roster.guards)))
+
+    def _stat(self):
+        return [os.path.getmtime(path) for path in self._watched]
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+
+import datetime
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import random
+import select
+import time
+
+from watchman import metrics
+
+_logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """
+    A Job calls its action either every ``interval`` seconds or every day ``at`` a given time.
+
+    Jobs of the same action which are due at the same time are run together:
+    the action is called once with the list of their items.
+
+    :param action: callable which gets the list of due items
+    :type action: callable
+
+    :param item: item handed to the action, e.g. a guard
+    :type item: object
+
+    :param interval: seconds between two runs
+    :type interval: float
+
+    :param jitter: every run is shifted randomly by up to this many seconds
+    :type jitter: float
+
+    :param at: daily run time in the format 'HH:MM'
+    :type at: str
+
+    :param policy: object whose ``current`` interval replaces the interval at every planning,
+                   e.g. an :class:`watchman.cadence.AdaptiveInterval`
+    :type policy: object
+    """
+    def __init__(self, action, item=None, interval=None, jitter=0.0, at=None, policy=None):
+        if (interval is None) == (at is None):
+            raise ValueError('A job needs either an interval or a daily time.')
+        if interval is not None and interval <= 0:
+            raise ValueError('interval has to be positive, got {}'.format(interval))
+        self.action = action
+        self.item = item
+        self.interval = interval
+        self.jitter = jitter
+        self.policy = policy
+        self._at = None if at is None else datetime.datetime.strptime(at, '%H:%M').time()
+        self.base = None
+        self.deadline = None
+        self.cancelled = False
+
+    def plan(self, now, first=False):
+        """
+        Compute the next deadline of the job.
+
+        Interval jobs keep their rhythm: the next base deadline is the last one
+        plus the interval, the jitter is added on top and does not accumulate.
+        Runs which were missed completely are skipped. When the policy changes
+        the interval, the next run is one new interval from now.
+
+        :param now: current time as unix timestamp
+        :type now: float
+
+        :param first: the job was not planned before
+        :type first: bool
+
+        :return: next deadline as unix timestamp
+        :rtype: float
+        """
+        if self._at is not None:
+            today = datetime.datetime.combine(datetime.date.fromtimestamp(now), self._at)
+            deadline = time.mktime(today.timetuple())
+            if deadline <= now:
+                deadline = time.mktime((today + datetime.timedelta(days=1)).timetuple())
+            self.base = self.deadline = deadline
+            return deadline
+
+        if self.policy is not None and self.policy.current != self.interval:
+            # a new interval starts a new rhythm
+            self.interval = self.policy.current
+            first = True
+        if first or self.base is None:
+            self.base = now + self.interval
+        else:
+            self.base += self.interval
+            if self.base <= now:
+                missed = int((now - self.base) // self.interval) + 1
+                _logger.warning('{} is late, skip {} runs.'.format(self, missed))
+                self.base += missed * self.interval
+        self.deadline = self.base + random.uniform(-self.jitter, self.jitter)
+        return self.deadline
+
+    def __str__(self):
+        return '<Job {} every {}>'.format(self.item, self.interval if self._at is None else self._at)
+
+
+class Scheduler(object):
+    """
+    The Scheduler keeps its jobs in a heap ordered by their next deadline
+    and sleeps exactly until the first one is due. :meth:`wake` ends the
+    sleep early through a self-pipe.
+
+    :param clock: function returning the current unix timestamp
+    :type clock: callable
+
+    :param sleep: function sleeping the given number of seconds (None: wait on the self-pipe)
+    :type sleep: callable
+
+    :param slack: jobs due within this many seconds are run together with the due ones
+    :type slack: float
+    """
+    def __init__(self, clock=time.time, sleep=None, slack=1.0):
+        self._clock = clock
+        self._sleep = sleep or self._wait
+        self._slack = slack
+        self._heap = []
+        self._counter = itertools.count()
+        self._woken = []
+        self._calls = []
+        self._wakeup, self._waker = os.pipe()
+        for fd in (self._wakeup, self._waker):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def add(self, job):
+        """
+        Plan a job.
+
+        :param job: the new job
+        :type job: Job
+
+        :return: the job
+        :rtype: Job
+        """
+        job.cancelled = False
+        self._push(job, job.plan(self._clock(), first=True))
+        return job
+
+    def cancel(self, job):
+        """
+        Remove a job. It is dropped when its deadline comes up.
+
+        :param job: planned job
+        :type job: Job
+        """
+        job.cancelled = True
+
+    def wake(self, job):
+        """
+        Run a planned job now, in the loop of :meth:`run_forever`.
+        Only appends to a list and writes to a pipe, so it can be called from
+        a signal handler or another thread.
+
+        :param job: planned job
+        :type job: Job
+        """
+        self._woken.append(job)
+        self._notify()
+
+    def call(self, function):
+        """
+        Call a function once in the loop of :meth:`run_forever`, after the due jobs.
+        Other threads hand work to the thread of the scheduler with it.
+
+        :param function: callable without arguments
+        :type function: callable
+        """
+        self._calls.append(function)
+        self._notify()
+
+    def _notify(self):
+        try:
+            os.write(self._waker, b'.')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise  # a full pipe wakes the loop anyway
+
+    def next_deadline(self):
+        """
+        Get the deadline of the first planned job.
+
+        :return: unix timestamp or None if no job is planned
+        :rtype: float
+        """
+        while len(self._heap) > 0 and not self._valid(*self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def run_pending(self):
+        """
+        Run all jobs which are due and plan their next run.
+
+        :return: seconds until the next job is due or None if there are no jobs
+        :rtype: float
+        """
+        now = self._clock()
+        due = []
+        while len(self._heap) > 0 and self._heap[0][0] <= now + self._slack:
+            entry = heapq.heappop(self._heap)
+            if self._valid(*entry):
+                due.append(entry[2])
+                metrics.SCHEDULER_LAG.observe(max(0.0, now - entry[0]))
+        while len(self._woken) > 0:
+            job = self._woken.pop()
+            if not job.cancelled and job not in due:
+                due.append(job)
+
+        actions = []
+        items = {}
+        for job in due:
+            if job.action not in items:
+                actions.append(job.action)
+                items[job.action] = []
+            items[job.action].append(job.item)
+
+        for action in actions:
+            try:
+                action(items[action])
+            except Exception:
+                _logger.exception('Scheduled action {} failed.'.format(action))
+        while len(self._calls) > 0:
+            function = self._calls.pop(0)
+            try:
+                function()
+            except Exception:
+                _logger.exception('Call of {} failed.'.format(function))
+
+        now = self._clock()
+        for job in due:
+            if not job.cancelled:
+                self._push(job, job.plan(now))
+
+        deadline = self.next_deadline()
+        return None if deadline is None else max(0.0, deadline - self._clock())
+
+    def run_forever(self):
+        """
+        Run the jobs until the process ends.
+        """
+        while True:
+            wait = self.run_pending()
+            if wait is None:
+                _logger.warning('No jobs planned, nothing to do.')
+                return
+            if len(self._woken) == 0 and len(self._calls) == 0:
+                self._sleep(wait)
+
+    def _wait(self, seconds):
+        """
+        Sleep until the timeout passes or :meth:`wake` writes to the self-pipe.
+        """
+        try:
+            select.select([self._wakeup], [], [], seconds)
+        except (select.error, OSError):
+            pass  # interrupted by a signal, its handler may have woken a job
+        try:
+            while os.read(self._wakeup, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _push(self, job, deadline):
+        heapq.heappush(self._heap, (deadline, next(self._counter), job))
+
+    @staticmethod
+    def _valid(deadline, counter, job):
+        # entries of cancelled or re-planned jobs stay in the heap until they come up
+        return not job.cancelled and job.deadline == deadline
@@ -1,19 +1,38 @@
 #!/usr/bin/env
-import numpy
+import collections
 import os
+import re
+import signal
 import subprocess
+import threading
+import time
 
 import datetime
+import io
 
-import xmltodict
-from abc import ABCMeta, abstractmethod, abstractproperty
+from abc import ABCMeta, abstractmethod
 import logging
 import cStringIO
-from email.mime.text import MIMEText
-import smtplib
-import pandas as pd
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from watchman import metrics
+from watchman.capture import Everything, HeadTail, excerpt
+from watchman.poller import Poller, READ
+
 _logger = logging.getLogger(__name__)
 
+# return codes of alerts which are not produced by the command itself
+RC_NOT_FOUND = -999
+RC_TIMEOUT = -998
+RC_CRASHED = -997
+RC_CIRCUIT_OPEN = -996
+
+# result of a command execution
+Result = collections.namedtuple('Result', ['return_code', 'out', 'error', 'timestamp', 'duration'])
+
 
 class Watchman(object):
     """
@@ -22,19 +41,83 @@ class Watchman(object):
     """
     __metaclass__ = ABCMeta
 
-    def __init__(self, name):
+    # number of results kept in memory
+    results_kept = 10
+
+    # bytes of stdout and of stderr shown in a report (None: everything)
+    report_limit = 4096
+
+    # attributes which stay in the daemon when the guard runs in a worker process
+    _process_local = ('_depends_on', '_running', '_results', 'failing', 'skipped_by', 'circuit_open', 'isolation')
+
+    # attributes a worker process hands back to the daemon after a watch, the state the guard keeps between watches
+    _worker_state = ()
+
+    def __init__(self, name, timeout=None, interval=None, jitter=0.0, depends_on=None, capture=None,
+                 isolated=False):
         """
         Initialize a Watchman with a command
 
         :param name: name of the Watchman
         :type name: str
+
+        :param timeout: seconds the command may run before it is killed (None: no limit)
+        :type timeout: float
+
+        :param interval: seconds between two watches (None: interval of the config)
+        :type interval: float
+
+        :param jitter: every watch is shifted randomly by up to this many seconds
+        :type jitter: float
+
+        :param depends_on: parent guard, e.g. the gateway of the hosts. While it fails, the Patrol skips this guard.
+        :type depends_on: Watchman
+
+        :param capture: how stdout of the command is kept, see :mod:`watchman.capture` (None: completely)
+        :type capture: object
+
+        :param isolated: run the command and check its output in a worker process, see :mod:`watchman.isolation`
+        :type isolated: bool
         """
         self._name = name
         self._command = None
+        self._timeout = timeout
+        self.interval = interval
+        self.jitter = jitter
+        self.capture = capture
+        self.isolated = isolated
+        # WorkerPool of an isolated guard, set when it goes on duty
+        self.isolation = None
+        self._depends_on = None
+        self.depends_on = depends_on
+        # set by the Patrol: alerts in the last watch, guard failing upstream when the watch was skipped,
+        # dependent guards are skipped because this guard fails
+        self.failing = False
+        self.skipped_by = None
+        self.circuit_open = False
+        self._running = None
+        self._results = collections.deque(maxlen=self.results_kept)
 
     def __str__(self):
         return '<{}: {}>'.format(self.__class__, self._name)
 
+    def __getstate__(self):
+        # a worker process gets the guard without its parent, results and pool
+        state = self.__dict__.copy()
+        for key in self._process_local:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._depends_on = None
+        self._running = None
+        self._results = collections.deque(maxlen=self.results_kept)
+        self.failing = False
+        self.skipped_by = None
+        self.circuit_open = False
+        self.isolation = None
+
     def guard(self, alerts):
         """
         Start the watch for the Watchman.
@@ -44,42 +127,325 @@ class Watchman(object):
         """
         _logger.debug('{} starts the watch.'.format(self._name))
         _logger.debug('Check command: {}'.format(self._command))
+        if self.isolation is not None:
+            self.isolation.guard(self, alerts)
+            return
+        self._conclude(self._perform(), alerts)
+
+    def watch(self, alerts):
+        """
+        Start the watch as a task of a :class:`watchman.loop.GuardLoop`, the counterpart of :meth:`guard`.
+
+        The generator yields (file descriptors, wake-up time) whenever it waits and
+        gets back the ready file descriptor or None when the time passed. The file
+        descriptors are a list to read from or a dict file descriptor -> events.
+        The steps of the watch come from :meth:`_steps`, isolated guards wait for the
+        answer of their worker process the same way.
+
+        :param alerts: watchman adds his alerts to it
+        :type alerts: list
+        """
+        _logger.debug('{} starts the watch.'.format(self._name))
+        steps = self._steps() if self.isolation is None else self.isolation.steps(self, alerts)
         try:
-            process = subprocess.Popen(self._command, stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE)
-        except OSError as e:
-            _logger.warning('{} not available. Skip it and inform admin'.format(self._command))
-            alerts.append((self._name, self._command, -999, 'Command not found.'))
+            wanted = next(steps)
+            while not isinstance(wanted, Result):
+                wanted = steps.send((yield wanted))
+        except StopIteration:
+            return  # the worker process concluded the watch
+        finally:
+            steps.close()
+        self._conclude(wanted, alerts)
+
+    def _steps(self, streaming=True):
+        """
+        Perform the watch without blocking, the engine of :meth:`watch` and of :meth:`_perform`.
+
+        The command is started and its output collected as it arrives, stdout with
+        the collector of :meth:`_collector`. When the timeout passes, the process group
+        is killed, whether the command still writes or only runs on. Guards which do
+        not run a command (they override :meth:`_perform`) are performed right away.
+
+        :param streaming: let :meth:`_collector` digest stdout, otherwise it is kept as the capture mode says
+        :type streaming: bool
+
+        :return: generator of (file descriptors, wake-up time) tuples, the last item is the Result
+        :rtype: generator
+        """
+        if getattr(self._perform, '__func__', None) is not getattr(Watchman._perform, '__func__', Watchman._perform):
+            yield self._perform()
             return
+        start = time.time()
+        deadline = None if self._timeout is None else start + self._timeout
+        pause = 0.001
+        while not self._ready() and (deadline is None or time.time() < deadline):
+            yield [], time.time() + pause
+            pause = min(0.1, pause * 2)
+        if not self._ready():
+            yield Result(RC_TIMEOUT, '', 'Command could not be started.', start, time.time() - start)
+            return
+        try:
+            process = self._spawn()
+        except OSError:
+            yield Result(RC_NOT_FOUND, '', 'Command not found.', start, 0.0)
+            return
+        run = _Run(process)
+        self._running = run
+        limit = self.report_limit or 4096
+        collectors = {process.stdout.fileno(): (self._collector() if streaming else
+                                                (self.capture or Everything()).collector()),
+                      process.stderr.fileno(): (Everything() if self.capture is None else
+                                                HeadTail(limit // 2, limit - limit // 2)).collector()}
+        out, error = collectors[process.stdout.fileno()], collectors[process.stderr.fileno()]
+        try:
+            while len(collectors) > 0 and not run.killed:
+                fd = yield list(collectors), deadline
+                if fd is None:
+                    run.kill()
+                    break
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    collectors[fd].write(chunk)
+                else:
+                    del collectors[fd]
+            # the command may close its output and run on
+            pause = 0.001
+            while not run.poll():
+                if deadline is not None and time.time() >= deadline:
+                    run.kill()
+                wakeup = time.time() + pause
+                yield [], wakeup if deadline is None or run.killed else min(wakeup, deadline)
+                pause = min(0.1, pause * 2)
+        finally:
+            if not run.poll():
+                run.kill()
+                run.reap()
+            self._running = None
+            process.stdout.close()
+            process.stderr.close()
+            self._reaped(process)
+        return_code = RC_TIMEOUT if run.killed else process.returncode
+        yield Result(return_code, out.value(), error.value(), start, time.time() - start)
 
-        out, error = process.communicate()
-        rc = process.returncode
+    def _collector(self):
+        """
+        Create the collector of stdout for :meth:`_steps`, it gets the output chunk by chunk.
+        Guards which digest their output on the fly override this.
+
+        :return: collector with write(chunk) and value(), see :mod:`watchman.capture`
+        :rtype: object
+        """
+        return (self.capture or Everything()).collector()
+
+    def _conclude(self, result, alerts):
+        """
+        Check a result, add its alerts and keep it.
+
+        :param result: result of the command
+        :type result: Result
+
+        :param alerts: watchman adds his alerts to it
+        :type alerts: list
+        """
+        try:
+            self._raise_alerts(result, alerts)
+        finally:
+            self._record(result)
+
+    def _raise_alerts(self, result, alerts):
+        """
+        Check a result and add the alerts.
+
+        :param result: result of the command
+        :type result: Result
+
+        :param alerts: watchman adds his alerts to it
+        :type alerts: list
+        """
+        if result.return_code == RC_NOT_FOUND:
+            _logger.warning('{} not available. Skip it and inform admin'.format(self._command))
+            alerts.append((self._name, self._command, RC_NOT_FOUND, 'Command not found.'))
+            metrics.GUARD_ALERTS.inc(self._name)
+            return
+        if result.return_code == RC_TIMEOUT:
+            _logger.warning('{} timed out after {}s.'.format(self._command, self._timeout))
+            alerts.append((self._name, self._command, RC_TIMEOUT,
+                           'Command timed out after {}s.'.format(self._timeout)))
+            metrics.GUARD_ALERTS.inc(self._name)
+            return
 
-        own_alerts = self._check_output(rc, out, error)
+        own_alerts = self._check_output(result.return_code, result.out, result.error)
 
         if len(own_alerts) > 0:
             alerts += own_alerts
+            metrics.GUARD_ALERTS.add(len(own_alerts), self._name)
         _logger.debug('Watch ends with {} alerts'.format(len(own_alerts)))
 
-    def report_back(self):
+    def report_back(self, max_age=None):
         """
-        Report back: execute the command and return the output of the command.
+        Report back: return the output of the command.
+        The command is executed unless the last result is younger than ``max_age``.
+
+        :param max_age: seconds a cached result may be old (None: always execute the command)
+        :type max_age: float
 
         :return: output of the command
         :rtype: str
         """
-        _logger.info('Report from {} with command {}.'.format(self._name, self._command))
-        process = subprocess.Popen(self._command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
+        result = self.last_result
+        if max_age is None or result is None or time.time() - result.timestamp > max_age:
+            _logger.info('Report from {} with command {}.'.format(self._name, self._command))
+            result = self._execute(streaming=False)
 
-        out, error = process.communicate()
+        rv = '{} reports on command {} at {}:\n'.format(
+            self._name, self._command, datetime.datetime.fromtimestamp(result.timestamp).strftime('%Y-%m-%d %H:%M:%S'))
+        if result.return_code == RC_NOT_FOUND:
+            return rv + 'Command not found.'
 
-        rv = '{} reports on command {}:\n'.format(self._name, self._command)
-        rv = rv + 'stdout:\n{}\n'.format(out) + \
-             'stderr:\n{}\n'.format(error) + \
-             'Return code: {}'.format(process.returncode)
+        out = self._format_output(result.out)
+        rv = rv + 'stdout:\n{}\n'.format('(no output)' if out is None else excerpt(out, self.report_limit)) + \
+             'stderr:\n{}\n'.format(excerpt(result.error, self.report_limit)) + \
+             'Return code: {}'.format(result.return_code)
+        if result.return_code == RC_TIMEOUT:
+            rv = rv + '\nCommand timed out after {}s.'.format(self._timeout)
         return rv
 
+    @property
+    def last_result(self):
+        """
+        Get the result of the last execution of the command.
+
+        :return: last result or None if the command was not executed yet
+        :rtype: Result
+        """
+        try:
+            return self._results[-1]
+        except IndexError:
+            return None
+
+    @property
+    def results(self):
+        """
+        Get the results of the last executions, the oldest first.
+
+        :return: list of results
+        :rtype: list
+        """
+        return list(self._results)
+
+    def _execute(self, streaming=True):
+        """
+        Execute the command and keep the result.
+
+        :param streaming: let :meth:`_collector` digest stdout while the command runs
+        :type streaming: bool
+
+        :return: result of the command, the return code is RC_NOT_FOUND or RC_TIMEOUT if it did not run through
+        :rtype: Result
+        """
+        return self._record(self._perform(streaming))
+
+    def _record(self, result):
+        """
+        Keep a result and export its metrics. Of a spooled output only the excerpt
+        for the reports is kept, the file is closed.
+
+        :param result: result of the command
+        :type result: Result
+
+        :return: the kept result
+        :rtype: Result
+        """
+        if hasattr(result.out, 'read'):
+            spooled = result.out
+            result = result._replace(out=excerpt(spooled, self.report_limit))
+            spooled.close()
+        self._results.append(result)
+        metrics.GUARD_DURATION.observe(result.duration, self._name)
+        metrics.GUARD_EXIT_CODE.set(result.return_code, self._name)
+        return result
+
+    def _perform(self, streaming=True):
+        """
+        Execute the command on this thread, driving :meth:`_steps` until the result is there.
+
+        :param streaming: let :meth:`_collector` digest stdout while the command runs
+        :type streaming: bool
+
+        :return: result of the command
+        :rtype: Result
+        """
+        return run_steps(self._steps(streaming))
+
+    def _format_output(self, out):
+        """
+        Format the stdout of a result for a report.
+
+        :param out: stdout as returned by :meth:`_collector` or the complete stdout
+        :type out: str
+
+        :return: stdout for the report
+        :rtype: str
+        """
+        return out
+
+    def abort(self):
+        """
+        Kill the running command of the Watchman together with its process group,
+        or the worker process of an isolated guard.
+        """
+        if self.isolation is not None:
+            self.isolation.abort(self)
+        running = self._running
+        if running is not None:
+            running.kill()
+
+    def _ready(self):
+        """
+        Get if the command can be started right now. The loop of :meth:`watch` waits
+        until it can, :meth:`_spawn` may block instead.
+
+        :return: True if :meth:`_spawn` would not block
+        :rtype: bool
+        """
+        return True
+
+    def _spawn(self):
+        """
+        Start the command in its own process group.
+
+        :return: the started process
+        :rtype: subprocess.Popen
+        """
+        return subprocess.Popen(self._command, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, preexec_fn=os.setsid)
+
+    def _reaped(self, process):
+        """
+        Called after the process of :meth:`_spawn` ended and was reaped.
+
+        :param process: the process
+        :type process: subprocess.Popen
+        """
+        pass
+
+    @staticmethod
+    def _kill(process, killed):
+        """
+        Kill the process group of a command.
+
+        :param process: running command
+        :type process: subprocess.Popen
+
+        :param killed: the kill is recorded in this list
+        :type killed: list
+        """
+        killed.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # already gone
+
     @abstractmethod
     def _check_output(self, return_code, out, error):
         """
@@ -99,6 +465,61 @@ class Watchman(object):
         """
         raise NotImplementedError
 
+    @property
+    def name(self):
+        """
+        Get the name of the Watchman.
+
+        :return: name
+        :rtype: str
+        """
+        return self._name
+
+    @property
+    def depends_on(self):
+        """
+        Get the parent guard.
+
+        :return: parent guard or None
+        :rtype: Watchman
+        """
+        return self._depends_on
+
+    @depends_on.setter
+    def depends_on(self, parent):
+        """
+        Set the parent guard.
+
+        :param parent: parent guard or None
+        :type parent: Watchman
+        """
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is self:
+                raise ValueError('{} cannot depend on itself.'.format(self._name))
+            ancestor = ancestor.depends_on
+        self._depends_on = parent
+
+    @property
+    def timeout(self):
+        """
+        Get the timeout of the command in seconds.
+
+        :return: timeout or None
+        :rtype: float
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        """
+        Set the timeout of the command.
+
+        :param timeout: seconds the command may run before it is killed (None: no limit)
+        :type timeout: float
+        """
+        self._timeout = timeout
+
     @property
     def command(self):
         """
@@ -120,12 +541,88 @@ class Watchman(object):
         self._command = command
 
 
+class _Run(object):
+    """
+    A command started by :meth:`Watchman._steps`. Its process group is only killed
+    until the process is reaped, afterwards the id may belong to another process.
+
+    :param process: running command
+    :type process: subprocess.Popen
+    """
+    def __init__(self, process):
+        self.process = process
+        self.killed = False
+        self._reaped = False
+        self._lock = threading.Lock()
+
+    def kill(self):
+        """
+        Kill the process group, e.g. after the timeout or from the Patrol.
+        """
+        with self._lock:
+            if not self._reaped:
+                Watchman._kill(self.process, [])
+                self.killed = True
+
+    def poll(self):
+        """
+        Reap the process if it ended.
+
+        :return: True if the process ended
+        :rtype: bool
+        """
+        with self._lock:
+            if self.process.poll() is not None:
+                self._reaped = True
+        return self._reaped
+
+    def reap(self):
+        """
+        Wait until the process ended and reap it, it can be killed while waiting.
+        """
+        pause = 0.001
+        while not self.poll():
+            time.sleep(pause)
+            pause = min(0.1, pause * 2)
+
+
+def run_steps(steps, final=None):
+    """
+    Drive the steps of a watch (see :meth:`Watchman.watch`) on this thread until they are done.
+
+    :param steps: generator yielding (file descriptors, wake-up time) tuples
+    :type steps: generator
+
+    :param final: type of the last item of the steps (None: Result)
+    :type final: type
+
+    :return: the last item
+    :rtype: Result
+    """
+    final = Result if final is None else final
+    poller = Poller()
+    registered = {}
+    try:
+        wanted = next(steps)
+        while not isinstance(wanted, final):
+            waits, wakeup = wanted
+            if not isinstance(waits, dict):
+                waits = dict.fromkeys(waits, READ)
+            poller.update(registered, waits)
+            registered = dict(waits)
+            ready = poller.poll(None if wakeup is None else max(0.0, wakeup - time.time()))
+            wanted = steps.send(ready[0][0] if len(ready) > 0 else None)
+        return wanted
+    finally:
+        steps.close()
+
+
 class PingGuard(Watchman):
     """
     Guard watches the ping output to host.
     """
-    def __init__(self, name, host):
-        super(PingGuard, self).__init__(name)
+    def __init__(self, name, host, **kwargs):
+        super(PingGuard, self).__init__(name, **kwargs)
         self.command = ['ping', '-c 4', host]
 
     def _check_output(self, return_code, out, error):
@@ -135,31 +632,347 @@ class PingGuard(Watchman):
             return [(self._name, self.command, return_code, error)]
 
 
+_HOST_RANGE = re.compile(r'\[([^\]]+)\]')
+
+
+def expand_hosts(pattern):
+    """
+    Expand a hostname pattern with ranges to a list of hosts.
+
+    ``ekpblus[001-003,007]`` becomes ``['ekpblus001', 'ekpblus002', 'ekpblus003', 'ekpblus007']``.
+    The width of the lower bound is kept, so leading zeros survive.
+    Several ranges in one pattern are expanded to their cartesian product.
+
+    :param pattern: hostname or hostname pattern
+    :type pattern: str
+
+    :return: list of hostnames
+    :rtype: list
+    """
+    match = _HOST_RANGE.search(pattern)
+    if match is None:
+        return [pattern]
+
+    head, tail = pattern[:match.start()], pattern[match.end():]
+    hosts = []
+    for part in match.group(1).split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            width = len(first)
+            numbers = ['{:0{}d}'.format(i, width) for i in range(int(first), int(last) + 1)]
+        else:
+            numbers = [part]
+        for number in numbers:
+            hosts += expand_hosts(head + number + tail)
+    return hosts
+
+
+class MultiPingGuard(Watchman):
+    """
+    Guard pings many hosts with one fping process.
+
+    fping probes all hosts in parallel and lists the unreachable ones,
+    so a whole group of hosts costs a single fork/exec per sweep.
+
+    :param name: name of the guard
+    :type name: str
+
+    :param hosts: list of hosts or hostname pattern, e.g. ``'ekpblus[001-400]'``
+    :type hosts: list or str
+
+    :param retries: number of retries for every host
+    :type retries: int
+
+    Further keyword arguments like ``timeout`` or ``interval`` are passed to :class:`Watchman`.
+    """
+    def __init__(self, name, hosts, retries=3, **kwargs):
+        super(MultiPingGuard, self).__init__(name, **kwargs)
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self._hosts = [host for pattern in hosts for host in expand_hosts(pattern)]
+        self.command = ['fping', '-u', '-r', str(retries)] + self._hosts
+
+    @property
+    def hosts(self):
+        """
+        Get the hosts watched by the guard.
+
+        :return: hosts
+        :rtype: list
+        """
+        return self._hosts
+
+    def _check_output(self, return_code, out, error):
+        # rc 1: some hosts unreachable, rc 2: some hosts not resolvable, rc > 2: fping failed
+        if return_code == 0:
+            return []
+        if return_code > 2:
+            return [(self._name, self.command, return_code, error)]
+
+        alerts = []
+        for line in out.splitlines():
+            host = line.strip()
+            if host:
+                alerts.append((self._name, ['fping', host], return_code, 'Host {} is unreachable.'.format(host)))
+        for line in error.splitlines():
+            host, _, message = line.partition(':')
+            if host.strip() in self._hosts:
+                alerts.append((self._name, ['fping', host.strip()], return_code, message.strip()))
+        return alerts
+
+
+class XmlItems(object):
+    """
+    Collector which parses xml output chunk by chunk as it arrives, see :mod:`watchman.capture`.
+
+    The parser builds no tree, its target picks the items out of the parser
+    events and collects them in its list ``items``.
+
+    :param target: parser target with start, data, end and close
+    :type target: object
+    """
+    def __init__(self, target):
+        self._target = target
+        self._parser = ElementTree.XMLParser(target=target)
+        self._error = None
+
+    def write(self, chunk):
+        if self._error is None:
+            try:
+                self._parser.feed(chunk)
+            except ElementTree.ParseError as e:
+                self._error = e
+
+    def value(self):
+        """
+        Finish the parse.
+
+        :return: the items or None if the output is no valid xml
+        :rtype: list
+        """
+        if self._error is None:
+            try:
+                self._parser.close()
+            except ElementTree.ParseError as e:
+                self._error = e
+        if self._error is not None:
+            _logger.warning('Could not parse xml output: {}'.format(self._error))
+            return None
+        return self._target.items
+
+
+def iter_parsed(stream, target):
+    """
+    Parse xml from a stream and yield the items of the target as they are found.
+
+    :param stream: file-like object with the xml output
+    :type stream: file
+
+    :param target: parser target which collects its items in the list ``items``
+    :type target: object
+
+    :return: generator of the items
+    :rtype: generator
+
+    :raises ElementTree.ParseError: if the output is no valid xml
+    """
+    parser = ElementTree.XMLParser(target=target)
+    for chunk in iter(lambda: stream.read(65536), b''):
+        parser.feed(chunk)
+        for item in target.items:
+            yield item
+        del target.items[:]
+    parser.close()
+    for item in target.items:
+        yield item
+    del target.items[:]
+
+
+class QueueTarget(object):
+    """
+    Parser target which picks the queue instances out of ``qstat -f -xml`` output.
+
+    Only the given fields of every ``Queue-List`` element are kept, job lists and
+    all other elements are never built, so the memory stays flat regardless of
+    the number of jobs.
+
+    :param fields: tags of the Queue-List children to keep
+    :type fields: tuple
+
+    :param make: function turning the dict of the fields of a queue into the item (None: keep the dict)
+    :type make: callable
+    """
+    def __init__(self, fields=('name', 'state'), make=None):
+        self.items = []
+        self._fields = fields
+        self._make = make
+        self._tags = []
+        self._queue = None
+        self._text = None
+
+    def start(self, tag, attrib):
+        if tag == 'Queue-List':
+            self._queue = {}
+        elif self._queue is not None and tag in self._fields and self._tags[-1] == 'Queue-List':
+            self._text = []
+        self._tags.append(tag)
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        self._tags.pop()
+        if tag == 'Queue-List' and self._queue is not None:
+            self.items.append(self._queue if self._make is None else self._make(self._queue))
+            self._queue = None
+        elif self._text is not None:
+            self._queue[tag] = ''.join(self._text) or None
+            self._text = None
+
+    def close(self):
+        return self.items
+
+
+def iter_queues(stream, fields=('name', 'state')):
+    """
+    Read the queue instances from ``qstat -f -xml`` output as it streams in, see :class:`QueueTarget`.
+
+    :param stream: file-like object with the xml output
+    :type stream: file
+
+    :param fields: tags of the Queue-List children to keep
+    :type fields: tuple
+
+    :return: generator of dicts with the fields found for every queue instance
+    :rtype: generator
+    """
+    return iter_parsed(stream, QueueTarget(fields))
+
+
+def _queue_state(queue):
+    return queue.get('name'), queue.get('state')
+
+
+def iter_queue_states(stream):
+    """
+    Read name and state of the queue instances from ``qstat -f -xml`` output as it streams in.
+
+    :param stream: file-like object with the xml output
+    :type stream: file
+
+    :return: generator of (queue name, state) tuples, state is None if the queue has none
+    :rtype: generator
+    """
+    for queue in iter_queues(stream):
+        yield _queue_state(queue)
+
+
 class QstatFGuard(Watchman):
     """
     Guard to control the qhost command output
+
+    The guard keeps the states of the last watch and only re-evaluates the
+    queues whose state changed. Queues entering or leaving an error state are
+    logged and kept in :attr:`transitions`. The alerts name all queues currently
+    in an error state, so the Logbook mails a queue once when it enters the error
+    state and once when it recovers.
     """
-    def __init__(self, name):
-        super(QstatFGuard, self).__init__(name)
+    # queue states which make a queue unusable: alarm, unknown and Error
+    error_states = ('a', 'u', 'E')
+
+    _worker_state = ('_states', '_failing', '_is_error_state', 'transitions')
+
+    def __init__(self, name, **kwargs):
+        super(QstatFGuard, self).__init__(name, **kwargs)
         self.command = ['qstat', '-f', '-xml']  # trigger xml output
+        # queue name -> state of the last watch, queues in an error state -> their state
+        self._states = {}
+        self._failing = collections.OrderedDict()
+        self._is_error_state = {}
+        # (queue name, old state, new state) of the queues which entered or left an error state in the last watch
+        self.transitions = []
 
-    def _check_output(self, return_code, out, error):
-        alerts = []
-        dict_from_xml = xmltodict.parse(out)
-        df = pd.DataFrame(dict_from_xml['job_info']['queue_info']['Queue-List'])
+    def _collector(self):
+        """
+        Parse the queue states while qstat writes its output.
 
-        if 'state' in df:
-            error_queues = []
-            states = df['state'].dropna().unique()
-            for state in states:
-                state = str(state)
-                if 'a' in state or 'u' in state or 'E' in state:
-                    error_queues += (df[df['state'] == state]['name'].unique().tolist())
+        :return: collector whose value is a list of (queue name, state) tuples or None if the output is no valid xml
+        :rtype: XmlItems
+        """
+        return XmlItems(QueueTarget(make=_queue_state))
 
-            for error_queue in error_queues:
-                alerts.append((self._name, self._command, return_code, 'Queue {} is not available or set to ERROR.'.format(error_queue)))
+    @staticmethod
+    def _parse(out):
+        """
+        Parse complete ``qstat -f -xml`` output.
 
-        return alerts
+        :param out: xml output
+        :type out: str
+
+        :return: list of (queue name, state) tuples or None if the output is no valid xml
+        :rtype: list
+        """
+        if not isinstance(out, bytes):
+            out = out.encode('utf-8')
+        try:
+            return list(iter_queue_states(io.BytesIO(out)))
+        except ElementTree.ParseError:
+            return None
+
+    def _format_output(self, out):
+        if isinstance(out, list):
+            return '\n'.join('{} {}'.format(name, state or '') for name, state in out)
+        return out
+
+    def _is_error(self, state):
+        """
+        Check if a state makes a queue unusable, cached per state string.
+        """
+        if state is None:
+            return False
+        if state not in self._is_error_state:
+            self._is_error_state[state] = any(error_state in state for error_state in self.error_states)
+        return self._is_error_state[state]
+
+    def _update(self, out):
+        """
+        Update the states with the queues of a watch, only changed queues are evaluated.
+
+        :param out: list of (queue name, state) tuples
+        :type out: list
+        """
+        states = dict(out)
+        changed = [name for name, state in states.items() if self._states.get(name, '') != state]
+        transitions = []
+        for name in changed:
+            state = states[name]
+            if self._is_error(state):
+                if name not in self._failing:
+                    transitions.append((name, self._states.get(name), state))
+                self._failing[name] = state
+            elif name in self._failing:
+                del self._failing[name]
+                transitions.append((name, self._states.get(name), state))
+        for name in [name for name in self._failing if name not in states]:
+            transitions.append((name, self._failing.pop(name), None))
+        self._states = states
+        self.transitions = transitions
+        for name, old, new in transitions:
+            if name in self._failing:
+                _logger.info('Queue {} entered error state {}.'.format(name, new))
+            else:
+                _logger.info('Queue {} recovered from state {}.'.format(name, old))
+
+    def _check_output(self, return_code, out, error):
+        if out is not None and not isinstance(out, list):
+            out = self._parse(out)
+        if out is None:
+            return [(self._name, self._command, return_code, 'Could not parse qstat output. {}'.format(error))]
+
+        self._update(out)
+        return [(self._name, self._command, return_code, 'Queue {} is not available or set to ERROR.'.format(name))
+                for name in self._failing]
 
 
 class RadioOperator(object):
@@ -174,8 +987,14 @@ class RadioOperator(object):
 
     :param admin_mail: Address of the admin
     :type admin_mail: str
+
+    :param courier: Courier which delivers the mails in the background (None: send directly)
+    :type courier: Courier
+
+    :param digest_window: alerts arriving within this many seconds are sent as one mail (0: send at once)
+    :type digest_window: float
     """
-    def __init__(self, name, from_mail, admin_mail):
+    def __init__(self, name, from_mail, admin_mail, courier=None, digest_window=0):
         self._name = name
         self._from_mail = from_mail
 
@@ -184,6 +1003,10 @@ class RadioOperator(object):
         else:
             self._admin_mail = admin_mail
         self._host = os.getenv('HOST') if os.getenv('HOSTNAME') is None else os.getenv('HOSTNAME')
+        self._courier = courier
+        self._digest_window = digest_window
+        self._digest = []
+        self._digest_lock = threading.Lock()
 
     def _create_message(self, alerts):
         """
@@ -195,6 +1018,7 @@ class RadioOperator(object):
         :return: message with from, to and subject
         :rtype: MIMEText
         """
+        from email.mime.text import MIMEText
         _logger.debug('Create message')
         mail = cStringIO.StringIO()
         mail.write('Dear Admin,\n\nat {} some errors occurred:\n\n'.format(datetime.
@@ -216,24 +1040,78 @@ class RadioOperator(object):
     def send_alerts(self, alerts):
         """
         Send an alerts to the admin via email.
+        With a digest window, the alerts are collected and sent together when the window closes.
 
         :param alerts: list of alerts
         :type alerts: list
         """
+        if self._digest_window > 0:
+            with self._digest_lock:
+                if len(self._digest) == 0:
+                    timer = threading.Timer(self._digest_window, self._send_digest)
+                    timer.daemon = True
+                    timer.start()
+                self._digest += alerts
+            return
+
         _logger.info('Send alert message to {}'.format(self._admin_mail))
         message = self._create_message(alerts)
 
         self._send_mail(message)
 
+    def _send_digest(self):
+        """
+        Send all alerts collected in the digest window as one mail.
+        """
+        with self._digest_lock:
+            alerts, self._digest = self._digest, []
+        if len(alerts) > 0:
+            _logger.info('Send digest with {} alerts to {}'.format(len(alerts), self._admin_mail))
+            self._send_mail(self._create_message(alerts))
+
+    def send_recoveries(self, recoveries):
+        """
+        Tell the admin that former alerts are resolved.
+
+        :param recoveries: list of alerts which are not observed any more
+        :type recoveries: list
+        """
+        from email.mime.text import MIMEText
+        _logger.info('Send recovery message to {}'.format(self._admin_mail))
+        mail = cStringIO.StringIO()
+        mail.write('Dear Admin,\n\nat {} some errors are resolved:\n\n'.format(datetime.
+                                                                            datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        for recovery in recoveries:
+            mail.write('Guard {} with command {} does not observe return state {} and error message {} anymore.\n'.format(*recovery))
+        mail.write('\n\nOver and out.\n')
+
+        message = MIMEText(mail.getvalue())
+        message['From'] = self._from_mail
+        message['To'] = self._get_admin_address()
+        message['Subject'] = 'Resolved errors on host {}'.format(self._host)
+
+        self._send_mail(message)
+
     def _send_mail(self, message):
         """
         Send the mail
         :param message: actual message
         :type message: MIMEText
         """
-        sender = smtplib.SMTP('localhost')
-        sender.sendmail(message['From'], self._admin_mail, message.as_string())
-        sender.quit()
+        if self._courier is not None:
+            self._courier.post(message['From'], self._admin_mail, message.as_string())
+            return
+
+        import smtplib
+        start = time.time()
+        try:
+            sender = smtplib.SMTP('localhost')
+            sender.sendmail(message['From'], self._admin_mail, message.as_string())
+            sender.quit()
+        except Exception:
+            metrics.SMTP_FAILURES.inc()
+            raise
+        metrics.SMTP_DURATION.observe(time.time() - start)
 
     def _get_admin_address(self):
         """
@@ -257,6 +1135,7 @@ class RadioOperator(object):
         """
         _logger.info('Send status report to {}'.format(self._admin_mail))
 
+        from email.mime.text import MIMEText
         report = 'Dear Admin,\n here comes the daily status report:\n\n:' + report
 
         message = MIMEText(report)